@@ -2,8 +2,12 @@
 from nfc_wrapper import *
 from nfc_helper import *
 from libnfc_ffi.libnfc_ffi import libnfc as nfc
-from time import time, sleep
+from relay_stats import *
+from output_redirect import progress
+from hook_workers import ObserverPool, DeadlineHook, close_hook
+from time import time, sleep, monotonic_ns
 from enum import Enum
+import concurrent.futures
 
 import logging
 logger = logging.getLogger(__name__)
@@ -22,6 +26,11 @@ def time_ms():
 def data_hook_default(direction, data, easy_framing):
     send_fragmented = False
     return send_fragmented, data
+# read-only hooks get the received buffer as is, others get a mutable copy
+data_hook_default.readonly = True
+
+DEFAULT_FRAGMENT_SIZE = 134
+IBLOCK_OVERHEAD = 3 # PCB + CRC of the chained I-blocks sent to the reader
 
 class MitmState(Enum):
     FromReader = 0
@@ -33,9 +42,15 @@ class MitmState(Enum):
 
 
 class NFCRelay:
-    def __init__(self, initiator_dev_num, target_dev_num, easy_framing=True, log_fname=None, verbose=True):
+    def __init__(self, initiator_dev_num, target_dev_num, easy_framing=True, log_fname=None, verbose=True, stream_log=True, context=None, max_frames=None):
+        # initiator_dev_num/target_dev_num: index in list_devices() or a connstring
+        # context: libnfc context (nfc_wrapper.NfcContext().c) for this relay, the module one by default
+        # max_frames: frames kept in memory by the frame log, older ones are spilled to <log_fname>.spill.nfcb
         self.verbose = verbose
+        self.context = context
+        self.stream_log = stream_log # append frames to <log_fname>.jsonl while relaying
         self.data_hook = data_hook_default
+        self.observers = None # ObserverPool of add_observer()
         self.initiator_dev_num = initiator_dev_num 
         self.target_dev_num = target_dev_num 
         self.easy_framing = easy_framing
@@ -47,23 +62,90 @@ class NFCRelay:
         self.target_modulation = None
         self.targettype = None
         self.timeout = 2000
-        self.fl = FrameLogger(easy_framing=easy_framing, log_fname=log_fname)
+        self.fl = FrameLogger(easy_framing=easy_framing, log_fname=log_fname, max_frames=max_frames)
+        self.stats = RelayStats()
+        self.fwt_ms = None # frame waiting time advertised by the emulated ATS
+        # ISO-DEP chaining to the reader: FSCI advertised in the emulated ATS (8 => FSC=256), FSD from the reader's RATS
+        self.fsci = 5
+        self.reader_fsd = None
+        self.fragment_size = DEFAULT_FRAGMENT_SIZE # I-block payload when the RATS was not seen
+        # S(WTX) keep-alive while the card or a hook is slow, non easy framing mode only
+        self.wtx_enabled = True
+        self.wtxm = 4 # FWT multiplier requested with every S(WTX)
+        self.wtx_guard = 0.5 # send S(WTX) when less than this fraction of FWT is left
+        self._wtx_executor = None
+        self._wtx_rx = bytearray(8)
+        self._wtx_deadline_ns = 0
+        self._wtx_sent = 0 # S(WTX) requests sent during the current exchange
+        self._reader_cid = None
+        self._fragment_rx = None # reassembly buffer of target_receive_fragmented()
         self.apple_transport = False
-        self.dev_list = list_devices(False)
-        if len(self.dev_list) < 2:
-            assert False, "Not enough devices found"
-        if self.initiator_dev_num >= 0: # -1 is used for log replay
-            self.initiator_dev = self.dev_list[self.initiator_dev_num]
-        else:
-            self.initiator_dev = None
-        self.target_dev = self.dev_list[self.target_dev_num]
+        self.dev_list = []
+        if isinstance(initiator_dev_num, int) or isinstance(target_dev_num, int):
+            # replay mode (initiator -1) only needs the emulator, the scan stops after the devices needed
+            needed = max(d for d in (initiator_dev_num, target_dev_num) if isinstance(d, int)) + 1
+            self.dev_list = list_devices(False, context=self.context, max_devices=needed)
+            if len(self.dev_list) < needed:
+                assert False, "Not enough devices found"
+        self.initiator_dev = self.resolve_dev(self.initiator_dev_num)
+        self.target_dev = self.resolve_dev(self.target_dev_num)
 
     def __del__(self):
         pass
 
-    def set_data_hook(self, data_hook):
+    def resolve_dev(self, dev):
+        if isinstance(dev, (str, bytes)):
+            return dev.encode() if isinstance(dev, str) else dev
+        if dev < 0: # -1 is used for log replay
+            return None
+        return self.dev_list[dev]
+
+    def close(self):
+        """Close both devices, e.g. before the relay's own libnfc context is released"""
+        for dev in (self.pndTag, self.pndReader):
+            if isinstance(dev, NfcDevice):
+                dev.close()
+        if self.observers is not None:
+            self.observers.close()
+        close_hook(self.data_hook)
+        self.data_hook = data_hook_default
+        self.pndTag = None
+        self.pndReader = None
+
+    def set_data_hook(self, data_hook, deadline_ms=None):
+        # data_hook(direction, data, easy_framing) -> (send_fragmented, data), data None drops the frame
+        # deadline_ms: forward the original frame when the hook takes longer (see hook_workers.py)
+        # the relay owns its hook: the one replaced is closed (DeadlineHook workers, RuleEngine reload thread...)
+        if self.data_hook is not data_hook:
+            close_hook(self.data_hook)
+        if deadline_ms is not None:
+            data_hook = DeadlineHook(data_hook, deadline_ms, stats=self.stats)
         self.data_hook = data_hook
 
+    def add_observer(self, observer, processes=False, workers=1):
+        """observer(direction, data, easy_framing) gets a copy of every received frame on a worker pool, off the relay path"""
+        if self.observers is None:
+            self.observers = ObserverPool(workers=workers, processes=processes)
+        self.observers.add(observer)
+        return self.observers
+
+    def observe(self, direction, data):
+        if self.observers is not None:
+            self.observers.submit(direction, data, self.easy_framing)
+
+    def set_data_rules(self, rules_fname, reload_interval=1.0):
+        """Apply the match/mutate rules of rules_fname (see hook_rules.py) before the data hook set so far"""
+        from hook_rules import RuleEngine
+        next_hook = self.data_hook if self.data_hook is not data_hook_default else None
+        self.data_hook = RuleEngine(rules_fname, next_hook=next_hook, reload_interval=reload_interval)
+        return self.data_hook
+
+    def hook_data(self, data):
+        """Data as handed to the hook: a bytearray copy unless the hook is marked with hook.readonly = True"""
+        if getattr(self.data_hook, 'readonly', False):
+            return data
+        return bytearray(data)
+
     # def reader_setup(self):
     #     self.pndReader = NfcInitiator(self.initiator_dev, verbosity=0)
     #     self.pndReader.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
@@ -81,7 +163,7 @@ class NFCRelay:
             # print("Loaded %d frames" % self.pndReader.get_frame_list_len())
             return False
         else:
-            self.pndReader = NfcInitiator(self.initiator_dev, verbosity=0)
+            self.pndReader = NfcInitiator(self.initiator_dev, verbosity=0, context=self.context)
             self.pndReader.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
             # self.pndReader.configure(NP_AUTO_ISO14443_4, True)
             # self.pndReader.configure_int(NP_TIMEOUT_COMMAND, self.timeout)
@@ -110,7 +192,7 @@ class NFCRelay:
             else:
                 self.attempts_cnt += 1
                 if self.verbose:
-                    print(".", end="", flush=True)
+                    progress()
 
 
         if (start_time + timeout_ms < time_ms()) and (timeout_ms != 0):
@@ -194,15 +276,18 @@ class NFCRelay:
     def emulator_setup(self):
         if self.real_target is None:
             logger.info("Real target is not set")
-            self.pndTag = NfcTarget(self.target_dev)
+            self.pndTag = NfcTarget(self.target_dev, context=self.context, fsci=self.fsci)
             self.emulated_target = self.pndTag.get_target()
         else:
-            self.pndTag = NfcTarget(self.target_dev, self.emulated_target)
+            self.pndTag = NfcTarget(self.target_dev, self.emulated_target, context=self.context, fsci=self.fsci)
 
         if self.pndTag.get_last_err():
             logger.warning("Failed to create target")
             return False
         self.emulated_target = self.pndTag.get_target()
+        self.fwt_ms = self.pndTag.get_fwt_ms()
+        self.reader_fsd = self.pndTag.get_reader_fsd()
+        logger.info("Chaining block size to the reader: {} bytes (FSD {})".format(self.chain_block_size(), self.reader_fsd))
         self.pndTag.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
         # self.pndTag.configure(nfc.NP_AUTO_ISO14443_4, True)
         # self.pndTag.configure_int(nfc.NP_TIMEOUT_COMMAND, self.timeout) # TODO: Does not work
@@ -217,21 +302,33 @@ class NFCRelay:
         state = MitmState.FromReader
         fragmented = False
         self.fl.clear()
+        self.stats.clear()
+        if self.observers is not None:
+            self.observers.reset_counters()
+        rx_done_ns = hook_ns = card_ns = 0
+        if self.stream_log and self.fl.open_stream() is not None:
+            logger.info("Streaming frames to {}".format(self.fl.stream.log_fname))
         logger.info("Starting relay")
         if self.verbose:
             print("Starting relay")
         self.pndTag.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
-        self.pndReader.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
+        self.set_reader_framing()
         start_time = time_ms()
         try:
             while (start_time + timeout_ms > time_ms()) or (timeout_ms == 0) and not is_done:
                 if self.verbose and logging.getLogger().getEffectiveLevel() >= logging.WARNING:
-                    print(".", end="", flush=True)
+                    progress()
 
-                logger.debug("State = {}".format(state))
+                logger.debug("State = %s", state)
 
                 if state == MitmState.FromReader:
-                    target_recvd, ret = self.pndTag.receive_bytes(timeout=timeout_ms)
+                    # target_recvd/reader_recvd are views over the device buffers, the log keeps copies
+                    t = monotonic_ns()
+                    target_recvd, ret = self.pndTag.receive_view(timeout=timeout_ms)
+                    rx_done_ns = monotonic_ns()
+                    self.stats.add(PHASE_READER_RECEIVE, rx_done_ns - t)
+                    hook_ns = 0
+                    self.wtx_start_exchange(rx_done_ns, target_recvd)
                     self.fl.add_frame_by_data(index=index, time=time(), data=target_recvd, result=ret, direction=FrameDirection.FromReader)
                     if ret <= nfc.NFC_SUCCESS:
                         logger.info("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
@@ -240,13 +337,26 @@ class NFCRelay:
                     state = MitmState.ReaderCardHook
 
                 elif state == MitmState.ReaderCardHook:
+                    self.observe(FrameDirection.FromReader, target_recvd)
                     if self.data_hook is not None:
-                        fragmented, target_recvd = self.data_hook(FrameDirection.FromReader, target_recvd, self.easy_framing)
+                        t = monotonic_ns()
+                        fragmented, target_recvd = self.call_with_wtx(index, self.data_hook, FrameDirection.FromReader, self.hook_data(target_recvd), self.easy_framing)
+                        hook_ns += monotonic_ns() - t
+                        if target_recvd is None:
+                            # dropped by the hook: nothing goes to the card, the reader gets no answer
+                            logger.info("Reader frame {} dropped by the data hook".format(index))
+                            self.stats.count("dropped_frames")
+                            index += 2
+                            state = MitmState.FromReader
+                            continue
                     state = MitmState.TransceiveCard
 
-                elif state == MitmState.TransceiveCard: # TODO: implement fragmented transceive
+                elif state == MitmState.TransceiveCard:
                     self.fl.add_frame_by_data(index=index, time=time(), data=target_recvd, result=ret, direction=FrameDirection.ToCard, easy_framing=self.easy_framing)
-                    reader_recvd, ret = self.pndReader.transceive_bytes(target_recvd)
+                    t = monotonic_ns()
+                    reader_recvd, ret = self.call_with_wtx(index, self.card_transceive(target_recvd), target_recvd)
+                    card_ns = monotonic_ns() - t
+                    self.stats.add(PHASE_CARD_TRANSCEIVE, card_ns)
                     index += 1
                     self.fl.add_frame_by_data(index=index, time=time(), data=reader_recvd, result=ret, direction=FrameDirection.FromCard, easy_framing=self.easy_framing)
                     if ret <= nfc.NFC_SUCCESS:
@@ -255,20 +365,34 @@ class NFCRelay:
                         continue
                     state = MitmState.CardReaderHook
                 elif state == MitmState.CardReaderHook:
+                    self.observe(FrameDirection.FromCard, reader_recvd)
                     if self.data_hook is not None:
-                        fragmented, reader_recvd = self.data_hook(FrameDirection.FromCard, reader_recvd, self.easy_framing)
+                        t = monotonic_ns()
+                        fragmented, reader_recvd = self.call_with_wtx(index, self.data_hook, FrameDirection.FromCard, self.hook_data(reader_recvd), self.easy_framing)
+                        hook_ns += monotonic_ns() - t
+                        if reader_recvd is None:
+                            logger.info("Card frame {} dropped by the data hook".format(index))
+                            self.stats.count("dropped_frames")
+                            index += 1
+                            state = MitmState.FromReader
+                            continue
                     state = MitmState.ToReader
 
                 elif state == MitmState.ToReader:                
+                    t = monotonic_ns()
+                    self.record_response_time(t - rx_done_ns, hook_ns, card_ns)
+                    if self.easy_framing and len(reader_recvd) > MAX_EASY_FRAMING_TX:
+                        fragmented = True # too long for the emulator in one frame
                     if fragmented:
                         ret = self.target_send_fragmented(index=index, data=reader_recvd)
                         # state = MitmState.FromReaderFragment
                         state = MitmState.FromReader
                         logger.info("fragmented send is done")
                     else:
-                        ret = self.pndTag.send_bytes(reader_recvd)
+                        ret = self.pndTag.send_from(reader_recvd)
                         self.fl.add_frame_by_data(index=index, time=time(), data=reader_recvd, result=ret, direction=FrameDirection.ToReader, easy_framing=self.easy_framing)
                         state = MitmState.FromReader
+                    self.stats.add(PHASE_EMULATOR_SEND, monotonic_ns() - t)
 
                     index += 1
                     if fragmented:
@@ -281,7 +405,12 @@ class NFCRelay:
 
                 elif state == MitmState.FromReaderFragment:
                     # logger.info("FromReaderFragment")
+                    t = monotonic_ns()
                     target_recvd, ret = self.target_receive_fragmented(timeout=timeout_ms)
+                    rx_done_ns = monotonic_ns()
+                    self.stats.add(PHASE_READER_RECEIVE, rx_done_ns - t)
+                    hook_ns = 0
+                    self.wtx_start_exchange(rx_done_ns)
                     self.easy_framing = True
                     self.pndTag.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
                     self.fl.add_frame_by_data(index=index, time=time(), data=target_recvd, result=ret, direction=FrameDirection.FromReader, easy_framing=self.easy_framing) # returns full frame
@@ -304,12 +433,112 @@ class NFCRelay:
         except AssertionError as error:
             logger.error('???? WTF with the radio frontend ????')
             logger.error(error)
+        finally:
+            self.fl.close_stream()
+            self.count_observers()
+            if self._wtx_executor is not None:
+                self._wtx_executor.shutdown(wait=False)
+                self._wtx_executor = None
+
+    def count_observers(self):
+        if self.observers is not None:
+            for name, n in self.observers.counters().items():
+                self.stats.count(name, n)
 
     def log_print(self):
         self.fl.print()
 
+    def record_response_time(self, response_ns, hook_ns, card_ns):
+        self.stats.add(PHASE_HOOK, hook_ns)
+        self.stats.add(PHASE_RESPONSE, response_ns)
+        self.stats.add(PHASE_OVERHEAD, response_ns - hook_ns - card_ns)
+        if self._wtx_sent:
+            self.stats.count("wtx_exchanges")
+        elif self.fwt_ms is not None and response_ns > self.fwt_ms * 1e6:
+            self.stats.count("fwt_exceeded")
+
+    def wtx_active(self):
+        return self.wtx_enabled and not self.easy_framing and self.fwt_ms is not None
+
+    def wtx_start_exchange(self, rx_done_ns, reader_frame=None):
+        """The reader starts its FWT countdown when its frame has been received"""
+        self._wtx_sent = 0
+        if not self.wtx_active():
+            return
+        self._wtx_deadline_ns = rx_done_ns + int(self.fwt_ms * 1e6)
+        if reader_frame is not None and len(reader_frame) > 1:
+            pcb = ISO14443_PCB(asbyte=reader_frame[0])
+            self._reader_cid = reader_frame[1] if pcb.iblock.hasCID else None
+
+    def call_with_wtx(self, index, func, *args):
+        """Run func(*args) and keep the reader waiting with S(WTX) requests while it runs past the FWT deadline"""
+        if not self.wtx_active():
+            return func(*args)
+        if self._wtx_executor is None:
+            self._wtx_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wtx")
+        future = self._wtx_executor.submit(func, *args)
+        guard_ns = int(self.fwt_ms * self.wtx_guard * 1e6)
+        while True:
+            wait_s = max(0, self._wtx_deadline_ns - guard_ns - monotonic_ns()) / 1e9
+            try:
+                return future.result(timeout=wait_s)
+            except concurrent.futures.TimeoutError:
+                pass
+            if not self.send_wtx(index):
+                # the reader did not take the extension, nothing left to do but wait
+                return future.result()
+
+    def send_wtx(self, index):
+        pcb = ISO14443_PCB(asbyte=0xF2) # S(WTX)
+        if self._reader_cid is not None:
+            pcb.sblock.b4_hasCID = 1
+            frame = bytearray([pcb.asbyte, self._reader_cid, self.wtxm])
+        else:
+            frame = bytearray([pcb.asbyte, self.wtxm])
+        ret = self.pndTag.send_bytes(frame)
+        self.fl.add_frame_by_data(index=index, time=time(), data=frame, result=ret, direction=FrameDirection.ToReader, easy_framing=False)
+        self.stats.count("wtx_requests")
+        self._wtx_sent += 1
+        if ret <= nfc.NFC_SUCCESS:
+            logger.warning("S(WTX) send failed: ({}) {}".format(ret, sErrorMessages[ret]))
+            self.stats.count("wtx_failed")
+            return False
+        # separate rx buffer: the reader frame in the shared one may still be in use by the card transceive
+        resp, ret = self.pndTag.receive_into(self._wtx_rx, timeout=int(self.fwt_ms))
+        self.fl.add_frame_by_data(index=index, time=time(), data=bytearray(resp), result=ret, direction=FrameDirection.FromReader, easy_framing=False)
+        if ret <= nfc.NFC_SUCCESS:
+            logger.warning("S(WTX) response receive failed: ({}) {}".format(ret, sErrorMessages[ret]))
+            self.stats.count("wtx_failed")
+            return False
+        pcb.asbyte = resp[0]
+        if pcb.bits.b7_b8 != 0b11 or pcb.sblock.DESELECT_WTX != 0b11 or resp[-1] & 0x3F != self.wtxm:
+            logger.warning("Unexpected S(WTX) response: {}".format(hexbytes(resp)))
+            self.stats.count("wtx_failed")
+            return False
+        self._wtx_deadline_ns = monotonic_ns() + int(self.fwt_ms * self.wtxm * 1e6)
+        return True
+
+    def stats_summary(self):
+        return self.stats.format_summary(self.fwt_ms)
+
+    def set_reader_framing(self):
+        """Easy framing on the initiator as configured, unless chaining put the card session in raw framing"""
+        if isinstance(self.pndReader, NfcInitiator) and self.pndReader.raw_iso_dep:
+            return # see NfcInitiator.transceive_chained()
+        self.pndReader.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
+
+    def card_transceive(self, apdu):
+        """Card exchange for apdu: ISO-DEP chaining by the initiator for long or extended length APDUs"""
+        if self.easy_framing and isinstance(self.pndReader, NfcInitiator) and self.pndReader.needs_chaining(apdu):
+            return self.pndReader.transceive_chained
+        return self.pndReader.transceive_view
+
     def target_receive_fragmented(self, timeout=0):
-        chunks = []
+        """Chained I-blocks from the reader, acknowledged with R(ACK), reassembled into a preallocated buffer"""
+        if self._fragment_rx is None:
+            self._fragment_rx = bytearray(MAX_CHAINED_LEN)
+        rx = self._fragment_rx
+        rx_len = 0
         is_last_chunk = False
 
         pcb_r = ISO14443_PCB()
@@ -322,16 +551,20 @@ class NFCRelay:
         while not is_last_chunk:
             # sleep fo 0.1 sec to avoid "RF transmission error" on PN532
             # sleep(0.02) ## TODO: doublecheck  if it is necessary
-            recvd, ret = self.pndTag.receive_bytes()
+            recvd, ret = self.pndTag.receive_view()
             # frame_recvd = Frame(index=999, time=time(), data=recvd, result=ret, direction=FrameDirection.FromReader, easy_framing=False)
             # print("Received frame: ")
             # print_frame(frame_recvd)
             if ret <= nfc.NFC_SUCCESS:
                 logger.info("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
                 # print ("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
-                return b'', ret
+                return memoryview(b''), ret
             pcb_r.asbyte = recvd[0]
-            chunks.append(recvd[1:])
+            n = len(recvd) - 1
+            if rx_len + n > len(rx):
+                return memoryview(b''), nfc.NFC_EOVFLOW
+            rx[rx_len:rx_len + n] = recvd[1:]
+            rx_len += n
             is_last_chunk = pcb_r.iblock.chaining == 0
             if not is_last_chunk:
                 # sleep(0.02) ## TODO: doublecheck  if it is necessary
@@ -339,63 +572,53 @@ class NFCRelay:
                 pcb_s.iblock.block_num = pcb_s.iblock.block_num ^ 1 
                 # print("Sent frame: {}".format(bytearray([pcb.asbyte])))
         # self.pndTag.configure(NP_EASY_FRAMING, self.easy_framing)
-        data = b''.join(chunks)
-        return data, len(data)
+        return memoryview(rx)[:rx_len], rx_len
 
 
-    def target_send_fragmented(self, index, data, fragment_size=134):
-        # if fragment_size > 128:
-        #     print("Fragment size can't be more than 0x80")
-        #     return False
-        if len(data) > fragment_size:
-            data_chunks = [data[i:i + fragment_size] for i in range(0, len(data), fragment_size)]
-        else:
-            data_chunks = [data]
-        # print("Source data: {}".format(data))
-        # print("Data chunks: {}".format(data_chunks))
-        # print("Sending {} fragments".format(len(data_chunks)))
+    def chain_block_size(self):
+        """I-block payload for chaining to the reader: its FSD when the RATS was seen, fragment_size otherwise"""
+        if self.reader_fsd is None:
+            return self.fragment_size
+        return min(self.reader_fsd, ISO14443_FSC_MAX) - IBLOCK_OVERHEAD
+
+    def target_send_fragmented(self, index, data, fragment_size=None):
+        """Send data to the reader as chained I-blocks, returns the number of blocks sent (<= 0 on error)"""
+        if fragment_size is None:
+            fragment_size = self.chain_block_size()
         self.easy_framing = False
         self.pndTag.set_property_bool(nfc.NP_EASY_FRAMING, self.easy_framing)
 
+        data = memoryview(data)
         pcb = ISO14443_PCB(asbyte=0x13) # 0x12 - for phone testing (0x13 works for PoS)
-        # block_num = 0
-        for chunk in data_chunks:
-            is_last_chunk = chunk == data_chunks[-1]
-            pcb.iblock.block_num = pcb.iblock.block_num ^ 1 
-            if is_last_chunk: # last chunk
+        blocks = 0
+        start = 0
+        while True:
+            end = start + fragment_size
+            is_last_chunk = end >= len(data)
+            pcb.iblock.block_num = pcb.iblock.block_num ^ 1
+            if is_last_chunk:
                 pcb.iblock.chaining = 0
-            # else:
-
-            frame = bytearray([pcb.asbyte]) + chunk
-            # print("Sending frame: {}".format(frame))
-            # self.pndTag.configure(NP_EASY_FRAMING, False)
+            frame = bytearray([pcb.asbyte]) + data[start:end]
             ret = self.pndTag.send_bytes(frame)
-
+            blocks += 1
             self.fl.add_frame_by_data(index=index, time=time(), data=frame, result=ret, direction=FrameDirection.ToReader, easy_framing=False)
-            # print_frame(self.fl.get_frame_list()[-1])
             if ret <= nfc.NFC_SUCCESS:
                 logger.info("Send to reader result: ({}) {}".format(ret, sErrorMessages[ret]))
-                # print ("Send to reader result: ({}) {}".format(ret, sErrorMessages[ret]))
                 return ret
-            
-            # pcb.iblock.block_num = pcb.iblock.block_num ^ 1 
-            # self.pndTag.configure(NP_EASY_FRAMING, False)
-            if not is_last_chunk:
-                # sleep(0.1)
-                recvd, ret = self.pndTag.receive_bytes(timeout=0)
-                self.fl.add_frame_by_data(index=index, time=time(), data=recvd, result=ret, direction=FrameDirection.FromReader, easy_framing=False)
-                # print_frame(self.fl.get_frame_list()[-1])
-                if ret <= nfc.NFC_SUCCESS:
-                    logger.info("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
-                    # print ("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
-                    return ret
-            else:
-                pass
-            
-            # sleep fo 0.1 sec to avoid "RF transmission error" on PN532
-            # sleep(0.02) # TODO: doublecheck  if it is necessary
+            if is_last_chunk:
+                break
+            # R(ACK) from the reader for the next block
+            recvd, ret = self.pndTag.receive_bytes(timeout=0)
+            self.fl.add_frame_by_data(index=index, time=time(), data=recvd, result=ret, direction=FrameDirection.FromReader, easy_framing=False)
+            if ret <= nfc.NFC_SUCCESS:
+                logger.info("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
+                return ret
+            start = end
 
-        return len(data_chunks)
+        self.stats.count("chained_exchanges")
+        self.stats.count("chained_blocks", blocks)
+        logger.info("Chained {} bytes to the reader in {} blocks of up to {} bytes".format(len(data), blocks, fragment_size))
+        return blocks
 
 
 
@@ -21,3 +21,8 @@ def data_hook(direction, data, easy_framing):
     # logger.info ("Data hook, send_fragmented: %s" % send_fragmented)
     logger.info("Frame direction {}, send_fragmented: {}".format(direction, send_fragmented))
     return send_fragmented, data
+
+
+def observer(direction, data, easy_framing):
+    # runs on an observer worker (nfc_mitm.py -O), off the relay path: slow analysis goes here
+    logger.info("Observed {} frame: {}".format(direction, bytes(data).hex()))
@@ -0,0 +1,189 @@
+#
+#  async_relay.py - asyncio front end for NFCRelay
+#
+'''
+libnfc calls are blocking, they run on a per-relay single-thread executor (cffi
+releases the GIL while libnfc waits on the device), so the event loop stays
+free for other tasks: metrics, log writers, test orchestration.
+
+    r = AsyncNFCRelay(initiator_dev_num=1, target_dev_num=0, log_fname="relay.json")
+    r.set_data_hook(my_coroutine_hook)   # plain callables work too
+    await r.run()
+
+Frames relayed by relay_frames_async() can also be consumed from r.frame_queue
+(an asyncio.Queue, see subscribe()).
+'''
+import asyncio
+import inspect
+import concurrent.futures
+
+from NFCRelay import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncNFCRelay(NFCRelay):
+    def __init__(self, *args, executor=None, **kwargs):
+        NFCRelay.__init__(self, *args, **kwargs)
+        # one thread per relay keeps the libnfc calls on both devices ordered
+        self.executor = executor
+        self._own_executor = executor is None
+        self.frame_queue = None
+
+    def subscribe(self, maxsize=0):
+        """Queue receiving every logged Frame while relay_frames_async() runs"""
+        self.frame_queue = asyncio.Queue(maxsize)
+        return self.frame_queue
+
+    async def run_blocking(self, func, *args):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="nfc_relay")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def close(self):
+        if self._own_executor and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        NFCRelay.close(self) # devices, observers and the data hook
+
+    async def reader_setup_async(self, log_fname=''):
+        return await self.run_blocking(self.reader_setup, log_fname)
+
+    async def reader_get_targets_async(self, timeout_ms=0):
+        return await self.run_blocking(self.reader_get_targets, timeout_ms)
+
+    async def select_target_async(self, tag_index=0):
+        return await self.run_blocking(self.select_target, tag_index)
+
+    async def emulator_setup_async(self):
+        return await self.run_blocking(self.emulator_setup)
+
+    async def call_hook(self, index, direction, data):
+        """Coroutine hooks are awaited on the loop, plain ones run on the executor (with WTX keep-alive if enabled)"""
+        if inspect.iscoroutinefunction(self.data_hook):
+            return await self.data_hook(direction, self.hook_data(data), self.easy_framing)
+        result = await self.run_blocking(self.call_with_wtx, index, self.data_hook, direction, self.hook_data(data), self.easy_framing)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def log_frame(self, index, data, ret, direction, easy_framing=None):
+        self.fl.add_frame_by_data(index=index, time=time(), data=data, result=ret, direction=direction, easy_framing=easy_framing)
+        if self.frame_queue is not None:
+            try:
+                self.frame_queue.put_nowait(self.fl.get_frame(-1))
+            except asyncio.QueueFull:
+                self.stats.count("frame_queue_full")
+
+    async def relay_frames_async(self, timeout_ms=0):
+        """Same exchange flow as NFCRelay.relay_frames(), one libnfc call per executor job"""
+        if self.pndReader is None or self.pndTag is None:
+            logger.warning("Reader or tag not initialized")
+            return False
+        index = 0
+        fragmented = False
+        self.fl.clear()
+        self.stats.clear()
+        if self.observers is not None:
+            self.observers.reset_counters()
+        if self.stream_log and self.fl.open_stream() is not None:
+            logger.info("Streaming frames to {}".format(self.fl.stream.log_fname))
+        logger.info("Starting async relay")
+        await self.run_blocking(self.pndTag.set_property_bool, nfc.NP_EASY_FRAMING, self.easy_framing)
+        await self.run_blocking(self.set_reader_framing)
+        start_time = time_ms()
+        try:
+            while (start_time + timeout_ms > time_ms()) or (timeout_ms == 0):
+                # MitmState.FromReader / FromReaderFragment
+                t = monotonic_ns()
+                if fragmented:
+                    target_recvd, ret = await self.run_blocking(self.target_receive_fragmented, timeout_ms)
+                    self.easy_framing = True
+                    await self.run_blocking(self.pndTag.set_property_bool, nfc.NP_EASY_FRAMING, self.easy_framing)
+                else:
+                    target_recvd, ret = await self.run_blocking(self.pndTag.receive_view, timeout_ms)
+                rx_done_ns = monotonic_ns()
+                self.stats.add(PHASE_READER_RECEIVE, rx_done_ns - t)
+                hook_ns = 0
+                self.wtx_start_exchange(rx_done_ns, None if fragmented else target_recvd)
+                self.log_frame(index, target_recvd, ret, FrameDirection.FromReader, self.easy_framing)
+                if ret <= nfc.NFC_SUCCESS:
+                    logger.info("Receive from reader result: ({}) {}".format(ret, sErrorMessages[ret]))
+                    break
+
+                # MitmState.ReaderCardHook
+                self.observe(FrameDirection.FromReader, target_recvd)
+                if self.data_hook is not None:
+                    t = monotonic_ns()
+                    fragmented, target_recvd = await self.call_hook(index, FrameDirection.FromReader, target_recvd)
+                    hook_ns += monotonic_ns() - t
+                    if target_recvd is None:
+                        logger.info("Reader frame {} dropped by the data hook".format(index))
+                        self.stats.count("dropped_frames")
+                        index += 2
+                        continue
+
+                # MitmState.TransceiveCard
+                self.log_frame(index, target_recvd, ret, FrameDirection.ToCard, self.easy_framing)
+                t = monotonic_ns()
+                reader_recvd, ret = await self.run_blocking(self.call_with_wtx, index, self.card_transceive(target_recvd), target_recvd)
+                card_ns = monotonic_ns() - t
+                self.stats.add(PHASE_CARD_TRANSCEIVE, card_ns)
+                index += 1
+                self.log_frame(index, reader_recvd, ret, FrameDirection.FromCard, self.easy_framing)
+                if ret <= nfc.NFC_SUCCESS:
+                    logger.info("Tag/device transceive result: ({}) {}".format(ret, sErrorMessages[ret]))
+                    break
+
+                # MitmState.CardReaderHook
+                self.observe(FrameDirection.FromCard, reader_recvd)
+                if self.data_hook is not None:
+                    t = monotonic_ns()
+                    fragmented, reader_recvd = await self.call_hook(index, FrameDirection.FromCard, reader_recvd)
+                    hook_ns += monotonic_ns() - t
+                    if reader_recvd is None:
+                        logger.info("Card frame {} dropped by the data hook".format(index))
+                        self.stats.count("dropped_frames")
+                        index += 1
+                        continue
+
+                # MitmState.ToReader
+                t = monotonic_ns()
+                self.record_response_time(t - rx_done_ns, hook_ns, card_ns)
+                if self.easy_framing and len(reader_recvd) > MAX_EASY_FRAMING_TX:
+                    fragmented = True
+                if fragmented:
+                    ret = await self.run_blocking(self.target_send_fragmented, index, reader_recvd)
+                    logger.info("fragmented send is done")
+                else:
+                    ret = await self.run_blocking(self.pndTag.send_from, reader_recvd)
+                    self.log_frame(index, reader_recvd, ret, FrameDirection.ToReader, self.easy_framing)
+                self.stats.add(PHASE_EMULATOR_SEND, monotonic_ns() - t)
+                index += 1
+                if ret <= nfc.NFC_SUCCESS:
+                    logger.info("Send to reader result: ({}) {}".format(ret, sErrorMessages[ret]))
+                    break
+        finally:
+            self.fl.close_stream()
+            self.count_observers()
+            if self._wtx_executor is not None:
+                self._wtx_executor.shutdown(wait=False)
+                self._wtx_executor = None
+        return True
+
+    async def run(self, log_replay=None, tag_timeout_ms=0, relay_timeout_ms=0):
+        """Reader/emulator setup followed by the relay, the asyncio counterpart of nfc_mitm.main()"""
+        try:
+            if await self.reader_setup_async(log_replay):
+                if await self.reader_get_targets_async(tag_timeout_ms) == 0:
+                    logger.warning("No tag/device found")
+                    return False
+                await self.select_target_async()
+            if not await self.emulator_setup_async():
+                logger.warning("Can't open emulator")
+                return False
+            return await self.relay_frames_async(relay_timeout_ms)
+        finally:
+            self.close()
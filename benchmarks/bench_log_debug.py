@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+#
+#  bench_log_debug.py - per-call overhead of the @log_debug instrumentation on the relay path
+#
+import os
+import sys
+import timeit
+import logging
+import functools
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nfc_helper
+from nfc_helper import hexbytes
+
+logger = logging.getLogger(__name__)
+
+APDU = bytearray.fromhex("00a4040007a0000000041010")
+
+
+def legacy_log_debug(func):
+    """@log_debug before the level-aware rewrite: always builds the repr() strings"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        args_repr = [repr(a) for a in args]
+        kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
+        signature = ", ".join(args_repr + kwargs_repr)
+        nfc_helper.logger.debug(f"function {func.__name__}() called with args {signature}")
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except Exception as e:
+            nfc_helper.logger.exception(f"Exception raised in {func.__name__}. exception: {str(e)}")
+            raise e
+    return wrapper
+
+
+class RelayDevice:
+    """Stand-in for NfcTarget/NfcInitiator: the libnfc call is replaced by a no-op"""
+    def __init__(self):
+        self._rxbytes = bytearray(264)
+
+    def plain_send_bytes(self, txbytes, timeout=None):
+        return len(txbytes)
+
+    @legacy_log_debug
+    def legacy_send_bytes(self, txbytes, timeout=None):
+        logger.info('T>I[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
+        return len(txbytes)
+
+    @nfc_helper.log_debug
+    def send_bytes(self, txbytes, timeout=None):
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T>I[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
+        return len(txbytes)
+
+
+def per_call_ns(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+def run(number=200000):
+    logging.getLogger().setLevel(logging.ERROR)
+    dev = RelayDevice()
+    results = {}
+    results["no_instrumentation"] = per_call_ns(lambda: dev.plain_send_bytes(APDU, timeout=0), number)
+    results["legacy_wrapper"] = per_call_ns(lambda: dev.legacy_send_bytes(APDU, timeout=0), number)
+    nfc_helper.configure_log_debug(True)
+    results["wrapper_level_check"] = per_call_ns(lambda: dev.send_bytes(APDU, timeout=0), number)
+    nfc_helper.configure_log_debug(False)
+    results["wrapper_removed"] = per_call_ns(lambda: dev.send_bytes(APDU, timeout=0), number)
+    nfc_helper.configure_log_debug(True)
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark @log_debug per-call overhead with DEBUG/INFO disabled")
+    parser.add_argument("-n", "--number", dest="number", default=200000, type=int, help="Calls per timing run")
+    args = parser.parse_args()
+    results = run(args.number)
+    for name, ns in results.items():
+        print("%-20s %8.0f ns/call" % (name, ns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+#
+#  bench_log_load.py - load time and peak memory of FrameLogger.load_from() vs the previous loader
+#
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nfc_helper import *
+
+
+def make_log(log_fname, n_frames):
+    fl = FrameLogger()
+    directions = [FrameDirection.FromReader, FrameDirection.ToCard, FrameDirection.FromCard, FrameDirection.ToReader]
+    apdu = bytearray.fromhex("00a4040007a0000000041010")
+    resp = bytearray.fromhex("6f1a840ea0000000041010a50888" + "00" * 16 + "9000")
+    for i in range(n_frames):
+        d = directions[i % 4]
+        data = apdu if d in (FrameDirection.FromReader, FrameDirection.ToCard) else resp
+        fl.add_frame_by_data(i // 2, 1700000000.0 + i * 0.01, data, len(data), d)
+    fl.save_to(log_fname)
+
+
+def legacy_load_from(fl, log_fname):
+    """FrameLogger.load_from() before the streaming loader: read, parse, then dumps/loads every frame again"""
+    fl.clear()
+    with open(log_fname, 'r') as f:
+        j = f.read()
+        a = json.loads(j)
+        for frame in a:
+            fl.add_frame(frame_from_json(json.dumps(frame)))
+
+
+def streaming_load_from(fl, log_fname):
+    fl.load_from(log_fname)
+
+
+def streaming_scan(fl, log_fname):
+    """Decode every frame without keeping it (e.g. counting or filtering)"""
+    n = 0
+    for frame in iter_frames(log_fname, direction=FrameDirection.FromCard):
+        n += 1
+    return n
+
+
+def measure(func, log_fname, repeat):
+    best = None
+    for _ in range(repeat):
+        fl = FrameLogger()
+        t0 = time.perf_counter()
+        func(fl, log_fname)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+        del fl
+    fl = FrameLogger()
+    tracemalloc.start()
+    func(fl, log_fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(n_frames=100000, repeat=3, log_fname=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if log_fname is None:
+            log_fname = os.path.join(tmp, "bench_log.json")
+            make_log(log_fname, n_frames)
+        for name, func in (("legacy_load_from", legacy_load_from),
+                           ("load_from", streaming_load_from),
+                           ("iter_frames_scan", streaming_scan)):
+            seconds, peak = measure(func, log_fname, repeat)
+            results[name] = {"seconds": seconds, "peak_bytes": peak}
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark frame log loading")
+    parser.add_argument("-n", "--frames", dest="n_frames", default=100000, type=int, help="Number of frames in the generated log")
+    parser.add_argument("-r", "--repeat", dest="repeat", default=3, type=int, help="Timing repetitions (best is reported)")
+    parser.add_argument("-f", "--filename", dest="log_fname", default=None, type=str, help="Use an existing log instead of a generated one")
+    args = parser.parse_args()
+    results = run(args.n_frames, args.repeat, args.log_fname)
+    base = results["legacy_load_from"]
+    print("%-18s %10s %14s %8s %8s" % ("loader", "time, s", "peak mem, MiB", "speedup", "mem x"))
+    for name, r in results.items():
+        print("%-18s %10.3f %14.1f %8.2f %8.2f" % (name, r["seconds"], r["peak_bytes"] / 2**20,
+                                                 base["seconds"] / r["seconds"], base["peak_bytes"] / r["peak_bytes"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+#  run_benchmarks.py - hot path benchmark suite with machine-readable results and baseline comparison
+#
+'''
+Runs against the simulated libnfc backend (LIBNFC_BACKEND=sim), no hardware needed.
+
+    benchmarks/run_benchmarks.py -o results.json                 # run and save results
+    benchmarks/run_benchmarks.py --save-baseline baseline.json   # record a baseline
+    benchmarks/run_benchmarks.py --baseline baseline.json        # compare, exit code 1 on regression
+'''
+import os
+import io
+import sys
+import json
+import time
+import timeit
+import platform
+import tempfile
+import contextlib
+from argparse import ArgumentParser
+
+os.environ.setdefault("LIBNFC_BACKEND", "sim")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nfc_helper import *
+import bench_log_load
+import bench_log_debug
+
+SELECT_PPSE = bytes.fromhex("00a404000e325041592e5359532e444446303100")
+PPSE_RESP = bytes.fromhex("6f10840e325041592e5359532e44444630319000")
+
+
+def result(value, unit, lower_is_better=True):
+    return {"value": value, "unit": unit, "lower_is_better": lower_is_better}
+
+
+def bench_relay_frames(exchanges):
+    """relay_frames() against simulated devices without latency: pure relay overhead"""
+    from libnfc_ffi import libnfc_sim
+    from NFCRelay import NFCRelay
+    libnfc_sim.configure(devices=[
+        libnfc_sim.SimDevice("sim:emulator", reader=libnfc_sim.VirtualReader([SELECT_PPSE] * exchanges)),
+        libnfc_sim.SimDevice("sim:reader", card=libnfc_sim.VirtualCard({SELECT_PPSE: PPSE_RESP}))])
+    r = NFCRelay(1, 0, verbose=False, stream_log=False)
+    r.reader_setup()
+    r.reader_get_targets()
+    r.select_target()
+    r.emulator_setup()
+    t0 = time.perf_counter()
+    r.relay_frames()
+    dt = time.perf_counter() - t0
+    summary = r.stats.summary()['phases']
+    r.close()
+    libnfc_sim.configure()
+    return {
+        "relay_exchange_us": result(dt / exchanges * 1e6, "us"),
+        "relay_response_p50_us": result(summary['response']['p50_ms'] * 1e3, "us"),
+        "relay_response_p99_us": result(summary['response']['p99_ms'] * 1e3, "us"),
+    }
+
+
+def bench_frame_logger(n_frames):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        log_fname = os.path.join(tmp, "bench_log.json")
+        bench_log_load.make_log(log_fname, n_frames)
+        fl = FrameLogger()
+        fl.load_from(log_fname)
+        results["to_json_s"] = result(min(timeit.repeat(fl.to_json, number=1, repeat=3)), "s")
+        seconds, peak = bench_log_load.measure(bench_log_load.streaming_load_from, log_fname, 3)
+        results["load_from_s"] = result(seconds, "s")
+        results["load_from_peak_mib"] = result(peak / 2**20, "MiB")
+    return results
+
+
+def bench_emulated_initiator(n_frames, lookups=10000):
+    e = EmulatedInitiator()
+    for i in range(0, n_frames, 2):
+        req = bytearray(b"\x00\xb2" + i.to_bytes(3, "big"))
+        e.add_frame_by_data(i, 0.0, req, len(req), FrameDirection.FromReader)
+        e.add_frame_by_data(i + 1, 0.0, bytearray(b"\x90\x00"), 2, FrameDirection.FromCard)
+    last = bytes(e.get_frame(n_frames - 2).data)
+    e.transceive_bytes(last) # builds the index
+    per_call = min(timeit.repeat(lambda: e.transceive_bytes(last), number=lookups, repeat=3)) / lookups
+    return {"replay_lookup_us": result(per_call * 1e6, "us")}
+
+
+def bench_print_frame(n_frames=2000):
+    frames = [Frame(i, 0.0, bytearray(PPSE_RESP), len(PPSE_RESP), FrameDirection.FromCard, i % 2 == 0) for i in range(n_frames)]
+    def render():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for frame in frames:
+                print_frame(frame)
+    per_frame = min(timeit.repeat(render, number=1, repeat=3)) / n_frames
+    return {"print_frame_us": result(per_frame * 1e6, "us")}
+
+
+def bench_log_debug_overhead(number):
+    r = bench_log_debug.run(number)
+    return {
+        "log_debug_wrapper_ns": result(r["wrapper_level_check"], "ns"),
+        "log_debug_removed_ns": result(r["wrapper_removed"], "ns"),
+    }
+
+
+def run(quick=False):
+    scale = 10 if quick else 1
+    results = {}
+    results.update(bench_relay_frames(20000 // scale))
+    results.update(bench_frame_logger(100000 // scale))
+    results.update(bench_emulated_initiator(100000 // scale))
+    results.update(bench_print_frame(2000 // scale))
+    results.update(bench_log_debug_overhead(200000 // scale))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print current vs baseline, return the names that regressed by more than threshold (0.1 = 10%)"""
+    regressions = []
+    print("%-24s %12s %12s %8s" % ("benchmark", "baseline", "current", "change"))
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or base["value"] == 0:
+            print("%-24s %12s %12.3f %8s" % (name, "-", cur["value"], "new"))
+            continue
+        change = cur["value"] / base["value"] - 1
+        if not cur["lower_is_better"]:
+            change = -change
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print("%-24s %12.3f %12.3f %+7.1f%%%s" % (name, base["value"], cur["value"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the relay, logging and replay hot paths")
+    parser.add_argument("-o", "--output", dest="output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", dest="baseline", type=str, help="Compare against a saved baseline, exit 1 on regression")
+    parser.add_argument("-s", "--save-baseline", dest="save_baseline", type=str, help="Save results as the new baseline")
+    parser.add_argument("-t", "--threshold", dest="threshold", default=10.0, type=float, help="Regression threshold in percent. Default: 10")
+    parser.add_argument("-q", "--quick", dest="quick", action='store_true', help="Smaller workloads (10x) for a fast check")
+    args = parser.parse_args()
+
+    current = run(args.quick)
+    out = json.dumps(current, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(out)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold / 100)
+        if regressions:
+            print("Regressions: %s" % ", ".join(regressions))
+            sys.exit(1)
+    elif not args.output:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+#
+#  frame_binlog.py - compact binary container for Frame records (*.nfcb)
+#
+'''
+File layout (all integers little endian):
+
+    header      "NFCB" magic, u16 version, u16 reserved
+    records     per frame: u32 index, f64 time, i32 result, u8 direction,
+                u8 easy_framing, u32 data_len, followed by data_len payload bytes
+    offsets     u64 file offset of every record
+    trailer     u64 frame count, u64 offset table position, "NFCE" magic
+
+The trailer is written on close(). A file without it (crashed session) is
+still readable, the offset table is then rebuilt by walking the records.
+'''
+import os
+import mmap
+import struct
+from array import array
+from argparse import ArgumentParser
+
+from nfc_helper import Frame, FrameDirection, FrameLogger, FRAME_DIRECTIONS, FRAME_DIRECTION_CODES
+
+BINLOG_EXT = ".nfcb"
+BINLOG_MAGIC = b"NFCB"
+BINLOG_END_MAGIC = b"NFCE"
+BINLOG_VERSION = 1
+
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<IdiBBI")
+TRAILER = struct.Struct("<QQ4s")
+
+# same codes as the FrameColumns direction column
+DIRECTIONS = FRAME_DIRECTIONS
+DIRECTION_CODES = FRAME_DIRECTION_CODES
+
+
+def is_binlog(log_fname):
+    return log_fname.endswith(BINLOG_EXT)
+
+
+class BinFrameWriter:
+    def __init__(self, log_fname):
+        self.log_fname = log_fname
+        self._file = open(log_fname, 'w+b') # readable for get_frame()
+        self._file.write(HEADER.pack(BINLOG_MAGIC, BINLOG_VERSION, 0))
+        self._pos = HEADER.size
+        self.offsets = array('Q')
+
+    def write(self, frame):
+        data = frame.data
+        self._file.write(RECORD.pack(frame.index, frame.time, frame.result,
+                                     DIRECTION_CODES[frame.direction], frame.easy_framing, len(data)))
+        self._file.write(data)
+        self.offsets.append(self._pos)
+        self._pos += RECORD.size + len(data)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_frame(self, n):
+        """Read frame n back while the file is still being written (FrameList spill segments)"""
+        self._file.flush()
+        fd = self._file.fileno()
+        pos = self.offsets[n]
+        index, time, result, direction, easy_framing, data_len = RECORD.unpack(os.pread(fd, RECORD.size, pos))
+        data = bytearray(os.pread(fd, data_len, pos + RECORD.size))
+        return Frame(index, time, data, result, DIRECTIONS[direction], bool(easy_framing))
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.write(self.offsets.tobytes())
+        self._file.write(TRAILER.pack(len(self.offsets), self._pos, BINLOG_END_MAGIC))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BinFrameReader:
+    """mmap-backed random access to the frames of a *.nfcb log"""
+    def __init__(self, log_fname):
+        self.log_fname = log_fname
+        with open(log_fname, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != BINLOG_MAGIC:
+            raise ValueError("{} is not a binary frame log".format(log_fname))
+        if version != BINLOG_VERSION:
+            raise ValueError("Unsupported binary frame log version: {}".format(version))
+        self.offsets = self._read_offsets()
+
+    def _read_offsets(self):
+        size = len(self._mm)
+        if size >= HEADER.size + TRAILER.size:
+            count, table_pos, magic = TRAILER.unpack_from(self._mm, size - TRAILER.size)
+            if magic == BINLOG_END_MAGIC:
+                # memoryview cast keeps the table in the mapping instead of copying it
+                return memoryview(self._mm)[table_pos:table_pos + count * 8].cast('Q')
+        # no trailer: walk the records
+        offsets = array('Q')
+        pos = HEADER.size
+        while pos + RECORD.size <= size:
+            data_len = RECORD.unpack_from(self._mm, pos)[5]
+            if pos + RECORD.size + data_len > size:
+                break # truncated last record
+            offsets.append(pos)
+            pos += RECORD.size + data_len
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_data_view(self, n):
+        """Payload of frame n as a memoryview into the mapping (no copy)"""
+        pos = self.offsets[n]
+        data_len = RECORD.unpack_from(self._mm, pos)[5]
+        start = pos + RECORD.size
+        return memoryview(self._mm)[start:start + data_len]
+
+    def get_frame(self, n):
+        pos = self.offsets[n]
+        index, time, result, direction, easy_framing, data_len = RECORD.unpack_from(self._mm, pos)
+        start = pos + RECORD.size
+        data = bytearray(self._mm[start:start + data_len])
+        return Frame(index, time, data, result, DIRECTIONS[direction], bool(easy_framing))
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        return self.get_frame(n)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.get_frame(n)
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.offsets = array('Q')
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_frames(frames, log_fname):
+    with BinFrameWriter(log_fname) as w:
+        for frame in frames:
+            w.write(frame)
+
+
+def convert(src_fname, dst_fname):
+    """Convert between JSON (*.json, *.jsonl) and binary (*.nfcb) logs, direction is taken from the extensions"""
+    fl = FrameLogger()
+    fl.load_from(src_fname)
+    fl.save_to(dst_fname)
+    return fl.get_frame_list_len()
+
+
+def main():
+    parser = ArgumentParser(description="Convert frame logs between JSON and the binary %s format" % BINLOG_EXT)
+    parser.add_argument("src", type=str, help="Input log (*.json, *.jsonl or *%s)" % BINLOG_EXT)
+    parser.add_argument("dst", type=str, help="Output log (*.json or *%s)" % BINLOG_EXT)
+    args = parser.parse_args()
+    n = convert(args.src, args.dst)
+    print("Converted %d frames: %s -> %s" % (n, args.src, args.dst))
+
+
+if __name__ == "__main__":
+    main()
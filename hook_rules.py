@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+#
+#  hook_rules.py - declarative match/mutate rules for the relay data hook
+#
+'''
+Rules are read from a JSON file, a list of objects, applied in file order:
+
+    [
+        {"direction": "FromReader", "pattern": "BA AD", "action": "fragment"},
+        {"direction": "FromCard", "pattern": "6F ?? 84 07 A0000000041010", "action": "patch", "offset": 4, "data": "A0000000031010"},
+        {"direction": "FromReader", "pattern": "80 CA 9F 17", "action": "replace", "data": "80CA9F3600"},
+        {"pattern": "00 B2 01 0C", "mask": "FF FF FF F8", "action": "drop"}
+    ]
+
+    direction   FromReader, FromCard or omitted for both
+    pattern     hex byte prefix of the frame data as the hook gets it (APDU with easy framing,
+                PCB first otherwise), "??" matches any byte
+    mask        optional hex, same length as pattern: data & mask == pattern & mask
+    action      replace (data), patch (offset, data), fragment (send to the reader fragmented)
+                or drop (the frame is not forwarded)
+
+All patterns of a direction compile into one deterministic prefix automaton,
+so matching is a single pass over the frame prefix whatever the number of
+rules. Partially masked bytes are wildcards in the automaton, the few rules
+with one are checked against their mask once the automaton matched them.
+Every matching rule is applied in file order, replace and drop end the chain.
+A background thread checks the file for changes every reload_interval seconds,
+compiles it and swaps the new automata in, the relay thread never waits for
+it; a broken file keeps the previous rules.
+
+    r.set_data_rules("rules.json")   # NFCRelay, chains the data hook set before
+'''
+import os
+import json
+import threading
+from argparse import ArgumentParser
+
+from nfc_helper import FrameDirection
+from hook_workers import close_hook
+
+import logging
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("replace", "patch", "fragment", "drop")
+HOOK_DIRECTIONS = (FrameDirection.FromReader, FrameDirection.FromCard)
+
+
+class Rule:
+    def __init__(self, priority, pattern, mask, action, data=b"", offset=0, direction=None, name=None):
+        self.priority = priority
+        self.pattern = pattern # bytes
+        self.mask = mask       # bytes, same length
+        self.action = action
+        self.data = data
+        self.offset = offset
+        self.direction = direction
+        self.name = name or "rule{}".format(priority)
+        self.hits = 0
+        self.partial = any(0 < m < 0xFF for m in mask) # checked by matches() after the automaton
+
+    def matches(self, data):
+        return len(data) >= len(self.pattern) and all(d & m == p for d, m, p in zip(data, self.mask, self.pattern))
+
+    @classmethod
+    def from_dict(cls, priority, d):
+        pattern, mask = parse_pattern(d['pattern'], d.get('mask'))
+        action = d['action']
+        if action not in ACTIONS:
+            raise ValueError("rule {}: unknown action {!r}".format(priority, action))
+        data = bytes.fromhex(d.get('data', "").replace(" ", ""))
+        if action in ("replace", "patch") and 'data' not in d:
+            raise ValueError("rule {}: {} needs data".format(priority, action))
+        direction = d.get('direction')
+        if direction is not None:
+            direction = FrameDirection(direction)
+        return cls(priority, pattern, mask, action, data, int(d.get('offset', 0)), direction, d.get('name'))
+
+    def __repr__(self):
+        return "Rule({}, {} {}, {})".format(self.name, self.direction, self.pattern.hex(), self.action)
+
+
+def parse_pattern(pattern, mask=None):
+    """Hex pattern with optional "??" wildcards and mask -> (pattern bytes, mask bytes)"""
+    tokens = pattern.replace(" ", "")
+    if len(tokens) % 2 or not tokens:
+        raise ValueError("bad pattern {!r}".format(pattern))
+    values = bytearray()
+    masks = bytearray()
+    for i in range(0, len(tokens), 2):
+        token = tokens[i:i + 2]
+        if token == "??":
+            values.append(0)
+            masks.append(0)
+        else:
+            values.append(int(token, 16))
+            masks.append(0xFF)
+    if mask is not None:
+        explicit = bytes.fromhex(mask.replace(" ", ""))
+        if len(explicit) != len(values):
+            raise ValueError("mask {!r} and pattern {!r} lengths differ".format(mask, pattern))
+        masks = bytearray(a & b for a, b in zip(masks, explicit))
+    return bytes(v & m for v, m in zip(values, masks)), bytes(masks)
+
+
+class _TrieNode:
+    __slots__ = ("children", "any", "rules")
+
+    def __init__(self):
+        self.children = {}
+        self.any = None # child for masked bytes
+        self.rules = []
+
+
+class _State:
+    """Automaton state: next[byte] -> state, default for bytes without an own transition"""
+    __slots__ = ("next", "default", "rules")
+
+    def __init__(self, rules):
+        self.next = {}
+        self.default = None
+        self.rules = rules
+
+
+class RuleAutomaton:
+    """Deterministic prefix automaton over the patterns of a rule list"""
+    def __init__(self, rules):
+        root = _TrieNode()
+        for rule in rules:
+            node = root
+            for value, mask in zip(rule.pattern, rule.mask):
+                if mask == 0xFF:
+                    node = node.children.setdefault(value, _TrieNode())
+                else: # a partial mask is a wildcard here, Rule.matches() checks it
+                    if node.any is None:
+                        node.any = _TrieNode()
+                    node = node.any
+            node.rules.append(rule)
+        self._states = {}
+        self.root = self._state(frozenset([root]))
+        self._states = None
+
+    def _state(self, nodes):
+        # subset construction: a wildcard branch is merged into every byte branch next to it
+        state = self._states.get(nodes)
+        if state is not None:
+            return state
+        rules = sorted({rule for node in nodes for rule in node.rules}, key=lambda rule: rule.priority)
+        state = self._states[nodes] = _State(rules)
+        wild = frozenset(node.any for node in nodes if node.any is not None)
+        for b in {b for node in nodes for b in node.children}:
+            state.next[b] = self._state(frozenset(node.children[b] for node in nodes if b in node.children) | wild)
+        if wild:
+            state.default = self._state(wild)
+        return state
+
+    def match(self, data):
+        """Rules whose pattern prefixes data, in priority order"""
+        state = self.root
+        matched = None
+        for b in data:
+            state = state.next.get(b, state.default)
+            if state is None:
+                break
+            if state.rules:
+                matched = state.rules if matched is None else matched + state.rules
+        if matched is None:
+            return ()
+        if len(matched) > 1:
+            matched.sort(key=lambda rule: rule.priority)
+        return [rule for rule in matched if not rule.partial or rule.matches(data)]
+
+
+class RuleEngine:
+    """Data hook applying the rules of rules_fname, next_hook (a plain data hook) runs after them"""
+    readonly = True # data is only copied when a rule changes it
+
+    def __init__(self, rules_fname=None, rules=None, next_hook=None, reload_interval=1.0):
+        self.rules_fname = rules_fname
+        self.next_hook = next_hook
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._reloader = None
+        self._stop = threading.Event()
+        self.rules = []
+        self.automata = {}
+        if rules_fname is not None:
+            self.load()
+            if reload_interval:
+                self._reloader = threading.Thread(target=self._reload_loop, name="rules-reload", daemon=True)
+                self._reloader.start()
+        else:
+            self.set_rules(rules or [])
+
+    def set_rules(self, rules):
+        if rules and isinstance(rules[0], dict):
+            rules = [Rule.from_dict(priority, d) for priority, d in enumerate(rules)]
+        automata = {direction: RuleAutomaton([r for r in rules if r.direction in (None, direction)])
+                    for direction in HOOK_DIRECTIONS}
+        # compiled first, apply() sees the old automata or the new ones, never a half built set
+        self.rules = rules
+        self.automata = automata
+
+    def load(self):
+        mtime = os.stat(self.rules_fname).st_mtime_ns
+        with open(self.rules_fname) as f:
+            self.set_rules(json.load(f))
+        self._mtime = mtime
+        logger.info("Loaded {} data rules from {}".format(len(self.rules), self.rules_fname))
+
+    def check_reload(self):
+        """Recompile the rules if the file changed, True if it did"""
+        try:
+            mtime = os.stat(self.rules_fname).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime # a broken file is reported once, not on every check
+            self.load()
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Keeping the previous data rules, can't reload {}: {}".format(self.rules_fname, e))
+            return False
+        return True
+
+    def _reload_loop(self):
+        while not self._stop.wait(self.reload_interval):
+            self.check_reload()
+
+    def close(self):
+        """Stop reloading and close next_hook"""
+        self._stop.set()
+        if self._reloader is not None:
+            self._reloader.join()
+            self._reloader = None
+        close_hook(self.next_hook)
+
+    def apply(self, direction, data):
+        """(send_fragmented, data), data is None when the frame is dropped"""
+        fragmented = False
+        automaton = self.automata.get(direction)
+        if automaton is None:
+            return fragmented, data
+        for rule in automaton.match(data):
+            rule.hits += 1
+            logger.info("Data rule {} matched ({})".format(rule.name, rule.action))
+            if rule.action == "fragment":
+                fragmented = True
+            elif rule.action == "patch":
+                data = bytearray(data)
+                end = rule.offset + len(rule.data)
+                if end > len(data):
+                    data.extend(bytes(end - len(data)))
+                data[rule.offset:end] = rule.data
+            elif rule.action == "replace":
+                return fragmented, bytearray(rule.data)
+            elif rule.action == "drop":
+                return False, None
+        return fragmented, data
+
+    def __call__(self, direction, data, easy_framing):
+        fragmented, data = self.apply(direction, data)
+        if data is not None and self.next_hook is not None:
+            if not getattr(self.next_hook, 'readonly', False) and not isinstance(data, bytearray):
+                data = bytearray(data)
+            next_fragmented, data = self.next_hook(direction, data, easy_framing)
+            fragmented = fragmented or next_fragmented
+        return fragmented, data
+
+    def hits(self):
+        return {rule.name: rule.hits for rule in self.rules}
+
+
+def main():
+    parser = ArgumentParser(description="Check a data rules file and show which rules match a frame")
+    parser.add_argument("rules_fname", help="JSON rules file")
+    parser.add_argument("-d", "--direction", dest="direction", default="FromReader", choices=[d.value for d in HOOK_DIRECTIONS])
+    parser.add_argument("frames", nargs="*", help="Hex frames to run through the rules")
+    args = parser.parse_args()
+    engine = RuleEngine(args.rules_fname, reload_interval=None)
+    print("%d rules" % len(engine.rules))
+    for rule in engine.rules:
+        print("\t%s" % rule)
+    for frame in args.frames:
+        fragmented, data = engine(FrameDirection(args.direction), bytes.fromhex(frame), True)
+        print("%s -> %s%s" % (frame, "dropped" if data is None else bytes(data).hex(), " (fragmented)" if fragmented else ""))
+
+
+if __name__ == "__main__":
+    main()
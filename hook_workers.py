@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+#
+#  hook_workers.py - observer hooks off the relay thread and data hooks with a latency budget
+#
+'''
+Two kinds of hooks keep CPU-heavy work out of the reader-visible latency:
+
+    observers   observer(direction, data, easy_framing), return value ignored. Frames are
+                queued to a worker pool (threads, or processes to get away from the GIL),
+                the relay never waits for them. When max_pending frames are queued the
+                newest are dropped and counted.
+    mutators    the data hook, run with a deadline (NFCRelay.set_data_hook(hook, deadline_ms=...)).
+                When it is missed the original frame is forwarded and the miss is counted;
+                the late result is discarded.
+
+    r.add_observer(apdu_processor.observer)              # thread pool
+    r.add_observer(apdu_processor.observer, processes=True)
+    r.set_data_hook(apdu_processor.data_hook, deadline_ms=20)
+'''
+import threading
+import concurrent.futures
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def close_hook(hook):
+    """Close a hook that holds workers or threads (DeadlineHook, RuleEngine...), plain functions are left alone"""
+    close = getattr(hook, 'close', None)
+    if close is not None:
+        close()
+
+
+def run_observers(observers, direction, data, easy_framing):
+    # module level so a process pool can pickle it
+    for observer in observers:
+        observer(direction, data, easy_framing)
+
+
+class ObserverPool:
+    """Feeds frames to observer hooks on a worker pool"""
+    def __init__(self, observers=(), workers=1, processes=False, max_pending=1024):
+        self.observers = list(observers)
+        self.workers = workers
+        self.processes = processes
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def add(self, observer):
+        self.observers.append(observer)
+
+    def start(self):
+        if self._executor is None:
+            if self.processes:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="observer")
+        return self
+
+    def submit(self, direction, data, easy_framing):
+        """Queue a copy of data for the observers, False if it was dropped"""
+        if not self.observers:
+            return False
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self.submitted += 1
+        self.start()
+        future = self._executor.submit(run_observers, tuple(self.observers), direction, bytes(data), easy_framing)
+        future.add_done_callback(self._done)
+        return True
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future.exception() is not None:
+                self.errors += 1
+                logger.error("Observer failed: {}".format(future.exception()))
+
+    def counters(self):
+        with self._lock:
+            return {'observed_frames': self.submitted, 'observer_dropped': self.dropped, 'observer_errors': self.errors}
+
+    def reset_counters(self):
+        with self._lock:
+            self.submitted = self.dropped = self.errors = 0
+
+    def close(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+class DeadlineHook:
+    """Runs data_hook on worker threads and gives up waiting after deadline_ms"""
+    readonly = True # copies the frame itself
+
+    def __init__(self, data_hook, deadline_ms, workers=2, stats=None):
+        self.data_hook = data_hook
+        self.deadline_ms = deadline_ms
+        self.workers = workers # a hook still running after its deadline keeps its worker busy
+        self.stats = stats # RelayStats, misses are counted as hook_deadline_missed
+        self.missed = 0
+        self._executor = None
+
+    def __call__(self, direction, data, easy_framing):
+        """(send_fragmented, data), (False, data) unchanged when the deadline is missed"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hook")
+        # the hook gets its own copy, data may be a view that is reused after a miss
+        future = self._executor.submit(self.data_hook, direction, bytearray(data), easy_framing)
+        try:
+            return future.result(timeout=self.deadline_ms / 1000)
+        except concurrent.futures.TimeoutError:
+            self.missed += 1
+            if self.stats is not None:
+                self.stats.count("hook_deadline_missed")
+            logger.warning("Data hook missed its {} ms deadline, forwarding the original frame".format(self.deadline_ms))
+            return False, data
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        close_hook(self.data_hook)
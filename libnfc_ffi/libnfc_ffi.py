@@ -1,7 +1,15 @@
 #!/usr/bin/python3
+import os
+import re
+import sys
+import ctypes
+import importlib
 from cffi import FFI
 
-ffi = FFI()
+# LIBNFC_BACKEND=sim swaps libnfc for the simulated devices of libnfc_sim.py
+LIBNFC_BACKEND = os.environ.get("LIBNFC_BACKEND", "libnfc")
+LIBNFC_INCLUDE = os.environ.get("LIBNFC_INCLUDE", "/usr/include/nfc")
+LIBNFC_SO = "libnfc.so"
 
 def fetch_nfc_functions(hfile):
     lines = []
@@ -41,25 +49,69 @@ def ffi_print_declarations(ffi):
     for key in ffi._parser._declarations:
         print(key, ffi._parser._declarations[key])
 
-cdef_types = fetch_nfc_types("/usr/include/nfc/nfc-types.h")
-# print (cdef_types)
-cdef_funcs = fetch_nfc_functions("/usr/include/nfc/nfc.h")
-cdef_defs = fetch_nfc_constants("/usr/include/nfc/nfc.h")
+def parse_headers(ffi=None):
+    """Declarations straight from the libnfc dev headers (slow, needs /usr/include/nfc)"""
+    if ffi is None:
+        ffi = FFI()
+    cdef_types = fetch_nfc_types(os.path.join(LIBNFC_INCLUDE, "nfc-types.h"))
+    # print (cdef_types)
+    cdef_funcs = fetch_nfc_functions(os.path.join(LIBNFC_INCLUDE, "nfc.h"))
+    cdef_defs = fetch_nfc_constants(os.path.join(LIBNFC_INCLUDE, "nfc.h"))
 
-ffi.cdef(cdef_types, packed=True)
-ffi.cdef(cdef_funcs, packed=True)
-ffi.cdef(cdef_defs, packed=True)
-      
+    ffi.cdef(cdef_types, packed=True)
+    ffi.cdef(cdef_funcs, packed=True)
+    ffi.cdef(cdef_defs, packed=True)
+    return ffi
 
-libnfc = ffi.dlopen("libnfc.so")
+def libnfc_version():
+    """Version string of the installed libnfc, probed through ctypes: a cdef() would pull in pycparser"""
+    nfc_version = ctypes.CDLL(LIBNFC_SO).nfc_version
+    nfc_version.restype = ctypes.c_char_p
+    return nfc_version().decode("utf-8")
+
+def compiled_module_name(version):
+    return "_libnfc_cffi_" + re.sub(r"\W", "_", version)
+
+def load_compiled(version):
+    """ffi of the prebuilt out-of-line module for this libnfc version, ImportError if it wasn't built"""
+    name = compiled_module_name(version)
+    if __package__:
+        name = "{}.{}".format(__package__, name)
+    return importlib.import_module(name).ffi
+
+def build_compiled(version=None, tmpdir=None):
+    """Parse the headers once and write them as an out-of-line ABI module (pure Python, no compiler needed)"""
+    if version is None:
+        version = libnfc_version()
+    ffi = parse_headers()
+    ffi.set_source(compiled_module_name(version), None)
+    return ffi.compile(tmpdir=tmpdir or os.path.dirname(os.path.abspath(__file__)))
+
+if LIBNFC_BACKEND == "sim":
+    try:
+        from libnfc_ffi.libnfc_sim import ffi, libnfc
+    except ImportError: # run as a script from this directory
+        from libnfc_sim import ffi, libnfc
+else:
+    try:
+        ffi = load_compiled(libnfc_version())
+    except ImportError:
+        # no prebuilt module for this libnfc version: libnfc_ffi.py --build
+        ffi = parse_headers()
+
+    libnfc = ffi.dlopen(LIBNFC_SO)
 
 
 if __name__ == "__main__":
+    if "--build" in sys.argv[1:]:
+        print("Generated", build_compiled())
+        sys.exit(0)
     print("CFFI binding for libNFC")
     ver_str = ffi.string(libnfc.nfc_version()).decode("utf-8")
     print("libNFC version:", ver_str)
     print("imported types:")
-    ffi_print_declarations(ffi)
+    if hasattr(ffi, "_parser"): # not on a prebuilt module
+        ffi_print_declarations(ffi)
 
     # some constants tst
     # print(sErrorMessages[libnfc.NFC_ECHIP])    
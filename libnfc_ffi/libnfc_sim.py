@@ -0,0 +1,435 @@
+#!/usr/bin/python3
+#
+#  libnfc_sim.py - simulated libnfc backend, selected with LIBNFC_BACKEND=sim
+#
+'''
+Drop-in replacement for the `ffi, libnfc` pair of libnfc_ffi.py covering the
+libnfc calls nfc_wrapper/NFCRelay make. Devices are SimDevice objects: acting
+as an initiator a device talks to a scriptable VirtualCard, acting as a
+target it is driven by a scriptable VirtualReader. Every libnfc call can be
+given a latency, so relay throughput and latency can be measured without
+PN532 hardware:
+
+    LIBNFC_BACKEND=sim python3 nfc_mitm.py
+
+    from libnfc_ffi import libnfc_sim
+    libnfc_sim.configure(devices=[libnfc_sim.SimDevice("sim:emulator", reader=VirtualReader(commands)),
+                                  libnfc_sim.SimDevice("sim:reader", card=VirtualCard(responses))],
+                         latency_ms={"nfc_initiator_transceive_bytes": 5})
+'''
+import time
+import threading
+from cffi import FFI
+
+SIM_VERSION = b"1.8.0-sim"
+
+# subset of nfc-types.h used by the wrapper, same layout for the iso14443a part
+SIM_CDEF = """
+typedef struct nfc_context nfc_context;
+typedef struct nfc_device nfc_device;
+typedef char nfc_connstring[1024];
+typedef enum {
+  NP_TIMEOUT_COMMAND, NP_TIMEOUT_ATR, NP_TIMEOUT_COM, NP_HANDLE_CRC, NP_HANDLE_PARITY,
+  NP_ACTIVATE_FIELD, NP_ACTIVATE_CRYPTO1, NP_INFINITE_SELECT, NP_ACCEPT_INVALID_FRAMES,
+  NP_ACCEPT_MULTIPLE_FRAMES, NP_AUTO_ISO14443_4, NP_EASY_FRAMING, NP_FORCE_ISO14443_A,
+  NP_FORCE_ISO14443_B, NP_FORCE_SPEED_106,
+} nfc_property;
+typedef enum { NBR_UNDEFINED = 0, NBR_106, NBR_212, NBR_424, NBR_847, } nfc_baud_rate;
+typedef enum {
+  NMT_ISO14443A = 1, NMT_JEWEL, NMT_ISO14443B, NMT_ISO14443BI, NMT_ISO14443B2SR,
+  NMT_ISO14443B2CT, NMT_FELICA, NMT_DEP, NMT_BARCODE, NMT_ISO14443BICLASS,
+  NMT_END_ENUM = NMT_ISO14443BICLASS,
+} nfc_modulation_type;
+typedef enum { N_TARGET, N_INITIATOR, } nfc_mode;
+typedef struct {
+  uint8_t  abtAtqa[2];
+  uint8_t  btSak;
+  size_t  szUidLen;
+  uint8_t  abtUid[10];
+  size_t  szAtsLen;
+  uint8_t  abtAts[254];
+} nfc_iso14443a_info;
+typedef union {
+  nfc_iso14443a_info nai;
+} nfc_target_info;
+typedef struct {
+  nfc_modulation_type nmt;
+  nfc_baud_rate nbr;
+} nfc_modulation;
+typedef struct {
+  nfc_target_info nti;
+  nfc_modulation nm;
+} nfc_target;
+#define NFC_SUCCESS 0
+#define NFC_EIO -1
+#define NFC_EINVARG -2
+#define NFC_EDEVNOTSUPP -3
+#define NFC_ENOTSUCHDEV -4
+#define NFC_EOVFLOW -5
+#define NFC_ETIMEOUT -6
+#define NFC_EOPABORTED -7
+#define NFC_ENOTIMPL -8
+#define NFC_ETGRELEASED -10
+#define NFC_ERFTRANS -20
+#define NFC_EMFCAUTHFAIL -30
+#define NFC_ESOFT -80
+#define NFC_ECHIP -90
+"""
+
+ffi = FFI()
+ffi.cdef(SIM_CDEF, packed=True)
+_consts = ffi.dlopen(None) # only used for the enum and #define values above
+
+
+def _is_sblock_wtx(frame):
+    return len(frame) > 1 and frame[0] & 0xF7 == 0xF2
+
+
+def _iblock_header_len(frame):
+    """PCB (+ CID, NAD) length of an ISO 14443-4 I-block, 0 if frame is not one"""
+    if not frame or frame[0] & 0xE2 != 0x02:
+        return 0
+    return 1 + bool(frame[0] & 0x08) + bool(frame[0] & 0x04)
+
+
+class VirtualCard:
+    """Answers the initiator: exact request -> response table, then handler(request), then default"""
+    def __init__(self, responses=None, handler=None, default=bytes.fromhex("6d00"),
+                 uid=bytes.fromhex("04a1b2c3"), atqa=bytes.fromhex("0004"), sak=0x20, ats=bytes.fromhex("75779102")):
+        self.responses = {bytes(k): bytes(v) for k, v in (responses or {}).items()}
+        self.handler = handler
+        self.default = bytes(default)
+        self.uid = bytes(uid)
+        self.atqa = bytes(atqa)
+        self.sak = sak
+        self.ats = bytes(ats)
+        self.requests = []
+        self.block_errors = 0 # blocks received with the card's current block number, i.e. out of step
+        self.select()
+
+    def select(self):
+        """New ISO-DEP session: block numbers start over (PICC 1, the PN53x framing with 0)"""
+        self.block_num = 1
+        self.pn53x_block_num = 0 # block number the PN53x puts on easy framing exchanges
+        self._chain_in = bytearray() # command blocks received with the chaining bit
+        self._chain_out = b''        # response part still to be sent after R(ACK)
+
+    @classmethod
+    def from_log(cls, log_fname, **kwargs):
+        """Card answering every FromReader request of a recorded log with the FromCard frame that followed it"""
+        from nfc_helper import iter_frames, FrameDirection
+        responses = {}
+        req = None
+        for frame in iter_frames(log_fname):
+            if frame.direction == FrameDirection.FromReader:
+                req = frame
+            elif frame.direction == FrameDirection.FromCard and req is not None and frame.index == req.index + 1:
+                responses.setdefault(bytes(req.data), bytes(frame.data))
+                req = None
+        return cls(responses, **kwargs)
+
+    def respond(self, request):
+        self.requests.append(request)
+        if request in self.responses:
+            return self.responses[request]
+        if self.handler is not None:
+            return bytes(self.handler(request))
+        return self.default
+
+    def _receive_block(self, block_num):
+        # PICC rule: another block number moves the session on, the current one is a retransmission
+        if block_num == self.block_num:
+            self.block_errors += 1
+        self.block_num = block_num
+
+    def _pn53x_block(self):
+        self._receive_block(self.pn53x_block_num)
+        self.pn53x_block_num ^= 1
+
+    def transceive(self, frame, easy_framing=True):
+        if easy_framing:
+            # the PN53x wraps the APDU in I-blocks with its own block numbers, chained in the FSC of the ATS,
+            # and acknowledges every chained response block but the last one (FSD 256) with R(ACK)
+            from nfc_helper import ats_fsc, iso_dep_blocks, ISO14443_FSC_MAX
+            for _ in range(iso_dep_blocks(len(frame), min(ats_fsc(self.ats), ISO14443_FSC_MAX))):
+                self._pn53x_block()
+            response = self.respond(bytes(frame))
+            for _ in range(iso_dep_blocks(len(response), ISO14443_FSC_MAX) - 1):
+                self._pn53x_block()
+            return response
+        # raw ISO 14443-4 framing: answer I-blocks with the same PCB/CID/NAD header, chaining both ways
+        # in blocks of the FSC of the ATS
+        hlen = _iblock_header_len(frame)
+        if hlen == 0:
+            if frame and frame[0] & 0xF6 == 0xA2 and self._chain_out: # R(ACK): next response block
+                self._receive_block(frame[0] & 0x01)
+                return self._next_block(bytes([0x02 | frame[0] & 0x01]))
+            return bytes(frame[:1]) # R/S-blocks are echoed
+        self._receive_block(frame[0] & 0x01)
+        if frame[0] & 0x10:
+            self._chain_in += frame[hlen:]
+            return bytes([0xA2 | frame[0] & 0x01])
+        request = bytes(self._chain_in) + bytes(frame[hlen:])
+        self._chain_in.clear()
+        self._chain_out = self.respond(request)
+        return self._next_block(bytes(frame[:hlen]))
+
+    def _next_block(self, header):
+        block_size = 256 - 3 - len(header)
+        if self.ats:
+            block_size = [16, 24, 32, 40, 48, 64, 96, 128, 256][min(self.ats[0] & 0x0F, 8)] - 2 - len(header)
+        chunk, self._chain_out = self._chain_out[:block_size], self._chain_out[block_size:]
+        pcb = header[0] & ~0x10 | (0x10 if self._chain_out else 0)
+        return bytes([pcb]) + header[1:] + chunk
+
+
+class VirtualReader:
+    """Sends a script of commands to the emulated target and records the answers.
+
+    commands -- any iterable of frames (a list, a generator driven by the test...)
+    When the script is exhausted the reader releases the target (NFC_ETGRELEASED).
+    S(WTX) requests from the target are answered automatically.
+    rats -- RATS returned by nfc_target_init(), e.g. E0 80 (FSD=256), none by default
+    """
+    def __init__(self, commands=(), repeat=1, rats=None):
+        self.rats = rats
+        self._commands = list(commands) * repeat if repeat != 1 else commands
+        self._iter = iter(self._commands)
+        self._pending = []
+        self.responses = []
+        self.wtx_requests = 0
+        self.chained_blocks = 0 # I-blocks with the chaining bit, acknowledged with R(ACK)
+
+    @classmethod
+    def from_log(cls, log_fname, repeat=1):
+        """Reader sending the FromReader frames of a recorded log"""
+        from nfc_helper import iter_frames, FrameDirection
+        return cls([bytes(f.data) for f in iter_frames(log_fname, direction=FrameDirection.FromReader) if f.result > 0], repeat)
+
+    def next_command(self):
+        if self._pending:
+            return self._pending.pop(0)
+        return next(self._iter, None)
+
+    def receive(self, frame):
+        frame = bytes(frame)
+        if _is_sblock_wtx(frame):
+            self.wtx_requests += 1
+            self._pending.append(frame) # S(WTX) response echoes the request
+            return
+        if _iblock_header_len(frame) and frame[0] & 0x10:
+            self.chained_blocks += 1
+            self._pending.append(bytes([0xA2 | frame[0] & 0x01])) # R(ACK) asks for the next chained block
+        self.responses.append(frame)
+
+
+class SimDevice:
+    def __init__(self, connstring, name=None, card=None, reader=None):
+        self.connstring = connstring.encode() if isinstance(connstring, str) else connstring
+        self.name = name or self.connstring.decode()
+        self.card = card if card is not None else VirtualCard()
+        self.reader = reader if reader is not None else VirtualReader()
+        self.properties = {}
+        self.is_open = False
+        self._name_c = ffi.new("char[]", self.name.encode())
+
+    def easy_framing(self):
+        return self.properties.get(_consts.NP_EASY_FRAMING, True)
+
+
+def default_devices():
+    select_ppse = bytes.fromhex("00a404000e325041592e5359532e444446303100")
+    return [SimDevice("sim:emulator0", "Simulated PN532 (emulator)", reader=VirtualReader([select_ppse] * 10)),
+            SimDevice("sim:reader1", "Simulated PN532 (reader)",
+                      card=VirtualCard({select_ppse: bytes.fromhex("6f10840e325041592e5359532e44444630319000")}))]
+
+
+class SimLibnfc:
+    """Stands in for the dlopen()ed libnfc: the libnfc functions and constants the wrapper uses"""
+    def __init__(self, devices=None, latency_ms=None):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._next_handle = 1
+        self._version = ffi.new("char[]", SIM_VERSION)
+        self._supported_mt = ffi.new("nfc_modulation_type[]", [_consts.NMT_ISO14443A, 0])
+        self.configure(devices, latency_ms)
+
+    def configure(self, devices=None, latency_ms=None):
+        """devices: list of SimDevice, latency_ms: {libnfc function name: ms or callable returning ms}"""
+        self.devices = devices if devices is not None else default_devices()
+        self.latency_ms = dict(latency_ms or {})
+        self.call_counts = {}
+
+    def __getattr__(self, name):
+        return getattr(_consts, name)
+
+    def _call(self, name):
+        self.call_counts[name] = self.call_counts.get(name, 0) + 1
+        latency = self.latency_ms.get(name)
+        if latency:
+            time.sleep((latency() if callable(latency) else latency) / 1000)
+
+    def _new_handle(self, ctype, obj):
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._handles[handle] = obj
+        return ffi.cast(ctype, handle)
+
+    def _dev(self, pnd):
+        return self._handles[int(ffi.cast("intptr_t", pnd))]
+
+    # library / context
+    def nfc_version(self):
+        return self._version
+
+    def nfc_init(self, ctx):
+        self._call("nfc_init")
+        ctx[0] = self._new_handle("nfc_context *", None)
+
+    def nfc_exit(self, context):
+        self._call("nfc_exit")
+
+    def nfc_list_devices(self, context, connstrings, connstrings_len):
+        self._call("nfc_list_devices")
+        n = min(len(self.devices), connstrings_len)
+        for i in range(n):
+            ffi.memmove(connstrings[i], self.devices[i].connstring + b"\0", len(self.devices[i].connstring) + 1)
+        return n
+
+    # device
+    def nfc_open(self, context, connstring):
+        self._call("nfc_open")
+        if connstring == ffi.NULL or connstring is None:
+            candidates = self.devices
+        else:
+            if isinstance(connstring, ffi.CData):
+                connstring = ffi.string(connstring)
+            candidates = [d for d in self.devices if d.connstring == connstring]
+        for dev in candidates:
+            if not dev.is_open:
+                dev.is_open = True
+                return self._new_handle("nfc_device *", dev)
+        return ffi.NULL
+
+    def nfc_close(self, pnd):
+        self._call("nfc_close")
+        handle = int(ffi.cast("intptr_t", pnd))
+        with self._lock:
+            dev = self._handles.pop(handle, None)
+        if dev is not None:
+            dev.is_open = False
+
+    def nfc_device_get_name(self, pnd):
+        return self._dev(pnd)._name_c
+
+    def nfc_device_get_connstring(self, pnd):
+        return ffi.new("char[]", self._dev(pnd).connstring)
+
+    def nfc_device_get_supported_modulation(self, pnd, mode, supported_mt):
+        supported_mt[0] = self._supported_mt
+        return self.NFC_SUCCESS
+
+    def nfc_device_get_last_error(self, pnd):
+        return self.NFC_SUCCESS
+
+    def nfc_device_set_property_bool(self, pnd, option, value):
+        self._call("nfc_device_set_property_bool")
+        self._dev(pnd).properties[option] = bool(value)
+        return self.NFC_SUCCESS
+
+    def nfc_device_set_property_int(self, pnd, option, value):
+        self._call("nfc_device_set_property_int")
+        self._dev(pnd).properties[option] = value
+        return self.NFC_SUCCESS
+
+    def nfc_abort_command(self, pnd):
+        return self.NFC_SUCCESS
+
+    def nfc_idle(self, pnd):
+        return self.NFC_SUCCESS
+
+    # initiator
+    def nfc_initiator_init(self, pnd):
+        self._call("nfc_initiator_init")
+        return self.NFC_SUCCESS
+
+    def _fill_target(self, card, nt, nm):
+        nt.nm = nm
+        nai = nt.nti.nai
+        nai.abtAtqa = list(card.atqa)
+        nai.btSak = card.sak
+        nai.szUidLen = len(card.uid)
+        nai.abtUid[0:len(card.uid)] = card.uid
+        nai.szAtsLen = len(card.ats)
+        nai.abtAts[0:len(card.ats)] = card.ats
+
+    def nfc_initiator_list_passive_targets(self, pnd, nm, ant, szTargets):
+        self._call("nfc_initiator_list_passive_targets")
+        dev = self._dev(pnd)
+        if szTargets < 1:
+            return 0
+        dev.card.select()
+        self._fill_target(dev.card, ant[0], nm)
+        return 1
+
+    def nfc_initiator_select_passive_target(self, pnd, nm, pbtInitData, szInitData, pnt):
+        self._call("nfc_initiator_select_passive_target")
+        dev = self._dev(pnd)
+        dev.card.select()
+        if pnt != ffi.NULL:
+            self._fill_target(dev.card, pnt[0], nm)
+        return 1
+
+    def nfc_initiator_deselect_target(self, pnd):
+        return self.NFC_SUCCESS
+
+    def nfc_initiator_target_is_present(self, pnd, pnt):
+        return self.NFC_SUCCESS
+
+    def nfc_initiator_transceive_bytes(self, pnd, pbtTx, szTx, pbtRx, szRx, timeout):
+        self._call("nfc_initiator_transceive_bytes")
+        dev = self._dev(pnd)
+        resp = dev.card.transceive(ffi.buffer(pbtTx, szTx)[:], dev.easy_framing())
+        if len(resp) > szRx:
+            return self.NFC_EOVFLOW
+        ffi.memmove(pbtRx, resp, len(resp))
+        return len(resp)
+
+    # target
+    def nfc_target_init(self, pnd, pnt, pbtRx, szRx, timeout):
+        self._call("nfc_target_init")
+        rats = self._dev(pnd).reader.rats
+        if not rats:
+            return self.NFC_SUCCESS
+        ffi.memmove(pbtRx, rats, len(rats))
+        return len(rats)
+
+    def nfc_target_receive_bytes(self, pnd, pbtRx, szRx, timeout):
+        self._call("nfc_target_receive_bytes")
+        cmd = self._dev(pnd).reader.next_command()
+        if cmd is None:
+            return self.NFC_ETGRELEASED
+        if len(cmd) > szRx:
+            return self.NFC_EOVFLOW
+        ffi.memmove(pbtRx, cmd, len(cmd))
+        return len(cmd)
+
+    def nfc_target_send_bytes(self, pnd, pbtTx, szTx, timeout):
+        self._call("nfc_target_send_bytes")
+        self._dev(pnd).reader.receive(ffi.buffer(pbtTx, szTx)[:])
+        return szTx
+
+
+libnfc = SimLibnfc()
+
+
+def configure(devices=None, latency_ms=None):
+    libnfc.configure(devices, latency_ms)
+    return libnfc
+
+
+if __name__ == "__main__":
+    print("Simulated libNFC backend, version:", ffi.string(libnfc.nfc_version()).decode("utf-8"))
+    for dev in libnfc.devices:
+        print("\t{} ({})".format(dev.name, dev.connstring.decode()))
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+#
+#  log_analytics.py - vectorized summaries over frame logs (NumPy, optional dependency)
+#
+'''
+Loads the frame columns of one or many logs into NumPy arrays and computes
+aggregate summaries over them. Binary logs (*.nfcb) are read straight from
+the file into the arrays; JSON records are appended to FrameColumns (see
+nfc_helper) as they are parsed, no Frame is built for either:
+
+    commands          command APDU counts by CLA/INS
+    status_words      SW1SW2 distribution of the card responses
+    response_size     card response APDU size histogram
+    inter_frame_ms    gap between consecutive frames of a log
+    card_response_ms  ToCard -> FromCard time (card round trip)
+    results           libnfc result/error code frequencies (result <= 0)
+
+    log_analytics.py logs/ -o summary.json
+    log_parser.py -a -f logs/ --format csv
+'''
+import os
+import io
+import csv
+import json
+from argparse import ArgumentParser
+
+from nfc_helper import FrameColumns, FrameDirection, FRAME_DIRECTION_CODES, iter_json_array
+
+LOG_EXTENSIONS = (".json", ".jsonl", ".nfcb")
+
+SIZE_BINS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+TIME_BINS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+def error_messages():
+    """sErrorMessages of nfc_wrapper, empty when libnfc can't be loaded on this host"""
+    try:
+        from nfc_wrapper import sErrorMessages
+    except (ImportError, OSError):
+        return {}
+    return sErrorMessages
+
+
+def expand_log_fnames(paths):
+    """Log files of paths, directories are searched recursively"""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fname in sorted(files):
+                    # streamed *.jsonl copies, *_stats.json summaries of a session and hidden files (the replay index) are skipped
+                    if not fname.endswith(LOG_EXTENSIONS) or fname.endswith("_stats.json") or ".spill." in fname \
+                            or fname.startswith("."):
+                        continue
+                    if fname.endswith(".jsonl") and os.path.exists(os.path.join(root, fname[:-1])):
+                        continue
+                    result.append(os.path.join(root, fname))
+        else:
+            result.append(path)
+    return result
+
+
+def load_binlog_columns(log_fname):
+    """Columns of a *.nfcb log, the records are decoded by NumPy over the whole file"""
+    import numpy as np
+    import frame_binlog
+    # packed like frame_binlog.RECORD
+    record = np.dtype([('index', '<u4'), ('time', '<f8'), ('result', '<i4'), ('direction', 'u1'),
+                       ('easy_framing', 'u1'), ('lens', '<u4')])
+    with frame_binlog.BinFrameReader(log_fname) as r:
+        offsets = np.array(r.offsets, dtype=np.int64)
+    arena = np.fromfile(log_fname, dtype=np.uint8)
+    # gather the fixed-size record headers, the payloads stay where they are in the file
+    records = arena[offsets[:, None] + np.arange(record.itemsize)].view(record).reshape(-1)
+    return {
+        'index': records['index'].astype(np.int64),
+        'time': records['time'],
+        'result': records['result'],
+        'direction': records['direction'],
+        'easy_framing': records['easy_framing'].astype(bool),
+        'starts': offsets + record.itemsize,
+        'lens': records['lens'].astype(np.int64),
+        'arena': arena,
+    }
+
+
+def load_json_columns(log_fname):
+    """Columns of a JSON or JSON lines log, records go into FrameColumns as they are parsed"""
+    import numpy as np
+    c = FrameColumns()
+    with open(log_fname, 'r') as f:
+        items = (json.loads(ln) for ln in f if ln.strip()) if log_fname.endswith(".jsonl") else iter_json_array(f)
+        for j in items:
+            c.append_fields(j['index'], j['time'], bytes.fromhex(j['data']), j['result'], j['direction'], j['easy_framing'])
+    return {
+        'index': np.frombuffer(c.index, dtype=np.int64),
+        'time': np.frombuffer(c.time, dtype=np.float64),
+        'result': np.frombuffer(c.result, dtype=np.int32),
+        'direction': np.frombuffer(c.direction, dtype=np.uint8),
+        'easy_framing': np.frombuffer(c.easy_framing, dtype=np.uint8).astype(bool),
+        'starts': np.frombuffer(c.starts, dtype=np.uint64).astype(np.int64),
+        'lens': np.frombuffer(c.lens, dtype=np.uint32).astype(np.int64),
+        'arena': np.frombuffer(c.arena, dtype=np.uint8),
+    }
+
+
+def load_arrays(log_fnames):
+    """Columns of all logs as concatenated NumPy arrays (payloads in one uint8 arena)"""
+    import numpy as np
+    parts = []
+    arena_base = 0
+    for file_id, log_fname in enumerate(log_fnames):
+        if log_fname.endswith(".nfcb"):
+            part = load_binlog_columns(log_fname)
+        else:
+            part = load_json_columns(log_fname)
+        n = len(part['index'])
+        if n == 0:
+            continue
+        part['file'] = np.full(n, file_id, dtype=np.int32)
+        part['starts'] = part['starts'] + arena_base
+        arena_base += len(part['arena'])
+        parts.append(part)
+    keys = ['file', 'index', 'time', 'result', 'direction', 'easy_framing', 'starts', 'lens', 'arena']
+    dtypes = [np.int32, np.int64, np.float64, np.int32, np.uint8, bool, np.int64, np.int64, np.uint8]
+    if not parts:
+        return {k: np.zeros(0, dtype=t) for k, t in zip(keys, dtypes)}
+    return {k: np.concatenate([p[k] for p in parts]) for k in keys}
+
+
+def apdu_header_len(a):
+    """Bytes before the APDU in every frame: 0 with easy framing, PCB (+CID, NAD) of an I-block otherwise, -1 if not an I-block"""
+    import numpy as np
+    arena = a['arena']
+    if len(arena) == 0:
+        return np.zeros(len(a['lens']), dtype=np.int64)
+    first = arena[np.minimum(a['starts'], len(arena) - 1)].astype(np.int64)
+    first[a['lens'] == 0] = 0
+    iblock = (first & 0xE2) == 0x02
+    raw_len = 1 + ((first & 0x08) != 0) + ((first & 0x04) != 0)
+    return np.where(a['easy_framing'], 0, np.where(iblock, raw_len, -1))
+
+
+def bin_labels(edges, fmt="{}"):
+    labels = ["<" + fmt.format(edges[0])]
+    labels += [(fmt + "-" + fmt).format(lo, hi) for lo, hi in zip(edges[:-1], edges[1:])]
+    labels.append(">=" + fmt.format(edges[-1]))
+    return labels
+
+
+def histogram(values, edges, fmt="{}"):
+    import numpy as np
+    counts = np.bincount(np.searchsorted(np.asarray(edges), values, side='right'), minlength=len(edges) + 1)
+    return [{'bin': label, 'count': int(count)} for label, count in zip(bin_labels(edges, fmt), counts)]
+
+
+def counted(keys):
+    """(unique keys, counts) sorted by count, most frequent first"""
+    import numpy as np
+    uniq, counts = np.unique(keys, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    return uniq[order], counts[order]
+
+
+def analyze(log_fnames, size_bins=SIZE_BINS, time_bins_ms=TIME_BINS_MS):
+    import numpy as np
+    a = load_arrays(log_fnames)
+    arena = a['arena']
+    direction = a['direction']
+    lens = a['lens']
+    hdr = apdu_header_len(a)
+    apdu = (hdr >= 0) & (lens >= hdr + 2)
+
+    # command APDUs: CLA, INS after the block header
+    cmd = apdu & (direction == FRAME_DIRECTION_CODES[FrameDirection.FromReader])
+    pos = a['starts'][cmd] + hdr[cmd]
+    keys, counts = counted(arena[pos].astype(np.uint16) << 8 | arena[pos + 1])
+    commands = [{'cla': "{:02X}".format(k >> 8), 'ins': "{:02X}".format(k & 0xFF), 'count': int(n)} for k, n in zip(keys, counts)]
+
+    # responses: SW1SW2 are the last two bytes
+    resp = apdu & (direction == FRAME_DIRECTION_CODES[FrameDirection.FromCard])
+    end = a['starts'][resp] + lens[resp]
+    keys, counts = counted(arena[end - 2].astype(np.uint16) << 8 | arena[end - 1])
+    status_words = [{'sw': "{:04X}".format(k), 'count': int(n)} for k, n in zip(keys, counts)]
+    response_size = histogram(lens[resp] - hdr[resp], size_bins)
+
+    # timing between consecutive frames of the same log
+    same_file = a['file'][1:] == a['file'][:-1]
+    dt_ms = np.diff(a['time']) * 1000
+    inter_frame = histogram(dt_ms[same_file], time_bins_ms)
+    card_rt = same_file & (direction[:-1] == FRAME_DIRECTION_CODES[FrameDirection.ToCard]) \
+        & (direction[1:] == FRAME_DIRECTION_CODES[FrameDirection.FromCard])
+    card_response = histogram(dt_ms[card_rt], time_bins_ms)
+
+    messages = error_messages()
+    result = a['result']
+    keys, counts = counted(result[result <= 0])
+    results = [{'code': int(k), 'name': messages.get(int(k), ""), 'count': int(n)} for k, n in zip(keys, counts)]
+
+    return {
+        'logs': len(log_fnames),
+        'frames': int(len(result)),
+        'commands': commands,
+        'status_words': status_words,
+        'response_size': response_size,
+        'inter_frame_ms': inter_frame,
+        'card_response_ms': card_response,
+        'results': results,
+    }
+
+
+def to_csv(summary):
+    """One section,key,count row per summary entry"""
+    out = io.StringIO()
+    w = csv.writer(out, lineterminator="\n")
+    w.writerow(["section", "key", "count"])
+    w.writerow(["totals", "logs", summary['logs']])
+    w.writerow(["totals", "frames", summary['frames']])
+    for row in summary['commands']:
+        w.writerow(["commands", row['cla'] + row['ins'], row['count']])
+    for row in summary['status_words']:
+        w.writerow(["status_words", row['sw'], row['count']])
+    for section in ('response_size', 'inter_frame_ms', 'card_response_ms'):
+        for row in summary[section]:
+            w.writerow([section, row['bin'], row['count']])
+    for row in summary['results']:
+        w.writerow(["results", "{} {}".format(row['code'], row['name']).strip(), row['count']])
+    return out.getvalue()
+
+
+def format_summary(summary, fmt="json"):
+    if fmt == "csv":
+        return to_csv(summary).rstrip("\n")
+    return json.dumps(summary, indent=4)
+
+
+def main():
+    parser = ArgumentParser(description="Aggregate command, status word, size, timing and error statistics of frame logs")
+    parser.add_argument("paths", nargs="+", help="Log files or directories (*.json, *.jsonl, *.nfcb)")
+    parser.add_argument("-F", "--format", dest="fmt", default="json", choices=["json", "csv"], help="Output format. Default: json")
+    parser.add_argument("-o", "--output", dest="output", type=str, help="Write the summary to this file instead of stdout")
+    args = parser.parse_args()
+    out = format_summary(analyze(expand_log_fnames(args.paths)), args.fmt)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
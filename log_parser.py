@@ -3,17 +3,38 @@
 # from nfc_ctypes import *
 # from nfc_wrapper import *
 from nfc_helper import *
+import frame_binlog
 # from NFCReplay import *
 from argparse import ArgumentParser
 
 def main():
     parser = ArgumentParser()
-    parser.add_argument("-f", "--filename", dest="log_fname", default=0, type=str, help="Input JSON log filename")
-    fl = FrameLogger(easy_framing=True, log_fname=parser.parse_args().log_fname)
+    parser.add_argument("-f", "--filename", dest="log_fname", required=True, type=str, nargs="+", help="Input log filename (JSON, JSON lines or binary *.nfcb). With -a: any number of logs or directories")
+    parser.add_argument("-n", "--frame", dest="frame_num", default=None, type=int, help="Print only frame number N (random access for *.nfcb logs)")
+    parser.add_argument("-a", "--analytics", dest="analytics", action='store_true', help="Print aggregate statistics (CLA/INS, SW, sizes, timing, errors) instead of frames. Needs numpy")
+    parser.add_argument("-F", "--format", dest="fmt", default="json", choices=["json", "csv"], help="Analytics output format. Default: json")
+    args = parser.parse_args()
+    if args.analytics:
+        import log_analytics
+        print (log_analytics.format_summary(log_analytics.analyze(log_analytics.expand_log_fnames(args.log_fname)), args.fmt))
+        return
+    if len(args.log_fname) > 1:
+        parser.error("several logs are only supported with -a")
+    args.log_fname = args.log_fname[0]
+    if args.frame_num is not None and frame_binlog.is_binlog(args.log_fname):
+        print ("Log file name: %s" % args.log_fname)
+        with frame_binlog.BinFrameReader(args.log_fname) as r:
+            print ("Log has %d frames" % len(r))
+            r[args.frame_num].print_data()
+        return
+    fl = FrameLogger(easy_framing=True, log_fname=args.log_fname)
     print ("Log file name: %s" % fl.log_fname)
     fl.load()
     print ("Loaded %d frames" % fl.get_frame_list_len())
+    if args.frame_num is not None:
+        fl.get_frame(args.frame_num).print_data()
+        return
     fl.print()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
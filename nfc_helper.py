@@ -7,29 +7,74 @@ from enum import Enum
 from dataclasses import dataclass
 import dataclasses
 import json
+import re
 
 import functools
 import logging
+import sys
+import os
+import queue
+import threading
+import atexit
+import weakref
+import tempfile
+from array import array
 
 
 
 logger = logging.getLogger(__name__)
 
+_log_debug_wrappers = []
+
 def log_debug(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        args_repr = [repr(a) for a in args]
-        kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
-        signature = ", ".join(args_repr + kwargs_repr)
-        logger.debug(f"function {func.__name__}() called with args {signature}")
+        if logger.isEnabledFor(logging.DEBUG):
+            args_repr = [repr(a) for a in args]
+            kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
+            signature = ", ".join(args_repr + kwargs_repr)
+            logger.debug(f"function {func.__name__}() called with args {signature}")
         try:
             result = func(*args, **kwargs)
             return result
         except Exception as e:
             logger.exception(f"Exception raised in {func.__name__}. exception: {str(e)}")
             raise e
+    _log_debug_wrappers.append(wrapper)
     return wrapper
 
+def _log_debug_owner(func):
+    owner = sys.modules.get(func.__module__)
+    for name in func.__qualname__.split(".")[:-1]:
+        if owner is None or name == "<locals>":
+            return None
+        owner = getattr(owner, name, None)
+    return owner
+
+def configure_log_debug(enabled=None):
+    """Resolve the @log_debug instrumentation once, after the log level is set.
+
+    When disabled, every wrapped function/method is swapped back to the original,
+    so the hot path does not even pay for the wrapper call. Functions imported
+    with "from module import name" before this call keep the reference they got.
+    Returns the number of rebound functions.
+    """
+    if enabled is None:
+        enabled = logger.isEnabledFor(logging.DEBUG)
+    count = 0
+    for wrapper in _log_debug_wrappers:
+        func = wrapper.__wrapped__
+        owner = _log_debug_owner(func)
+        if owner is None:
+            continue
+        name = func.__name__
+        current = getattr(owner, name, None)
+        if current is not wrapper and current is not func:
+            continue # overridden or rebound by someone else
+        setattr(owner, name, wrapper if enabled else func)
+        count += 1
+    return count
+
 
 hex2str = lambda x: bytearray.fromhex(x.replace(" ", ""))
 str2hex = lambda x: x.hex()
@@ -100,6 +145,60 @@ def print_target(target):
     ret += ("\tATS \t: {}\n".format(binascii.hexlify(bytearray(target.nti.nai.abtAts)[:target.nti.nai.szAtsLen])))
     return str(ret)
 
+def hexbytes(data):
+    return " ".join(["{:02x}".format(x) for x in data])
+
+ISO14443_FC_HZ = 13.56e6
+
+def ats_fwi(ats):
+    """FWI from an ATS given without the TL byte (T0 TA TB TC ...), 4 when TB is absent"""
+    if len(ats) == 0 or not ats[0] & 0x20:
+        return 4
+    tb_pos = 2 if ats[0] & 0x10 else 1
+    return ats[tb_pos] >> 4
+
+def fwt_ms(fwi):
+    """ISO 14443-4 frame waiting time: FWT = (256 * 16 / fc) * 2^FWI"""
+    return 256 * 16 / ISO14443_FC_HZ * (1 << fwi) * 1000
+
+# FSDI/FSCI -> FSD/FSC (maximum frame size incl. PCB and CRC), ISO 14443-4:2018 adds 512..4096 for 9..C
+ISO14443_FSC = [16, 24, 32, 40, 48, 64, 96, 128, 256, 512, 1024, 2048, 4096]
+ISO14443_FSC_MAX = 256 # largest frame the PN53x buffers take
+
+def fsc_from_fsci(fsci):
+    """FSC/FSD of an FSCI/FSDI code, RFU codes are read as 256"""
+    return ISO14443_FSC[fsci] if fsci < len(ISO14443_FSC) else 256
+
+def rats_fsd(rats):
+    """Reader frame size FSD from a RATS (E0 PARAM), None if rats is not one"""
+    if len(rats) < 2 or rats[0] != 0xE0:
+        return None
+    return fsc_from_fsci(rats[1] >> 4)
+
+def ats_fsc(ats):
+    """FSC advertised by an ATS given without the TL byte"""
+    return fsc_from_fsci(ats[0] & 0x0F) if len(ats) else 32
+
+def iso_dep_blocks(data_len, frame_size):
+    """I-blocks carrying data_len bytes in frames of frame_size (PCB + CRC each), at least one"""
+    return max(1, -(-data_len // (frame_size - 3)))
+
+def apdu_is_extended(apdu):
+    """Extended length command APDU (ISO 7816-4 case 2E/3E/4E): 00 and two length bytes after the header.
+
+    Only for CLA bytes with the interindustry structure (0X-7X, and the proprietary 8X, 9X, AX) and a length
+    matching the Lc/Le layout, so native commands such as DESFire BD 01 00 00 00 ... are not taken for one.
+    """
+    if len(apdu) < 7 or apdu[4] != 0 or apdu[0] >> 4 > 0xA: # BX-FX: proprietary/RFU, FF: invalid
+        return False
+    if len(apdu) == 7: # case 2E: Le only
+        return True
+    lc = apdu[5] << 8 | apdu[6]
+    return lc > 0 and len(apdu) in (7 + lc, 9 + lc) # case 3E, 4E with two Le bytes
+
+def target_ats(target):
+    return bytearray(target.nti.nai.abtAts)[:target.nti.nai.szAtsLen]
+
 def print_frame(frame):
         # frame_data = frame['data'].encode('utf-8')
         # frame_len = len(frame_data)
@@ -189,6 +288,8 @@ class Frame:
         }.items()
     def __dict__(self) -> dict:
         return dataclasses.asdict(self)
+    def __reduce__(self): # __dict__ above is a method, pickle can't use the default
+        return (Frame, (self.index, self.time, self.data, self.result, self.direction, self.easy_framing))
     def to_json(self):
         d = dict(self)
         print(d)
@@ -198,6 +299,152 @@ class Frame:
     def __repr__(self) -> str:
         return self.to_json()
 
+FRAME_DIRECTIONS = [FrameDirection.FromReader, FrameDirection.ToReader, FrameDirection.FromCard, FrameDirection.ToCard]
+FRAME_DIRECTION_CODES = {d: code for code, d in enumerate(FRAME_DIRECTIONS)}
+
+
+class FrameColumns:
+    """List-like columnar frame storage: typed arrays per field and one bytes arena for the payloads.
+
+    Frames are built on access, their data is a copy of the arena slice (changing it doesn't change the
+    stored frame, set_frame() does). Scans that need only some fields read column() and payload() instead.
+    popleft() only moves a start mark, the consumed head is compacted away in bulk.
+    """
+    def __init__(self, frames=()):
+        self.index = array('q')
+        self.time = array('d')
+        self.result = array('i')
+        self.direction = array('B') # FRAME_DIRECTIONS code
+        self.easy_framing = array('B')
+        self.starts = array('Q') # payload offsets in arena
+        self.lens = array('I')
+        self.arena = bytearray()
+        self._head = 0 # frames before it were popped
+        for frame in frames:
+            self.append(frame)
+
+    def append(self, frame):
+        self.append_fields(frame.index, frame.time, frame.data, frame.result, frame.direction, frame.easy_framing)
+
+    def append_fields(self, index, time, data, result, direction, easy_framing):
+        """append() without a Frame object"""
+        arena = self.arena
+        self.index.append(index)
+        self.time.append(time)
+        self.result.append(result)
+        self.direction.append(FRAME_DIRECTION_CODES[direction])
+        self.easy_framing.append(bool(easy_framing))
+        self.starts.append(len(arena))
+        self.lens.append(len(data))
+        arena += data
+
+    def __len__(self):
+        return len(self.index) - self._head
+
+    def column(self, name):
+        """memoryview of a column (index, time, result, direction, easy_framing, starts, lens) from the first frame.
+
+        No Frame is built. The columns can't grow while a view is held: release it (with ... as view) before appending.
+        """
+        return memoryview(getattr(self, name))[self._head:]
+
+    def payload(self, n):
+        """memoryview of the payload of frame n in the arena, same rule as column()"""
+        n = self._position(n)
+        start = self.starts[n]
+        return memoryview(self.arena)[start:start + self.lens[n]]
+
+    def get_data(self, n):
+        """Payload of frame n as bytes, without building the Frame"""
+        with self.payload(n) as view:
+            return bytes(view)
+
+    def get_direction(self, n):
+        return FRAME_DIRECTIONS[self.direction[self._position(n)]]
+
+    def set_frame(self, n, frame):
+        """Store frame as frame n, frames read from the columns are copies"""
+        pos = self._position(n)
+        data = frame.data
+        if len(data) <= self.lens[pos]:
+            start = self.starts[pos]
+        else: # the old payload stays in the arena until the next compaction
+            start = len(self.arena)
+            self.arena += bytes(len(data))
+        self.arena[start:start + len(data)] = data
+        self.starts[pos] = start
+        self.lens[pos] = len(data)
+        self.index[pos] = frame.index
+        self.time[pos] = frame.time
+        self.result[pos] = frame.result
+        self.direction[pos] = FRAME_DIRECTION_CODES[frame.direction]
+        self.easy_framing[pos] = bool(frame.easy_framing)
+
+    def _position(self, n):
+        length = len(self)
+        if n < 0:
+            n += length
+        if not 0 <= n < length:
+            raise IndexError("frame index out of range")
+        return n + self._head
+
+    def _frame_at(self, pos):
+        start = self.starts[pos]
+        return Frame(self.index[pos], self.time[pos], bytearray(self.arena[start:start + self.lens[pos]]),
+                     self.result[pos], FRAME_DIRECTIONS[self.direction[pos]], bool(self.easy_framing[pos]))
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self._frame_at(self._head + i) for i in range(*n.indices(len(self)))]
+        return self._frame_at(self._position(n))
+
+    def __iter__(self):
+        for pos in range(self._head, len(self.index)):
+            yield self._frame_at(pos)
+
+    def iter_dicts(self):
+        """Frame.__dict__() of every frame, straight from the columns"""
+        arena = self.arena
+        for pos in range(self._head, len(self.index)):
+            start = self.starts[pos]
+            yield {
+                'index': self.index[pos],
+                'time': self.time[pos],
+                'data': arena[start:start + self.lens[pos]],
+                'result': self.result[pos],
+                'direction': FRAME_DIRECTIONS[self.direction[pos]],
+                'easy_framing': bool(self.easy_framing[pos]),
+            }
+
+    def popleft(self):
+        frame = self[0]
+        self._head += 1
+        if self._head >= 1024 and self._head * 2 >= len(self.index):
+            self._compact()
+        return frame
+
+    def _compact(self):
+        head = self._head
+        # set_frame() may have moved a payload to the end of the arena, so
+        # the live payloads are not ordered by start: copy them out in order
+        arena = bytearray()
+        starts = array('Q')
+        for start, length in zip(self.starts[head:], self.lens[head:]):
+            starts.append(len(arena))
+            arena += self.arena[start:start + length]
+        for column in (self.index, self.time, self.result, self.direction, self.easy_framing, self.lens):
+            del column[:head]
+        self.starts = starts
+        self.arena = arena
+        self._head = 0
+
+    def clear(self):
+        for column in (self.index, self.time, self.result, self.direction, self.easy_framing, self.starts, self.lens):
+            del column[:]
+        self.arena = bytearray()
+        self._head = 0
+
+
 class FrameEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Frame):
@@ -215,7 +462,9 @@ class FrameEncoder(json.JSONEncoder):
 
 
 def frame_from_json(json_str):
-    j = json.loads(json_str)
+    return frame_from_dict(json.loads(json_str))
+
+def frame_from_dict(j):
     index = j['index']
     time = j['time']
     data = bytearray.fromhex(j['data'])
@@ -224,33 +473,189 @@ def frame_from_json(json_str):
     easy_framing = j['easy_framing']
     return Frame(index, time, data, result, direction, easy_framing)
 
+_json_skip_re = re.compile(r'[\s,]*')
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """Yield the elements of a top-level JSON array one at a time, reading f in chunks"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    while not buf:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buf = chunk.lstrip()
+    if not buf.startswith('['):
+        raise ValueError("JSON log must be an array of frames")
+    pos = 1
+    eof = False
+    while True:
+        pos = _json_skip_re.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos == len(buf):
+                raise ValueError
+            obj, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # element crosses the chunk boundary
+            if eof:
+                if pos == len(buf):
+                    return
+                raise
+            more = f.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield obj
+
+def iter_frames(log_fname, direction=None, start=None, stop=None):
+    """Lazily decode frames from a JSON, JSON lines or binary (*.nfcb) log.
+
+    direction -- a FrameDirection or a collection of them to keep
+    start, stop -- keep frames with start <= frame.index < stop. Frames are logged
+                   in index order, so reading stops at the first index >= stop.
+    """
+    if isinstance(direction, str):
+        direction = (direction,)
+    if log_fname.endswith(".nfcb"):
+        import frame_binlog
+        with frame_binlog.BinFrameReader(log_fname) as r:
+            yield from _filter_frames(r, direction, start, stop)
+        return
+    with open(log_fname, 'r') as f:
+        if log_fname.endswith(".jsonl"):
+            items = (json.loads(ln) for ln in f if ln.strip())
+        else:
+            items = iter_json_array(f)
+        yield from _filter_frames(map(frame_from_dict, items), direction, start, stop)
+
+def _filter_frames(frames, direction, start, stop):
+    for frame in frames:
+        if stop is not None and frame.index >= stop:
+            return
+        if start is not None and frame.index < start:
+            continue
+        if direction is not None and frame.direction not in direction:
+            continue
+        yield frame
+
+def _remove_spill(spill):
+    spill.close()
+    try:
+        os.remove(spill.log_fname)
+    except FileNotFoundError:
+        pass
+
 class FrameList:
-    def __init__(self, easy_framing=True):
-        self.frame_list: List[Frame] = []
+    def __init__(self, easy_framing=True, max_frames=None, spill_fname=None):
+        # max_frames: keep only the last max_frames frames in memory, older ones are spilled
+        # to a binary segment (spill_fname, a temporary *.nfcb by default) and read back on access
+        self.max_frames = max_frames
+        self.frame_list = FrameColumns()
         # self.easy_framing = False
         self.easy_framing = easy_framing
+        self.spill_fname = spill_fname
+        self.spill = None # frame_binlog.BinFrameWriter of the frames evicted from frame_list
+        self._spill_cleanup = None
         pass
 
     def clear(self):
         self.frame_list.clear()
+        self.close_spill()
         
     def add_frame(self, frame):
         self.frame_list.append(frame)
+        if self.max_frames is not None and len(self.frame_list) > self.max_frames:
+            self.spill_frame(self.frame_list.popleft())
 
     def add_frame_by_data(self, index, time, data, result, direction, easy_framing=None):
         if easy_framing == None:
             easy_framing = self.easy_framing
-        frame = Frame(index, time, data, result, direction, easy_framing)
-        self.add_frame(frame)
+        # straight into the columns, no Frame object
+        self.frame_list.append_fields(index, time, data, result, direction, easy_framing)
+        if self.max_frames is not None and len(self.frame_list) > self.max_frames:
+            self.spill_frame(self.frame_list.popleft())
+
+    def spill_frame(self, frame):
+        if self.spill is None:
+            import frame_binlog
+            if self.spill_fname is None:
+                fd, spill_fname = tempfile.mkstemp(prefix="frames_", suffix=frame_binlog.BINLOG_EXT)
+                os.close(fd)
+                self.spill = frame_binlog.BinFrameWriter(spill_fname)
+                # our own temporary file: removed with the list or at exit if close_spill() is never called
+                self._spill_cleanup = weakref.finalize(self, _remove_spill, self.spill)
+            else:
+                self.spill = frame_binlog.BinFrameWriter(self.spill_fname)
+        self.spill.write(frame)
+
+    def close_spill(self):
+        """Drop the spilled frames and their segment file"""
+        if self._spill_cleanup is not None:
+            self._spill_cleanup()
+            self._spill_cleanup = None
+        elif self.spill is not None:
+            _remove_spill(self.spill)
+        self.spill = None
+
+    def get_spilled_len(self):
+        return 0 if self.spill is None else len(self.spill)
 
     def get_frame(self, index):
-        return self.frame_list[index]
+        spilled = self.get_spilled_len()
+        if not spilled:
+            return self.frame_list[index]
+        if index < 0:
+            index += spilled + len(self.frame_list)
+            if index < 0:
+                raise IndexError("frame index out of range")
+        if index < spilled:
+            return self.spill.get_frame(index)
+        return self.frame_list[index - spilled]
+
+    def iter_all(self):
+        """All frames in order: the spilled ones first, then the in-memory ones"""
+        for n in range(self.get_spilled_len()):
+            yield self.spill.get_frame(n)
+        yield from self.frame_list
     
+    def iter_dicts(self):
+        for n in range(self.get_spilled_len()):
+            yield self.spill.get_frame(n).__dict__()
+        yield from self.frame_list.iter_dicts()
+
+    def iter_index_direction(self):
+        """(n, frame index, FRAME_DIRECTIONS code) of every frame in order, n as in get_frame(), no Frame is built"""
+        spilled = self.get_spilled_len()
+        for n in range(spilled):
+            frame = self.spill.get_frame(n)
+            yield n, frame.index, FRAME_DIRECTION_CODES[frame.direction]
+        with self.frame_list.column('index') as index, self.frame_list.column('direction') as direction:
+            yield from zip(range(spilled, spilled + len(index)), index, direction)
+
+    def get_data(self, n):
+        """Payload of frame n as bytes, without building the Frame of an in-memory frame"""
+        spilled = self.get_spilled_len()
+        if n < spilled:
+            return bytes(self.spill.get_frame(n).data)
+        return self.frame_list.get_data(n - spilled)
+
+    def set_frame(self, index, frame):
+        """Write a changed frame back, get_frame() and get_frame_list() return copies"""
+        spilled = self.get_spilled_len()
+        if index < 0:
+            index += spilled + len(self.frame_list)
+        if 0 <= index < spilled:
+            raise ValueError("frame {} is spilled to disk and can't be changed".format(index))
+        self.frame_list.set_frame(index - spilled, frame)
+
     def get_frame_list(self):
-        return self.frame_list
+        """Snapshot of all frames: a tuple of copies, change frames with set_frame() and add them with add_frame()"""
+        return tuple(self.iter_all())
         
     def get_frame_list_len(self):
-        return len(self.frame_list)
+        return self.get_spilled_len() + len(self.frame_list)
     
 
 
@@ -267,6 +672,8 @@ class TargetData:
         }.items()
     def __dict__(self) -> dict:
         return dataclasses.asdict(self)
+    def __reduce__(self): # __dict__ above is a method, pickle can't use the default
+        return (TargetData, (self.abtUid, self.abtAtqa, self.btSak))
     def to_json(self):
         d = dict(self)
         print(d)
@@ -276,42 +683,164 @@ class TargetData:
     def __repr__(self) -> str:
         return self.to_json()
 
+def frame_to_jsonl(frame):
+    return json.dumps({
+        'index': frame.index,
+        'time': frame.time,
+        'data': frame.data.hex(),
+        'result': frame.result,
+        'direction': frame.direction,
+        'easy_framing': frame.easy_framing
+    }) + "\n"
+
+
+_open_stream_writers = weakref.WeakSet()
+
+@atexit.register
+def close_stream_writers():
+    for writer in list(_open_stream_writers):
+        writer.close()
+
+
+class FrameStreamWriter(threading.Thread):
+    """Append-only JSON lines log sink.
+
+    write() only enqueues the frame, serialization and disk I/O happen on this
+    background thread. Lines are flushed in batches of flush_every frames or
+    after flush_interval seconds, whichever comes first.
+    """
+    _STOP = object()
+
+    def __init__(self, log_fname, flush_every=64, flush_interval=0.5):
+        threading.Thread.__init__(self, name="FrameStreamWriter")
+        self.daemon = True # closed by close_stream_writers() at exit
+        self.log_fname = log_fname
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.frames_written = 0
+        self._queue = queue.SimpleQueue()
+        self._file = open(log_fname, 'w')
+        self._closed = False
+        _open_stream_writers.add(self)
+        self.start()
+
+    def write(self, frame):
+        self._queue.put(frame)
+
+    def run(self):
+        batch = []
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(frame_to_jsonl(item))
+                if len(batch) >= self.flush_every:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            if batch:
+                self._file.write("".join(batch))
+                self._file.flush()
+                self.frames_written += len(batch)
+                batch.clear()
+        self._file.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self.join()
+        _open_stream_writers.discard(self)
+
+
+def stream_fname(log_fname):
+    return os.path.splitext(log_fname)[0] + ".jsonl"
+
+
 class FrameLogger(FrameList):
     log_fname: str = None
 
-    def __init__(self, easy_framing=True, log_fname=None):
-        FrameList.__init__(self, easy_framing)
+    def __init__(self, easy_framing=True, log_fname=None, max_frames=None):
+        spill_fname = None
+        if max_frames is not None and log_fname is not None:
+            spill_fname = os.path.splitext(log_fname)[0] + ".spill.nfcb"
+        FrameList.__init__(self, easy_framing, max_frames, spill_fname)
         self.easy_framing = easy_framing
         self.log_fname = log_fname
+        self.stream = None
+
+    def add_frame(self, frame):
+        FrameList.add_frame(self, frame)
+        if self.stream is not None:
+            self.stream.write(frame)
+
+    def add_frame_by_data(self, index, time, data, result, direction, easy_framing=None):
+        if self.stream is None:
+            FrameList.add_frame_by_data(self, index, time, data, result, direction, easy_framing)
+            return
+        if easy_framing == None:
+            easy_framing = self.easy_framing
+        # the stream writer thread needs its own Frame, data may be a view over a reused device buffer
+        self.add_frame(Frame(index, time, bytearray(data), result, direction, easy_framing))
+
+    def open_stream(self, log_fname=None):
+        """Start appending every added frame to a JSON lines file (<log_fname>.jsonl by default)"""
+        self.close_stream()
+        if log_fname is None:
+            if self.log_fname == None:
+                return None
+            log_fname = stream_fname(self.log_fname)
+        self.stream = FrameStreamWriter(log_fname)
+        return self.stream
+
+    def close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
 
     def print(self):
-        for frame in self.frame_list:
+        for frame in self.iter_all():
             # print(type(frame))
             frame.print_data()
 
     def to_json(self):
-        return json.dumps([frame.__dict__() for frame in self.frame_list], cls=BytearrayEncoder)
+        return json.dumps(list(self.iter_dicts()), cls=BytearrayEncoder)
     
     def to_json_pretty(self):
-        return json.dumps([frame.__dict__() for frame in self.frame_list], cls=BytearrayEncoder, indent=4)
+        return json.dumps(list(self.iter_dicts()), cls=BytearrayEncoder, indent=4)
         
     def save_to(self, log_fname):
+        if log_fname.endswith(".nfcb"):
+            import frame_binlog
+            frame_binlog.save_frames(self.iter_all(), log_fname)
+            return
         with open(log_fname, 'w') as f:
-            j = self.to_json_pretty()
-            f.write(j)
+            # element by element, the same text as to_json_pretty() without the whole log in one string
+            sep = "[\n"
+            for d in self.iter_dicts():
+                f.write(sep)
+                f.write("    " + json.dumps(d, cls=BytearrayEncoder, indent=4).replace("\n", "\n    "))
+                sep = ",\n"
+            f.write("[]" if sep == "[\n" else "\n]")
 
     def save(self):
         if self.log_fname == None:
             return
         self.save_to(self.log_fname)
 
-    def load_from(self, log_fname):
+    def load_from(self, log_fname, direction=None, start=None, stop=None):
         self.clear()
-        with open(log_fname, 'r') as f:
-            j = f.read()
-            a = json.loads(j)
-            for frame in a:
-                self.add_frame(frame_from_json(json.dumps(frame)))
+        for frame in iter_frames(log_fname, direction, start, stop):
+            self.add_frame(frame)
 
     def load(self):
         if self.log_fname == None:
@@ -319,23 +848,168 @@ class FrameLogger(FrameList):
         self.load_from(self.log_fname)
 
 
+class _ConversationNode:
+    __slots__ = ("children", "by_header", "response")
+
+    def __init__(self, response=None):
+        self.children = {}  # full request -> node
+        self.by_header = {} # request header (data[:5]) -> first node with it
+        self.response = response # response frame of the request leading here
+
+
+class ConversationAutomaton:
+    """Prefix tree of the request/response exchanges of recorded sessions, follows the replayed session"""
+    MATCHES = ("path", "restart", "header", "resync")
+
+    def __init__(self):
+        self.root = _ConversationNode()
+        self.by_request = {} # full request -> first node with it, to get back on track
+        self.node = self.root
+        self.matches = dict.fromkeys(self.MATCHES, 0)
+
+    def add_conversation(self, exchanges):
+        """exchanges: (request data, response frame) of one session in order"""
+        node = self.root
+        for request, response in exchanges:
+            request = bytes(request)
+            child = node.children.get(request)
+            if child is None:
+                child = node.children[request] = _ConversationNode(response)
+                node.by_header.setdefault(request[:5], child)
+                self.by_request.setdefault(request, child)
+            node = child
+
+    def reset(self):
+        self.node = self.root
+
+    def __getstate__(self):
+        # flat node table: a long session would nest too deep for pickle
+        nodes = [self.root]
+        ids = {id(self.root): 0}
+        for node in nodes:
+            for child in node.children.values():
+                ids[id(child)] = len(nodes)
+                nodes.append(child)
+        return {
+            'responses': [node.response for node in nodes],
+            'children': [[(request, ids[id(child)]) for request, child in node.children.items()] for node in nodes],
+            'by_header': [[(header, ids[id(child)]) for header, child in node.by_header.items()] for node in nodes],
+            'by_request': [(request, ids[id(node)]) for request, node in self.by_request.items()],
+        }
+
+    def __setstate__(self, state):
+        nodes = [_ConversationNode(response) for response in state['responses']]
+        for node, children, by_header in zip(nodes, state['children'], state['by_header']):
+            node.children = {request: nodes[i] for request, i in children}
+            node.by_header = {header: nodes[i] for header, i in by_header}
+        self.root = nodes[0]
+        self.by_request = {request: nodes[i] for request, i in state['by_request']}
+        self.node = self.root
+        self.matches = dict.fromkeys(self.MATCHES, 0)
+
+    def advance(self, request):
+        """Response frame recorded for request after the exchanges so far, None if it was never seen"""
+        request = bytes(request)
+        # the recorded continuation, a new session, the same command with other data, the request anywhere
+        for kind, node in (("path", self.node.children.get(request)),
+                           ("restart", self.root.children.get(request)),
+                           ("header", self.node.by_header.get(request[:5])),
+                           ("resync", self.by_request.get(request))):
+            if node is not None:
+                self.matches[kind] += 1
+                self.node = node
+                return node.response
+        return None
+
+
+def recorded_responses(fl):
+    """{frame index: first FromCard frame with it} of a FrameList, only those frames are built"""
+    from_card = FRAME_DIRECTION_CODES[FrameDirection.FromCard]
+    resp_by_index = {}
+    for n, index, direction in fl.iter_index_direction():
+        if direction == from_card and index not in resp_by_index:
+            resp_by_index[index] = fl.get_frame(n)
+    return resp_by_index
+
+def recorded_sessions(fl, resp_by_index=None):
+    """(request data, response frame) exchanges of a FrameList, one list per recorded session"""
+    if resp_by_index is None:
+        resp_by_index = recorded_responses(fl)
+    from_reader = FRAME_DIRECTION_CODES[FrameDirection.FromReader]
+    exchanges = []
+    last_index = -1
+    for n, index, direction in fl.iter_index_direction():
+        if direction != from_reader:
+            continue
+        resp = resp_by_index.get(index + 1)
+        if resp is None:
+            continue
+        if index < last_index: # indexes start over: the next log of the loaded ones
+            yield exchanges
+            exchanges = []
+        last_index = index
+        exchanges.append((fl.get_data(n), resp))
+    if exchanges:
+        yield exchanges
+
+
 class EmulatedInitiator(FrameLogger):
+    def __init__(self, easy_framing=True, log_fname=None):
+        FrameLogger.__init__(self, easy_framing, log_fname)
+        self.resp_by_req = {}   # request header (data[:5]) -> response frame
+        self.resp_by_index = {} # response frame index -> response frame
+        self.conversation = ConversationAutomaton()
+        self._indexed_len = 0
+
     def configure(self, option, value): # for backward compatibility from relay as data source
         pass 
 
+    def load_from(self, log_fname):
+        if os.path.isdir(log_fname):
+            self.load_corpus(log_fname)
+            return
+        FrameLogger.load_from(self, log_fname)
+        self.build_index()
+
+    def load_corpus(self, path):
+        """Replay from the merged index of every log under path (see replay_corpus.py), no frames are loaded"""
+        from replay_corpus import ReplayCorpus
+        corpus = ReplayCorpus(path)
+        corpus.load()
+        self.resp_by_req = corpus.resp_by_req
+        self.resp_by_index = {}
+        self.conversation = corpus.conversation
+        self._indexed_len = self.get_frame_list_len()
+        return corpus
+
+    def build_index(self):
+        """Index the loaded frames, so every lookup in transceive_bytes() is O(1)"""
+        self.resp_by_index = recorded_responses(self)
+        self.resp_by_req = {}
+        self.conversation = ConversationAutomaton()
+        for exchanges in recorded_sessions(self, self.resp_by_index):
+            for request, resp in exchanges:
+                # keep the first request that has a response, same as the linear scan did
+                self.resp_by_req.setdefault(bytes(request[:5]), resp)
+            self.conversation.add_conversation(exchanges)
+        self._indexed_len = self.get_frame_list_len()
+
     def transceive_bytes(self, data, timeout=0): # for backward compatibility from relay as data source
         # print("initiator_transceive_bytes: ", data)
-        for req in self.frame_list:
-            if (req.direction == FrameDirection.FromReader) and (req.data[:5] == data[:5]):
-                idx = req.index
-                # print("Found req frame: ", idx, req)
-                for resp in self.frame_list:
-                    if resp.direction == FrameDirection.FromCard and resp.index == idx+1:
-                        # print("Found resp frame: ", resp)
-                        return resp.data, resp.result
+        if self._indexed_len != self.get_frame_list_len():
+            self.build_index()
+        resp = self.conversation.advance(data)
+        if resp is None: # not recorded as such, the first response to the same header
+            resp = self.resp_by_req.get(bytes(data[:5]))
+        if resp is not None:
+            return resp.data, resp.result
         print("Can't find frame for request: ", data)
         return b'', 0
 
+    def transceive_view(self, data, timeout=0):
+        resp_data, ret = self.transceive_bytes(data, timeout)
+        return memoryview(resp_data), ret
+
     def set_property_bool(self, option, value: bool):
         logger.debug("set_property_bool")
         pass
@@ -22,17 +22,16 @@ device.name = "_PN532_UART"
 device.connstring = "pn532_uart:/dev/ttyS0"
 '''
 # from nfc_ctypes import *
-import output_redirect
-from nfc_wrapper import *
-from nfc_helper import *
-from NFCRelay import *
-from libnfc_ffi.libnfc_ffi import libnfc as nfc
-import apdu_processor
+from time import perf_counter
+startup_t0 = perf_counter()
 
 from datetime import datetime
 import os
+import sys
+import importlib
 import threading
 import argparse 
+import logging
 
 
 logger = logging.getLogger(__name__)
@@ -44,8 +43,26 @@ fname_date = datetime.now().strftime('%H_%M_%S_%d_%m_%Y')
 log_fname_default = "%s_%s_APDU_log.json" % (fname_main, fname_date)
 
 logs_path = "{}/logs/".format(cwd)
-if not os.path.exists(logs_path):
-    os.mkdir(logs_path)
+
+# libnfc, the relay and the output threads are only loaded by the modes that need them,
+# so --help and --list-devs don't pay for them
+import_times = {} # module name -> seconds, in import order (nested imports count for the first importer)
+
+
+def timed_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    t = perf_counter()
+    module = importlib.import_module(name)
+    import_times[name] = perf_counter() - t
+    return module
+
+
+def print_import_report():
+    print ("\n************ Import times ************")
+    for name, seconds in import_times.items():
+        print ("%-20s %8.1f ms" % (name, seconds * 1000))
+    print ("%-20s %8.1f ms" % ("startup total", (perf_counter() - startup_t0) * 1000))
 
 
 target_dev_num_default = 0  # make it command line params
@@ -60,19 +77,28 @@ def main():
     parser.add_argument("-o", "--log-fname", dest="log_fname", default=log_fname_default, type=str, help=f"Output JSON log filename. Default: {log_fname_default}")
     parser.add_argument("-n", "--no-easy-framing", dest="no_easy_framing", action='store_true', help="Do not use easy framing. Transfer data as frames instead of APDUs")    
     parser.add_argument("-p", "--print-log", dest="print_log", action='store_false', help="Print APDU log to stdout after completion")   
+    parser.add_argument("-W", "--no-wtx", dest="no_wtx", action='store_true', help="Do not send S(WTX) to the reader when the card is slow (non easy framing mode only)")
     parser.add_argument("-H", "--hook-data", dest="hook_data", action='store_true', help="Use data hook function for data processing")
+    parser.add_argument("-D", "--hook-deadline", dest="hook_deadline", type=float, help="Forward the original frame when the data hook takes longer than this many ms")
+    parser.add_argument("-O", "--observe", dest="observe", action='store_true', help="Run the apdu_processor observer on every frame in a worker process, off the relay path")
+    parser.add_argument("-R", "--rules", dest="rules", type=str, help="Match/mutate data rules from this JSON file (see hook_rules.py), reloaded when it changes")
     parser.add_argument("-L", "--log-level", dest="log_level", default="ERROR", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Set the logging level")
     parser.add_argument("-t", "--target", dest="target_dev_num", default=target_dev_num_default, type=int, help=f"Emulator device number. Default: {target_dev_num_default}")
+    parser.add_argument("-P", "--pairs", dest="pairs", type=str, help="Relay several device pairs at once: comma separated initiator:target device numbers, e.g. 1:0,3:2")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-i", "--initiator", dest="initiator_dev_num", default=initiator_dev_num_default, type=int, help=f"Reader device number. Default: {initiator_dev_num_default}")
-    group.add_argument("-r", "--replay", dest="log_replay", type=str, help="Replay APDU data from a recorded log file instead of using a reader. exclusive with -i option")
+    group.add_argument("-r", "--replay", dest="log_replay", type=str, help="Replay APDU data from a recorded log file, or from every log in a directory, instead of using a reader. exclusive with -i option")
+    parser.add_argument("-F", "--fsci", dest="fsci", default=5, type=int, choices=range(9), help="FSCI advertised in the emulated ATS, 8 => FSC=256 bytes. Default: 5 (FSC=64)")
+    parser.add_argument("-M", "--max-frames", dest="max_frames", type=int, help="Keep only the last N frames in memory, older frames are spilled to <log-fname>.spill.nfcb")
+    parser.add_argument("-T", "--import-report", dest="import_report", action='store_true', help="Print how long the imports of the selected mode took")
     args = parser.parse_args()
+    if args.hook_deadline is not None and not args.hook_data:
+        parser.error("-D/--hook-deadline needs -H/--hook-data")
 
     log_level = getattr(logging, args.log_level)
     logging.getLogger().setLevel(log_level)
 
     current_log_level = logging.getLogger().getEffectiveLevel()
-    logger.info(f"Current log level: {logging.getLevelName(current_log_level)}")
 
     log_fname = logs_path + args.log_fname
     easy_framing = not args.no_easy_framing
@@ -85,34 +111,66 @@ def main():
         log_replay = args.log_replay
         initiator_dev_num = -1 # for log replay mode
         if not os.path.exists(log_replay):
-            print ("Replay log file not found: %s" % log_replay)
+            print ("Replay log file or directory not found: %s" % log_replay)
             return
     else:
         initiator_dev_num = args.initiator_dev_num
         log_replay = None
 
+    if args.rules and not os.path.exists(args.rules):
+        print ("Rules file not found: %s" % args.rules)
+        return
+
+    if not list_devs:
+        # threaded log/stdout output for the relay modes
+        timed_import("output_redirect").start()
+    logger.info(f"Current log level: {logging.getLevelName(current_log_level)}")
+    nfc_wrapper = timed_import("nfc_wrapper")
 
     print ("                   *** LibNFC re(p)lay tool ***")
     print ("tag <---> initiator (relay) <---> target (relay) <---> original reader\n")
-    print ("%s uses LibNFC ver %s" % (fname_main, get_version_str()))
+    print ("%s uses LibNFC ver %s" % (fname_main, nfc_wrapper.get_version_str()))
     if list_devs:
-        devs_list = list_devices(True)
+        devs_list = nfc_wrapper.list_devices(True)
         if len(devs_list) < 2:
             print ("Found ", len(devs_list), "... Needed 2.\nExitng...")
         else:
             print ("Initiator dev num:", initiator_dev_num_default)
             print ("Target dev num:", target_dev_num_default)
+        if args.import_report:
+            print_import_report()
         return
-    
 
-    r = NFCRelay(initiator_dev_num, target_dev_num, easy_framing=easy_framing, log_fname=log_fname)
+    if not os.path.exists(logs_path):
+        os.mkdir(logs_path)
+    relay = timed_import("NFCRelay")
+    data_hook = timed_import("apdu_processor").data_hook if hook_data else None
+    # drop the @log_debug wrappers from the relay path unless DEBUG is on
+    relay.configure_log_debug()
+    if args.import_report:
+        print_import_report()
+
+    if args.pairs:
+        run_pairs(args, log_fname, easy_framing, data_hook)
+        return
+
+    r = relay.NFCRelay(initiator_dev_num, target_dev_num, easy_framing=easy_framing, log_fname=log_fname, max_frames=args.max_frames)
     if r is None:
         print ("Can't create NFCRelay object with provided device numbers")
         return
 
+    r.wtx_enabled = not args.no_wtx
+    r.fsci = args.fsci
+
     if hook_data:
         print ("Using data hook")
-        r.set_data_hook(apdu_processor.data_hook)
+        r.set_data_hook(data_hook, deadline_ms=args.hook_deadline)
+    if args.observe:
+        print ("Using observer worker process")
+        r.add_observer(timed_import("apdu_processor").observer, processes=True)
+    if args.rules:
+        print ("Using data rules from %s" % args.rules)
+        r.set_data_rules(args.rules)
 
     ret = r.reader_setup(log_fname=log_replay)
     if r.pndReader is None:
@@ -128,11 +186,11 @@ def main():
         else:
             print ("Found ", tag_count, " tag(s)/device(s)")
             for target in r.passive_targets_list:
-                print ("\tTag info: " + print_target(target), flush=True)
+                print ("\tTag info: " + relay.print_target(target), flush=True)
             print("Selecting 1st target by default")
 
             r.select_target()
-            print("Real target:" + print_target(r.real_target), flush=True)
+            print("Real target:" + relay.print_target(r.real_target), flush=True)
     else:
         print("Using log file: %s as a data source" % log_replay)
         
@@ -142,7 +200,7 @@ def main():
         print ("Can't open emulator or poll timeout")
         return
 
-    print("Emulated target:" + print_target(r.emulated_target), flush=True)
+    print("Emulated target:" + relay.print_target(r.emulated_target), flush=True)
 
     print("Done, relaying frames now...\n")
 
@@ -152,14 +210,41 @@ def main():
         logger.error(f"Error relaying frames: {e}")
 
     print("Relaying finished")
-    print("Tag emulator reported:", r.pndTag.get_last_err(), sErrorMessages[r.pndTag.get_last_err()])
-    print("Reader reported:", r.pndReader.get_last_err(), sErrorMessages[r.pndReader.get_last_err()])
+    print("Tag emulator reported:", r.pndTag.get_last_err(), relay.sErrorMessages[r.pndTag.get_last_err()])
+    print("Reader reported:", r.pndReader.get_last_err(), relay.sErrorMessages[r.pndReader.get_last_err()])
 
+    print("\n************** Latency ***************")
+    print(r.stats_summary())
+    r.stats.save_to(os.path.splitext(log_fname)[0] + "_stats.json", r.fwt_ms)
+    print("Frames were streamed to: %s" % relay.stream_fname(log_fname))
     print("Saving log to file: %s" % log_fname)
     r.fl.save()
     if print_log:
         print ("\n************** Log Out ***************")
         r.log_print()
+    # the saved log has every frame, the spill segment is not needed anymore
+    r.fl.close_spill()
+    r.close()
+
+
+def run_pairs(args, log_fname, easy_framing, data_hook):
+    from relay_scheduler import RelayScheduler
+    scheduler = RelayScheduler()
+    log_base, log_ext = os.path.splitext(log_fname)
+    observers = [timed_import("apdu_processor").observer] if args.observe else []
+    for n, pair in enumerate(args.pairs.split(",")):
+        initiator_dev_num, target_dev_num = (int(x) for x in pair.split(":"))
+        # each relay builds its own rule engine and hook workers and closes them when its session ends
+        scheduler.add_pair(initiator_dev_num, target_dev_num, log_fname="%s_pair%d%s" % (log_base, n, log_ext),
+                           easy_framing=easy_framing, data_hook=data_hook, hook_deadline_ms=args.hook_deadline,
+                           rules=args.rules, observers=observers, observer_processes=True,
+                           wtx_enabled=not args.no_wtx, fsci=args.fsci, max_frames=args.max_frames)
+    print("Relaying %d device pairs..." % len(scheduler.sessions))
+    scheduler.start()
+    while scheduler.is_alive():
+        scheduler.join(1)
+    for result in scheduler.results():
+        print("%s: %d frames, log: %s, error: %s" % (result.name, result.frames, result.log_fname, result.error))
 
 
 class MainThread(threading.Thread):
@@ -2,26 +2,68 @@
 # to trace shared lib calls use "ltrace --library="*libnfc*" python3 ./nfc_wrapper.py"
 from libnfc_ffi.libnfc_ffi import ffi, libnfc as nfc
 import nfc_helper 
+from nfc_helper import hexbytes
 from hexdump import *
 import time
 # from pprint import pprint
 from inspect import getmembers
+from dataclasses import dataclass, field
+from typing import Optional
+import threading
 import atexit
 import logging
 
 logger = logging.getLogger(__name__)
 
-NFC_DEVICE_LIST_SIZE = 10
-NFC_DEVICE_LIST = ffi.new("nfc_connstring[{0}]".format(NFC_DEVICE_LIST_SIZE))
+NFC_DEVICE_LIST_SIZE = 64 # default upper bound for list_devices(), pass max_devices for more
 MAX_FRAME_LEN = 264
-
-ctx = ffi.new("nfc_context**")
-nfc.nfc_init(ctx)
-c = ctx[0]
+MAX_EASY_FRAMING_TX = MAX_FRAME_LEN - 3 # APDU bytes the PN53x takes in one easy framing exchange
+MAX_CHAINED_LEN = 65536 + 2 # extended length response + SW1SW2
+
+
+class NfcContext(object):
+    """Own libnfc context, e.g. one per relay session when several device pairs run at once"""
+    def __init__(self):
+        self._ctx = ffi.new("nfc_context**")
+        nfc.nfc_init(self._ctx)
+        self.c = self._ctx[0]
+        if self.c == ffi.NULL:
+            raise IOError("Unable to initialize libnfc")
+
+    def list_devices(self, verbose=False, max_devices=NFC_DEVICE_LIST_SIZE):
+        return list_devices(verbose, context=self.c, max_devices=max_devices)
+
+    def close(self):
+        """Devices opened in this context must be closed first"""
+        if self.c is not None:
+            invalidate_device_cache(self.c)
+            nfc.nfc_exit(self.c)
+            self.c = None
+
+
+# the module context is created on first use (get_context() or nfc_wrapper.c), importing stays free of libnfc I/O
+_default_context = None
+_default_context_lock = threading.Lock()
+
+def get_context():
+    global _default_context
+    with _default_context_lock:
+        if _default_context is None:
+            _default_context = NfcContext()
+        return _default_context
+
+def __getattr__(name):
+    # module level "c" of the eagerly initialized versions
+    if name == "c":
+        return get_context().c
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 @atexit.register
 def nfc_exit():
-    nfc.nfc_exit(c)
+    global _default_context
+    if _default_context is not None:
+        _default_context.close()
+        _default_context = None
 
 # def nfc_wrapper_unload():
 #     nfc_exit()
@@ -53,9 +95,6 @@ def pprint_cdata(cd, print_hex=False):
         c = ffi.buffer(cd)
         logger.debug(hexdump(c, result='return'))
     
-def hexbytes(data):
-    return " ".join(["{:02x}".format(x) for x in data])
-
 sErrorMessages = {
     # /* Chip-level errors (internal errors, RF errors, etc.) */
     nfc.NFC_SUCCESS: "Success",
@@ -83,29 +122,94 @@ cffi_chars_to_str = lambda c: ffi.string(c).decode("utf-8")
 def get_version_str():
     return cffi_chars_to_str(nfc.nfc_version())
 
-def list_devices(verbose=False):
+@dataclass
+class DeviceInfo:
+    connstring: bytes
+    name: Optional[str] = None # None until probed
+    capabilities: dict = field(default_factory=dict) # "initiator"/"target" -> supported modulation names
+
+# context address -> (max_devices of the scan, [DeviceInfo]); nfc_list_devices() probes every bus, keep the result
+_device_cache = {}
+_device_cache_lock = threading.Lock()
+
+def _context_key(context):
+    return int(ffi.cast("intptr_t", context))
+
+def invalidate_device_cache(context=None):
+    """Forget enumerated devices of context (of all contexts if None), e.g. after plugging a reader in"""
+    with _device_cache_lock:
+        if context is None:
+            _device_cache.clear()
+        else:
+            _device_cache.pop(_context_key(context), None)
+
+def enumerate_devices(context=None, max_devices=NFC_DEVICE_LIST_SIZE, refresh=False):
+    """[DeviceInfo] of the devices found in context (the module context by default), cached until invalidated"""
+    if context is None:
+        context = get_context().c
+    key = _context_key(context)
+    with _device_cache_lock:
+        cached = _device_cache.get(key)
+        # a scan stopped at a smaller max_devices than asked for may have missed devices
+        if not refresh and cached is not None and (cached[0] >= max_devices or len(cached[1]) < cached[0]):
+            return cached[1][:max_devices]
+    # per call buffer: concurrent sessions must not share one global connstring list
+    dev_list = ffi.new("nfc_connstring[{0}]".format(max_devices))
+    num_devices = nfc.nfc_list_devices(context, dev_list, max_devices)
+    infos = [DeviceInfo(ffi.string(dev_list[i])) for i in range(num_devices)]
+    with _device_cache_lock:
+        _device_cache[key] = (max_devices, infos)
+    return infos
+
+def supported_modulations(device, mode):
+    supported_mt = ffi.new("nfc_modulation_type **")
+    if nfc.nfc_device_get_supported_modulation(device, mode, supported_mt) < nfc.NFC_SUCCESS:
+        return []
     result = []
-    num_devices = nfc.nfc_list_devices(c, NFC_DEVICE_LIST, NFC_DEVICE_LIST_SIZE)
-    for i in range(num_devices):
-        result.append(NFC_DEVICE_LIST[i])
-    if verbose:
-        print ('libNFC devices ({}):'.format(num_devices))
-        for dev in result:
-            d = nfc.nfc_open(c, dev)
-            devname = cffi_chars_to_str(nfc.nfc_device_get_name(d))
-            print('\t{}'.format(devname))
-            nfc.nfc_close(d)
+    i = 0
+    while supported_mt[0][i] != 0:
+        result.append(ffi.string(ffi.cast("nfc_modulation_type", supported_mt[0][i])))
+        i += 1
     return result
 
-def close_devics():
-    for dev in NFC_DEVICE_LIST:
-        nfc.nfc_close(dev)
+def probe_device(info, context=None):
+    """Fill name and capabilities of a DeviceInfo by opening the device once, the result stays in the cache"""
+    if info.name is not None:
+        return info
+    d = nfc.nfc_open(get_context().c if context is None else context, info.connstring)
+    if d == ffi.NULL:
+        return info
+    try:
+        info.name = cffi_chars_to_str(nfc.nfc_device_get_name(d))
+        info.capabilities = {
+            "initiator": supported_modulations(d, nfc.N_INITIATOR),
+            "target": supported_modulations(d, nfc.N_TARGET),
+        }
+    finally:
+        nfc.nfc_close(d)
+    return info
+
+def list_devices(verbose=False, context=None, max_devices=NFC_DEVICE_LIST_SIZE, refresh=False):
+    """Connstrings (bytes) of the devices found in context (the module context by default)"""
+    infos = enumerate_devices(context, max_devices, refresh)
+    if verbose:
+        print ('libNFC devices ({}):'.format(len(infos)))
+        for info in infos:
+            probe_device(info, context)
+            print('\t{}'.format(info.name))
+    return [info.connstring for info in infos]
 
 class NfcDevice(object):
     @nfc_helper.log_debug
-    def __init__(self, devdesc=None, verbosity=0, modtype=nfc.NMT_ISO14443A, baudrate=nfc.NBR_106, timeout=5000):
+    def __init__(self, devdesc=None, verbosity=0, modtype=nfc.NMT_ISO14443A, baudrate=nfc.NBR_106, timeout=5000, context=None):
         # logger.debug("NfcDevice init")
-        self._device = nfc.nfc_open(c, devdesc)
+        if devdesc is None:
+            devdesc = ffi.NULL
+        self._device = nfc.nfc_open(get_context().c if context is None else context, devdesc)
+        if self._device == ffi.NULL:
+            # the device may be gone, rescan next time
+            invalidate_device_cache(get_context().c if context is None else context)
+            raise IOError("Unable to open NFC device {}".format(devdesc))
         self._device_name = cffi_chars_to_str(nfc.nfc_device_get_name(self._device))
         self._txbytes = ffi.new("uint8_t[{}]".format(MAX_FRAME_LEN))
         self._rxbytes = ffi.new("uint8_t[{}]".format(MAX_FRAME_LEN))
@@ -116,7 +220,12 @@ class NfcDevice(object):
         # time.sleep(0.5) # 50ms removes error "libnfc.driver.pn532_spi Unable to wait for SPI data. (RX)"
 
     def __del__(self):
-        nfc.nfc_close(self._device)
+        self.close()
+
+    def close(self):
+        if getattr(self, '_device', None) is not None and self._device != ffi.NULL:
+            nfc.nfc_close(self._device)
+        self._device = None
 
     @nfc_helper.log_debug
     def get_last_err(self):
@@ -151,11 +260,13 @@ class NfcDevice(object):
 
 class NfcTarget(NfcDevice):
     @nfc_helper.log_debug
-    def __init__(self, devdesc, targettype=None, timeout=10000, verbosity=0):
-        super().__init__(devdesc, verbosity)
+    def __init__(self, devdesc, targettype=None, timeout=10000, verbosity=0, context=None, fsci=5):
+        super().__init__(devdesc, verbosity, context=context)
+        self.fsci = fsci # frame size advertised in the emulated ATS, FSCI=8 => FSC=256
+        self.init_frame = b'' # first frame from the reader, the RATS in ISO 14443-4 emulation
         ret = self.init(targettype, timeout)
         logger.info("Target dev name: {}".format(self._device_name))
-        self.last_err = ret
+        self.last_err = min(ret, nfc.NFC_SUCCESS) # > 0: length of the frame received on init
 
     @nfc_helper.log_debug
     def init(self, targettype=None, timeout=0):
@@ -164,30 +275,42 @@ class NfcTarget(NfcDevice):
             targettype = self.prepare_emulated_target()
 
         ret = nfc.nfc_target_init(self._device, targettype, self._rxbytes, MAX_FRAME_LEN, timeout)
-        self.last_err = ret
+        self.last_err = min(ret, nfc.NFC_SUCCESS)
 
         if ret < nfc.NFC_SUCCESS:
             logger.info("init() error: {}, {}".format(ret, sErrorMessages[ret]))
+        else:
+            self.init_frame = bytes(ffi.buffer(self._rxbytes, ret))
         self._nt = targettype
         return ret
+
+    @nfc_helper.log_debug
+    def get_reader_fsd(self):
+        """Frame size the reader accepts (FSDI of its RATS), None when the RATS was not seen"""
+        return nfc_helper.rats_fsd(self.init_frame)
     
     @nfc_helper.log_debug
     def get_target(self):
         return self._nt
 
+    @nfc_helper.log_debug
+    def get_fwt_ms(self):
+        """Frame waiting time the emulated ATS advertises to the reader"""
+        return nfc_helper.fwt_ms(nfc_helper.ats_fwi(nfc_helper.target_ats(self._nt)))
+
     @nfc_helper.log_debug
     def prepare_emulated_target(self):
         # logger.debug("prepare_emulated_target")
         abtAtqa = [0x03, 0x04]
         abtUid = [0x08, 0xba, 0xdf, 0x0d] # abtUid[0] = 0x08 Needed for PN532 emulation 
-        abtAts = [0x75, 0x33, 0x92, 0x03]
+        abtAts = [0x70 | min(self.fsci, 8), 0x33, 0x92, 0x03]
         # https://de.wikipedia.org/wiki/Answer_to_Select
         # ATS = (05) 75 33 92 03
         #       (TL) T0 TA TB TC
         #             |  |  |  +-- CID supported, NAD supported
         #             |  |  +----- FWI=9 SFGI=2 => FWT=154ms, SFGT=1.21ms
         #             |  +-------- DR=2,4 DS=2,4 => supports 106, 212 & 424bps in both directions
-        #             +----------- TA,TB,TC, FSCI=5 => FSC=64
+        #             +----------- TA,TB,TC, FSCI=5 => FSC=64 (self.fsci)
         # It seems hazardous to tell we support NAD if the tag doesn't support NAD but I don't know how to disable it
         # PC/SC pseudo-ATR = 3B 80 80 01 01 if there is no historical bytes
 
@@ -219,7 +342,8 @@ class NfcTarget(NfcDevice):
             data = bytearray()
         else:
             data = bytearray(ffi.buffer(self._rxbytes, ret))
-        logger.info('T<I[%2X]: %s' % (len(data), hexbytes(data)))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T<I[%2X]: %s' % (len(data), hexbytes(data)))
         return data, ret
 
     @nfc_helper.log_debug
@@ -227,7 +351,8 @@ class NfcTarget(NfcDevice):
         # logger.debug("send_bytes")
         if timeout is None:
             timeout = self.timeout
-        logger.info('T>I[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T>I[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
         tx_len = len(txbytes)
         self._txbytes[0:tx_len] = txbytes
         ret = nfc.nfc_target_send_bytes(self._device, self._txbytes, tx_len, timeout)
@@ -237,6 +362,55 @@ class NfcTarget(NfcDevice):
             logger.info("send_bytes() error: {}".format(ret))
         return ret
 
+    @nfc_helper.log_debug
+    def receive_view(self, timeout=None):
+        """receive_bytes() without the copy: returns a memoryview over the shared rx buffer.
+        The view is only valid until the next receive on this device."""
+        if timeout is None:
+            timeout = self.timeout
+        ret = nfc.nfc_target_receive_bytes(self._device, self._rxbytes, MAX_FRAME_LEN, timeout)
+        self.last_err = ret
+
+        if ret < nfc.NFC_SUCCESS:
+            logger.info("receive_view() error {}: ".format(ret))
+            data = memoryview(b'')
+        else:
+            data = memoryview(ffi.buffer(self._rxbytes, ret))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T<I[%2X]: %s' % (len(data), hexbytes(data)))
+        return data, ret
+
+    @nfc_helper.log_debug
+    def receive_into(self, rxbuf, timeout=None):
+        """Receive into a caller-owned buffer (bytearray) instead of the shared rx buffer, returns a memoryview of the frame"""
+        if timeout is None:
+            timeout = self.timeout
+        ret = nfc.nfc_target_receive_bytes(self._device, ffi.from_buffer("uint8_t[]", rxbuf), len(rxbuf), timeout)
+        self.last_err = ret
+
+        if ret < nfc.NFC_SUCCESS:
+            logger.info("receive_into() error {}: ".format(ret))
+            data = memoryview(b'')
+        else:
+            data = memoryview(rxbuf)[:ret]
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T<I[%2X]: %s' % (len(data), hexbytes(data)))
+        return data, ret
+
+    @nfc_helper.log_debug
+    def send_from(self, txbuf, timeout=None):
+        """send_bytes() without the copy into _txbytes: txbuf (bytes, bytearray, memoryview) is passed to libnfc as is"""
+        if timeout is None:
+            timeout = self.timeout
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('T>I[%2X]: %s' % (len(txbuf), hexbytes(txbuf)))
+        ret = nfc.nfc_target_send_bytes(self._device, ffi.from_buffer("uint8_t[]", txbuf), len(txbuf), timeout)
+        self.last_err = ret
+
+        if ret < nfc.NFC_SUCCESS:
+            logger.info("send_from() error: {}".format(ret))
+        return ret
+
     @nfc_helper.log_debug
     def receive_bits(self, *args, **kwargs):
         raise NotImplementedError("receive_bits() not implemented")
@@ -249,8 +423,15 @@ class NfcTarget(NfcDevice):
 
 class NfcInitiator(NfcDevice):
     @nfc_helper.log_debug
-    def __init__(self, devdesc=None, verbosity=0):
-        super().__init__(devdesc, verbosity)
+    def __init__(self, devdesc=None, verbosity=0, context=None):
+        super().__init__(devdesc, verbosity, context=context)
+        self.card_fsc = 32 # frame size of the selected card (its ATS), ISO-DEP chaining block size
+        # ISO-DEP block number of the next I-block. The PN53x keeps its own while it does the framing, so
+        # once transceive_chained() has sent blocks itself the card session stays in raw framing (raw_iso_dep)
+        self._block_num = 0
+        self.raw_iso_dep = False
+        self._chain_tx = None # preallocated on the first chained exchange
+        self._chain_rx = None
         ret = self.init()
         logger.info("Initiator dev name: {}".format(self._device_name))
         self.last_err = ret
@@ -280,6 +461,7 @@ class NfcInitiator(NfcDevice):
         result = []
         max_targets_length = 16
         nt = ffi.new("nfc_target[{}]".format(max_targets_length))
+        self.end_raw_iso_dep()
         # time.sleep(0.5) # 50ms removes error "libnfc.driver.pn532_spi Unable to wait for SPI data. (RX)"
         ret = nfc.nfc_initiator_list_passive_targets(self._device, self.nm[0], 
                                                              nt, max_targets_length)
@@ -310,6 +492,7 @@ class NfcInitiator(NfcDevice):
     def select_passive_target(self, initdata=None):
         # logger.debug("select_passive_target")
         nt = ffi.new("nfc_target*")
+        self.end_raw_iso_dep()
         if initdata is None:
             ret = nfc.nfc_initiator_select_passive_target(self._device, self.nm[0], ffi.NULL, 0, nt)
         else:
@@ -319,6 +502,8 @@ class NfcInitiator(NfcDevice):
 
         if ret < nfc.NFC_SUCCESS:
             logger.info("select_passive_target() error: {}, {}".format(ret, sErrorMessages[ret]))
+        else:
+            self.card_fsc = nfc_helper.ats_fsc(nfc_helper.target_ats(nt))
         return ret, nt
     
     @nfc_helper.log_debug
@@ -338,7 +523,8 @@ class NfcInitiator(NfcDevice):
         # logger.debug("transceive_bytes()")
         if timeout is None:
             timeout = self.timeout
-        logger.info('I>T[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('I>T[%2X]: %s' % (len(txbytes), hexbytes(txbytes)))
         tx_len = len(txbytes)
         self._txbytes[0:tx_len] = txbytes
         rx_len = MAX_FRAME_LEN
@@ -350,9 +536,127 @@ class NfcInitiator(NfcDevice):
             data = bytearray()
         else:
             data = bytearray(ffi.buffer(self._rxbytes, ret))
-            logger.info('I<T[%2X]: %s' % (len(data), hexbytes(data)))
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('I<T[%2X]: %s' % (len(data), hexbytes(data)))
+            if not self.raw_iso_dep:
+                self._block_num ^= self.easy_framing_blocks(tx_len, ret) & 1
         return data, ret
 
+    @nfc_helper.log_debug
+    def transceive_view(self, txbuf, timeout=None):
+        """transceive_bytes() without copies: txbuf (any buffer, e.g. the view returned by
+        NfcTarget.receive_view()) is passed to libnfc as is and the response is returned as a
+        memoryview over the shared rx buffer, valid until the next transceive on this device."""
+        if timeout is None:
+            timeout = self.timeout
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('I>T[%2X]: %s' % (len(txbuf), hexbytes(txbuf)))
+        ret = nfc.nfc_initiator_transceive_bytes(self._device, ffi.from_buffer("uint8_t[]", txbuf), len(txbuf),
+                                                    self._rxbytes, MAX_FRAME_LEN, timeout)
+        self.last_err = ret
+        if ret < nfc.NFC_SUCCESS:
+            logger.info("transceive_view() error: {}".format(ret))
+            data = memoryview(b'')
+        else:
+            data = memoryview(ffi.buffer(self._rxbytes, ret))
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('I<T[%2X]: %s' % (len(data), hexbytes(data)))
+            if not self.raw_iso_dep:
+                self._block_num ^= self.easy_framing_blocks(len(txbuf), ret) & 1
+        return data, ret
+
+    def easy_framing_blocks(self, tx_len, rx_len):
+        """Block number toggles of an APDU framed by the PN53x: it chains the command in the card's FSC
+        and the card chains the response in the PN53x FSD (256), every I-block or R(ACK) of the card toggles"""
+        return (nfc_helper.iso_dep_blocks(tx_len, min(self.card_fsc, nfc_helper.ISO14443_FSC_MAX))
+                + nfc_helper.iso_dep_blocks(rx_len, nfc_helper.ISO14443_FSC_MAX) - 1)
+
+    def needs_chaining(self, apdu):
+        """True if apdu has to go through transceive_chained(): too long to send or extended length (long response)
+        with easy framing, or any APDU once the card session is in raw framing"""
+        return self.raw_iso_dep or len(apdu) > MAX_EASY_FRAMING_TX or nfc_helper.apdu_is_extended(apdu)
+
+    def end_raw_iso_dep(self):
+        """Back to easy framing for the next card session (a new selection restarts the block numbers)"""
+        self._block_num = 0
+        if self.raw_iso_dep:
+            self.raw_iso_dep = False
+            self.set_property_bool(nfc.NP_EASY_FRAMING, True)
+
+    @nfc_helper.log_debug
+    def transceive_chained(self, apdu, timeout=None):
+        """Exchange an APDU of any length with ISO-DEP chaining done here instead of by the PN53x.
+
+        Used in easy framing mode, which is switched off: the command is sent as chained I-blocks
+        of the card's FSC, chained response blocks are acknowledged with R(ACK) and reassembled in
+        a preallocated buffer, S(WTX) requests of the card are answered. The PN53x would go on with
+        a stale block number, so easy framing stays off and every later APDU of the card session
+        comes here (needs_chaining()) until the next selection.
+        Returns a memoryview of the response APDU, valid until the next chained exchange.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self._chain_rx is None:
+            self._chain_tx = bytearray(nfc_helper.ISO14443_FSC_MAX)
+            self._chain_rx = bytearray(MAX_CHAINED_LEN)
+        apdu = memoryview(apdu)
+        block_size = min(self.card_fsc, nfc_helper.ISO14443_FSC_MAX) - 3 # PCB + CRC
+        tx = self._chain_tx
+        if not self.raw_iso_dep:
+            self.raw_iso_dep = True
+            self.set_property_bool(nfc.NP_EASY_FRAMING, False)
+        # command: I-blocks with the chaining bit, each acknowledged by the card with R(ACK)
+        start = 0
+        while True:
+            chunk = apdu[start:start + block_size]
+            is_last_chunk = start + block_size >= len(apdu)
+            tx[0] = 0x02 | self._block_num | (0 if is_last_chunk else 0x10)
+            tx[1:1 + len(chunk)] = chunk
+            resp, ret = self.transceive_block(memoryview(tx)[:1 + len(chunk)], timeout)
+            if ret < nfc.NFC_SUCCESS:
+                return memoryview(b''), ret
+            if is_last_chunk:
+                break
+            if resp[0] & 0xF6 != 0xA2:
+                logger.warning("Expected R(ACK) for a chained block, got: {}".format(hexbytes(resp)))
+                return memoryview(b''), nfc.NFC_ECHIP
+            start += block_size
+        # response: copy every I-block into the buffer, ask for the next one while chaining is set
+        rx = self._chain_rx
+        rx_len = 0
+        while True:
+            if resp[0] & 0xE2 != 0x02:
+                logger.warning("Expected an I-block from the card, got: {}".format(hexbytes(resp)))
+                return memoryview(b''), nfc.NFC_ECHIP
+            hlen = 1 + bool(resp[0] & 0x08) + bool(resp[0] & 0x04)
+            n = len(resp) - hlen
+            if rx_len + n > len(rx):
+                return memoryview(b''), nfc.NFC_EOVFLOW
+            rx[rx_len:rx_len + n] = resp[hlen:]
+            rx_len += n
+            if not resp[0] & 0x10:
+                break
+            tx[0] = 0xA2 | self._block_num # R(ACK)
+            resp, ret = self.transceive_block(memoryview(tx)[:1], timeout)
+            if ret < nfc.NFC_SUCCESS:
+                return memoryview(b''), ret
+        logger.info("Chained exchange: {} bytes sent, {} bytes received".format(len(apdu), rx_len))
+        return memoryview(rx)[:rx_len], rx_len
+
+    def transceive_block(self, block, timeout):
+        """One ISO-DEP block exchange in raw framing, S(WTX) requests of the card are answered until it responds"""
+        while True:
+            resp, ret = self.transceive_view(block, timeout)
+            if ret < 1:
+                return resp, min(ret, nfc.NFC_ECHIP)
+            if resp[0] & 0xF7 == 0xF2: # S(WTX): echo it as the response
+                block = bytes(resp)
+                continue
+            if resp[0] & 0xE2 == 0x02 or resp[0] & 0xF6 == 0xA2:
+                # I-block or R(ACK): the card's block number, the next block goes with the other one
+                self._block_num = (resp[0] & 0x01) ^ 1
+            return resp, ret
+
     @nfc_helper.log_debug
     def transceive_bits(self, *args, **kwargs):
         raise NotImplementedError("transceive_bits() not implemented")
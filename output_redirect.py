@@ -2,7 +2,9 @@
 import logging
 import logging.handlers
 import queue
+import collections
 import sys
+import time
 import threading
 import atexit
 import functools
@@ -16,7 +18,6 @@ queue_handler = logging.handlers.QueueHandler(log_queue)
 root_logger = logging.getLogger()
 
 # root_logger.setLevel(logging.NOTSET)
-root_logger.addHandler(queue_handler)
 
 # Set up the listener with desired handlers (e.g., StreamHandler)
 stream_handler = logging.StreamHandler()
@@ -44,54 +45,175 @@ listener = logging.handlers.QueueListener(log_queue, stream_handler)
 #     return wrapper
 
 
+class ProgressRun:
+    """count consecutive progress marks, written as mark * count"""
+    __slots__ = ("mark", "count")
+
+    def __init__(self, mark):
+        self.mark = mark
+        self.count = 1
+
+
+class OutputChannel:
+    """Bounded stdout channel: write() only appends under a short lock, the worker writes coalesced batches.
+
+    Progress marks beyond max_progress are dropped oldest first. Text is never dropped: once max_pending
+    characters are queued, write() waits for the worker to take them.
+    """
+    def __init__(self, stream=None, max_pending=1 << 20, max_progress=256, linger=0.02):
+        self.stream = stream
+        self.max_pending = max_pending
+        self.max_progress = max_progress
+        self.linger = linger # seconds the worker waits for more writes before a batch
+        self._items = collections.deque() # str or ProgressRun
+        self._pending = 0
+        self._progress = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)  # the worker waits for items
+        self._space = threading.Condition(self._lock) # writers wait for the worker to take them
+        self._stopped = False
+        self.blocked = 0 # writes that waited for the worker
+        self.dropped_progress = 0
+
+    def write(self, message):
+        if not message:
+            return 0
+        with self._lock:
+            if self._pending and self._pending + len(message) > self.max_pending and not self._stopped:
+                self.blocked += 1
+                while self._pending and self._pending + len(message) > self.max_pending and not self._stopped:
+                    self._cond.notify()
+                    self._space.wait()
+            was_empty = not self._items
+            self._items.append(message)
+            self._pending += len(message)
+            if was_empty:
+                self._cond.notify()
+        return len(message)
+
+    def progress(self, mark="."):
+        with self._lock:
+            was_empty = not self._items
+            last = self._items[-1] if self._items else None
+            if isinstance(last, ProgressRun) and last.mark == mark:
+                last.count += 1
+            else:
+                self._items.append(ProgressRun(mark))
+            self._progress += 1
+            if self._progress > self.max_progress:
+                self._drop_oldest_progress()
+            if was_empty:
+                self._cond.notify()
+
+    def _drop_oldest_progress(self):
+        for i, item in enumerate(self._items):
+            if isinstance(item, ProgressRun):
+                item.count -= 1
+                if item.count == 0:
+                    del self._items[i]
+                self._progress -= 1
+                self.dropped_progress += 1
+                return
+
+    def _take(self):
+        items, self._items = self._items, collections.deque()
+        self._pending = self._progress = 0
+        self._space.notify_all()
+        return "".join(item if isinstance(item, str) else item.mark * item.count for item in items)
+
+    def run(self):
+        stream = self.stream or sys.__stdout__
+        while True:
+            with self._cond:
+                while not self._items and not self._stopped:
+                    self._cond.wait()
+                stopped = self._stopped
+            if not stopped and self.linger:
+                time.sleep(self.linger) # let the burst of writes coalesce
+            with self._cond:
+                data = self._take()
+            if data:
+                try:
+                    stream.write(data)
+                    stream.flush()
+                except Exception:
+                    pass  # Handle exceptions as needed
+            if stopped:
+                break
+
+    def close(self):
+        with self._lock:
+            self._stopped = True
+            self._cond.notify()
+            self._space.notify_all()
+
+
 class StdoutRedirector:
-    def __init__(self, output_queue):
-        self.output_queue = output_queue
+    def __init__(self, channel):
+        self.channel = channel
 
     def write(self, message):
-        self.output_queue.put(message)
+        return self.channel.write(message)
 
     def flush(self):
-        pass  # Required for file-like objects
-
-def output_worker(output_queue):
-    while True:
-        message = output_queue.get()
-        if message == 'STOP':
-            break
-        try:
-            sys.__stdout__.write(message)
-            sys.__stdout__.flush()
-        except Exception:
-            pass  # Handle exceptions as needed
-        finally:
-            output_queue.task_done()
+        pass  # the worker flushes once per batch
 
 def start_redirect():
-    output_queue = queue.Queue()
-    worker_thread = threading.Thread(target=output_worker, args=(output_queue,))
+    channel = OutputChannel()
+    worker_thread = threading.Thread(target=channel.run, name="OutputChannel")
     worker_thread.daemon = True  # Allows the program to exit even if the thread is running
     worker_thread.start()
 
     # Redirect sys.stdout
     original_stdout = sys.stdout
-    sys.stdout = StdoutRedirector(output_queue)
+    sys.stdout = StdoutRedirector(channel)
 
-    return output_queue, worker_thread, original_stdout
+    return channel, worker_thread, original_stdout
 
-def stop_redirect(output_queue, worker_thread, original_stdout):
+def stop_redirect(channel, worker_thread, original_stdout):
     # Restore sys.stdout
     sys.stdout = original_stdout
 
-    # Signal the worker thread to stop
-    output_queue.put('STOP')
+    # Signal the worker thread to write what's left and stop
+    channel.close()
     worker_thread.join()
 
-listener.start()
-output_queue, worker_thread, original_stdout = start_redirect()
+output_channel = None
+worker_thread = None
+original_stdout = None
+
+# progress marks are rate limited before they reach the channel
+PROGRESS_INTERVAL = 0.1
+_last_progress = 0.0
+
+def progress(mark="."):
+    """Progress mark for polling loops: at most one per PROGRESS_INTERVAL, never blocks on the console"""
+    global _last_progress
+    now = time.monotonic()
+    if now - _last_progress < PROGRESS_INTERVAL:
+        return
+    _last_progress = now
+    if output_channel is not None:
+        output_channel.progress(mark)
+    else:
+        print(mark, end="", flush=True)
+
+def start():
+    """Start the log listener and the stdout worker thread, nothing runs until a mode needs it"""
+    global output_channel, worker_thread, original_stdout
+    if worker_thread is not None:
+        return
+    root_logger.addHandler(queue_handler)
+    listener.start()
+    output_channel, worker_thread, original_stdout = start_redirect()
+    atexit.register(redirect_unload)
 
-@atexit.register
 def redirect_unload():
-    stop_redirect(output_queue, worker_thread, original_stdout)
+    global output_channel, worker_thread
+    if worker_thread is None:
+        return
+    stop_redirect(output_channel, worker_thread, original_stdout)
+    output_channel = None
+    worker_thread = None
     listener.stop()
-    
+    root_logger.removeHandler(queue_handler)
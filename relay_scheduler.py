@@ -0,0 +1,129 @@
+#
+#  relay_scheduler.py - run several reader/emulator device pairs at once
+#
+'''
+Every pair runs in its own thread with its own libnfc context and device
+handles (libnfc calls release the GIL, so the pairs don't serialize on it).
+
+    s = RelayScheduler()
+    s.add_pair(initiator=1, target=0, log_fname="logs/pair0.json")
+    s.add_pair(initiator="pn532_spi:/dev/spidev0.1:1953000", target="pn532_uart:/dev/ttyS1", log_fname="logs/pair1.json")
+    s.start()
+    s.join()
+    for result in s.results():
+        print(result)
+'''
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+from nfc_wrapper import NfcContext, sErrorMessages
+from NFCRelay import NFCRelay
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RelayPair:
+    initiator: Union[int, str]  # device index, connstring, or -1 with log_replay
+    target: Union[int, str]
+    log_fname: Optional[str] = None
+    log_replay: Optional[str] = None
+    easy_framing: bool = True
+    data_hook: Optional[Callable] = None
+    hook_deadline_ms: Optional[float] = None
+    rules: Optional[str] = None  # hook_rules.py rules file applied before data_hook
+    observers: list = field(default_factory=list)
+    observer_processes: bool = False
+    wtx_enabled: bool = True
+    fsci: int = 5
+    max_frames: Optional[int] = None
+    tag_timeout_ms: int = 0
+    relay_timeout_ms: int = 0
+    name: str = ""
+
+
+@dataclass
+class RelayResult:
+    name: str
+    log_fname: Optional[str]
+    frames: int = 0
+    stats: dict = field(default_factory=dict)
+    tag_err: Optional[str] = None
+    reader_err: Optional[str] = None
+    error: Optional[str] = None
+
+
+class RelaySession(threading.Thread):
+    def __init__(self, pair: RelayPair):
+        threading.Thread.__init__(self, name="relay-{}".format(pair.name))
+        self.daemon = True
+        self.pair = pair
+        self.relay = None
+        self.result = RelayResult(name=pair.name, log_fname=pair.log_fname)
+
+    def run(self):
+        pair = self.pair
+        context = NfcContext()
+        try:
+            self.relay = r = NFCRelay(pair.initiator, pair.target, easy_framing=pair.easy_framing,
+                                      log_fname=pair.log_fname, verbose=False, context=context.c,
+                                      max_frames=pair.max_frames)
+            r.wtx_enabled = pair.wtx_enabled
+            r.fsci = pair.fsci
+            if pair.data_hook is not None:
+                r.set_data_hook(pair.data_hook, deadline_ms=pair.hook_deadline_ms)
+            for observer in pair.observers:
+                r.add_observer(observer, processes=pair.observer_processes)
+            if pair.rules:
+                r.set_data_rules(pair.rules)
+            if r.reader_setup(log_fname=pair.log_replay):
+                if r.reader_get_targets(pair.tag_timeout_ms) == 0:
+                    self.result.error = "No tag/device found"
+                    return
+                r.select_target()
+            if not r.emulator_setup():
+                self.result.error = "Can't open emulator"
+                return
+            logger.info("[{}] relaying frames".format(pair.name))
+            r.relay_frames(pair.relay_timeout_ms)
+            r.fl.save()
+            self.result.frames = r.fl.get_frame_list_len()
+            r.fl.close_spill()
+            self.result.stats = r.stats.summary()
+            self.result.tag_err = sErrorMessages.get(r.pndTag.get_last_err())
+            self.result.reader_err = sErrorMessages.get(r.pndReader.get_last_err())
+        except Exception as e:
+            logger.exception("[{}] relay session failed".format(pair.name))
+            self.result.error = str(e)
+        finally:
+            if self.relay is not None:
+                self.relay.close()
+            context.close()
+
+
+class RelayScheduler:
+    def __init__(self):
+        self.sessions = []
+
+    def add_pair(self, initiator, target, **kwargs):
+        pair = RelayPair(initiator, target, **kwargs)
+        if not pair.name:
+            pair.name = "pair{}".format(len(self.sessions))
+        self.sessions.append(RelaySession(pair))
+        return pair
+
+    def start(self):
+        for session in self.sessions:
+            session.start()
+
+    def join(self, timeout=None):
+        for session in self.sessions:
+            session.join(timeout)
+
+    def is_alive(self):
+        return any(session.is_alive() for session in self.sessions)
+
+    def results(self):
+        return [session.result for session in self.sessions]
@@ -0,0 +1,86 @@
+#
+#  relay_stats.py - per-phase latency samples and counters of a relay session
+#
+import json
+from array import array
+
+# phases recorded by NFCRelay.relay_frames(), all in monotonic nanoseconds
+PHASE_READER_RECEIVE = "reader_receive"   # waiting for / receiving the reader's frame
+PHASE_HOOK = "hook"                       # data_hook calls of one exchange
+PHASE_CARD_TRANSCEIVE = "card_transceive" # real card (or replay source) round trip
+PHASE_EMULATOR_SEND = "emulator_send"     # sending the response to the reader
+PHASE_RESPONSE = "response"               # reader frame received -> response send starts (what the reader's FWT measures)
+PHASE_OVERHEAD = "overhead"               # response time not spent in the hook or the card, i.e. Python/relay code
+
+PHASES = [PHASE_READER_RECEIVE, PHASE_HOOK, PHASE_CARD_TRANSCEIVE, PHASE_EMULATOR_SEND, PHASE_RESPONSE, PHASE_OVERHEAD]
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_samples:
+        return 0
+    rank = max(1, -(-len(sorted_samples) * p // 100)) # ceil without floats
+    return sorted_samples[rank - 1]
+
+
+def fwt_verdict(summary, fwt_ms):
+    """How the response p99 compares to FWT, responses over it are fine when S(WTX) extended the wait"""
+    if summary['phases'][PHASE_RESPONSE]['p99_ms'] < fwt_ms:
+        return "fits"
+    if summary['counters'].get("wtx_exchanges"):
+        return "over FWT, extended with S(WTX)"
+    return "EXCEEDS FWT"
+
+
+class RelayStats:
+    def __init__(self):
+        self.samples = {phase: array('q') for phase in PHASES}
+        self.counters = {}
+
+    def clear(self):
+        for samples in self.samples.values():
+            del samples[:]
+        self.counters.clear()
+
+    def add(self, phase, ns):
+        self.samples[phase].append(ns)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        result = {'phases': {}, 'counters': dict(self.counters)}
+        for phase, samples in self.samples.items():
+            if not samples:
+                continue
+            s = sorted(samples)
+            result['phases'][phase] = {
+                'count': len(s),
+                **{'p{}_ms'.format(p): percentile(s, p) / 1e6 for p in PERCENTILES},
+                'max_ms': s[-1] / 1e6,
+            }
+        return result
+
+    def format_summary(self, fwt_ms=None):
+        summary = self.summary()
+        lines = ["{:<16} {:>6} {:>10} {:>10} {:>10} {:>10}".format("phase", "count", "p50, ms", "p95, ms", "p99, ms", "max, ms")]
+        for phase, s in summary['phases'].items():
+            lines.append("{:<16} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                phase, s['count'], s['p50_ms'], s['p95_ms'], s['p99_ms'], s['max_ms']))
+        if fwt_ms is not None and PHASE_RESPONSE in summary['phases']:
+            p99 = summary['phases'][PHASE_RESPONSE]['p99_ms']
+            lines.append("Advertised FWT: {:.1f} ms, response p99 {:.3f} ms ({})".format(
+                fwt_ms, p99, fwt_verdict(summary, fwt_ms)))
+        for name, value in summary['counters'].items():
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+    def save_to(self, fname, fwt_ms=None):
+        summary = self.summary()
+        summary['fwt_ms'] = fwt_ms
+        if fwt_ms is not None and PHASE_RESPONSE in summary['phases']:
+            summary['fwt_verdict'] = fwt_verdict(summary, fwt_ms)
+        with open(fname, 'w') as f:
+            json.dump(summary, f, indent=4)
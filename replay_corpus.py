@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+#
+#  replay_corpus.py - merged replay index over a directory of recorded logs
+#
+'''
+The request/response exchanges of every log under a directory are merged into
+one replay index: the first response per APDU header and one conversation
+automaton (see nfc_helper.ConversationAutomaton) in which sessions sharing a
+prefix share their nodes. Identical responses are stored once.
+
+The index is kept next to the logs in a JSON sidecar (.replay_index.json):
+the response frames, the request headers and the node table of the automaton,
+with bytes as hex, together with the path, mtime and size of every log it was
+built from. It holds data only, loading it runs no code from the capture
+directory. Any added, removed or changed log rebuilds it on the next load.
+
+    nfc_mitm.py -r captures/                 # replay from every log in captures/
+    replay_corpus.py captures/ --rebuild     # build the index ahead of time
+'''
+import os
+import json
+from time import perf_counter
+from argparse import ArgumentParser
+
+from nfc_helper import FrameLogger, ConversationAutomaton, recorded_sessions, frame_from_dict, BytearrayEncoder
+from log_analytics import expand_log_fnames
+
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_FNAME = ".replay_index.json"
+INDEX_VERSION = 2
+
+
+def log_sources(log_fnames, path):
+    """{log path relative to path: (mtime_ns, size)}, what the index is valid for"""
+    sources = {}
+    for log_fname in log_fnames:
+        st = os.stat(log_fname)
+        sources[os.path.relpath(log_fname, path)] = [st.st_mtime_ns, st.st_size]
+    return sources
+
+
+class ReplayCorpus:
+    def __init__(self, path, index_fname=None):
+        self.path = path
+        self.index_fname = index_fname or os.path.join(path, INDEX_FNAME)
+        self.sources = {}
+        self.resp_by_req = {}   # request header (data[:5]) -> response frame
+        self.conversation = ConversationAutomaton()
+        self.exchanges = 0      # exchanges in all logs
+        self.responses = 0      # distinct responses stored
+
+    def load(self, rebuild=False):
+        """Load the sidecar index if it is up to date, rebuild and save it otherwise. True if it was cached"""
+        t0 = perf_counter()
+        log_fnames = expand_log_fnames([self.path])
+        sources = log_sources(log_fnames, self.path)
+        if not rebuild and self.read_index(sources):
+            logger.info("Replay index of {} logs loaded from {} in {:.1f} ms".format(
+                len(sources), self.index_fname, (perf_counter() - t0) * 1000))
+            return True
+        self.build(log_fnames)
+        self.sources = sources
+        self.write_index()
+        logger.info("Replay index of {} logs built in {:.1f} ms: {} exchanges, {} distinct responses".format(
+            len(sources), (perf_counter() - t0) * 1000, self.exchanges, self.responses))
+        return False
+
+    def build(self, log_fnames):
+        self.resp_by_req = {}
+        self.conversation = ConversationAutomaton()
+        self.exchanges = 0
+        interned = {} # (data, result) -> response frame
+        for log_fname in log_fnames:
+            fl = FrameLogger()
+            fl.load_from(log_fname)
+            for session in recorded_sessions(fl):
+                exchanges = []
+                for request, resp in session:
+                    resp = interned.setdefault((bytes(resp.data), resp.result), resp)
+                    self.resp_by_req.setdefault(bytes(request[:5]), resp)
+                    exchanges.append((request, resp))
+                self.conversation.add_conversation(exchanges)
+                self.exchanges += len(exchanges)
+        self.responses = len(interned)
+
+    def read_index(self, sources):
+        try:
+            with open(self.index_fname) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring replay index {}: {}".format(self.index_fname, e))
+            return False
+        if not isinstance(state, dict) or state.get('version') != INDEX_VERSION or state.get('sources') != sources:
+            return False
+        try:
+            frames = [frame_from_dict(d) for d in state['frames']]
+            conversation = state['conversation']
+            self.conversation = ConversationAutomaton()
+            self.conversation.__setstate__({
+                'responses': [None if n is None else frames[n] for n in conversation['responses']],
+                'children': [[(bytes.fromhex(request), i) for request, i in children] for children in conversation['children']],
+                'by_header': [[(bytes.fromhex(header), i) for header, i in by_header] for by_header in conversation['by_header']],
+                'by_request': [(bytes.fromhex(request), i) for request, i in conversation['by_request']],
+            })
+            self.resp_by_req = {bytes.fromhex(header): frames[n] for header, n in state['resp_by_req']}
+            self.exchanges = state['exchanges']
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            logger.warning("Ignoring replay index {}: {}".format(self.index_fname, e))
+            return False
+        self.sources = state['sources']
+        self.responses = len(frames)
+        return True
+
+    def write_index(self):
+        frames = [] # every response frame once, referenced by position
+        frame_ids = {}
+
+        def frame_id(frame):
+            if frame is None:
+                return None
+            n = frame_ids.get(id(frame))
+            if n is None:
+                n = frame_ids[id(frame)] = len(frames)
+                frames.append(frame)
+            return n
+
+        conversation = self.conversation.__getstate__()
+        state = {
+            'version': INDEX_VERSION,
+            'sources': self.sources,
+            'exchanges': self.exchanges,
+            'resp_by_req': [(header.hex(), frame_id(resp)) for header, resp in self.resp_by_req.items()],
+            'conversation': {
+                'responses': [frame_id(resp) for resp in conversation['responses']],
+                'children': [[(request.hex(), i) for request, i in children] for children in conversation['children']],
+                'by_header': [[(header.hex(), i) for header, i in by_header] for by_header in conversation['by_header']],
+                'by_request': [(request.hex(), i) for request, i in conversation['by_request']],
+            },
+            'frames': [frame.__dict__() for frame in frames],
+        }
+        tmp_fname = self.index_fname + ".tmp"
+        try:
+            with open(tmp_fname, 'w') as f:
+                json.dump(state, f, cls=BytearrayEncoder, separators=(",", ":"))
+            os.replace(tmp_fname, self.index_fname)
+        except OSError as e: # e.g. a read-only capture archive, the index is just rebuilt next time
+            logger.warning("Can't save replay index {}: {}".format(self.index_fname, e))
+
+
+def main():
+    parser = ArgumentParser(description="Build or check the merged replay index of a directory of logs")
+    parser.add_argument("path", help="Directory with recorded logs (*.json, *.jsonl, *.nfcb)")
+    parser.add_argument("-r", "--rebuild", dest="rebuild", action='store_true', help="Rebuild the index even if it is up to date")
+    args = parser.parse_args()
+    corpus = ReplayCorpus(args.path)
+    t0 = perf_counter()
+    cached = corpus.load(rebuild=args.rebuild)
+    print("%s: %d logs, %d exchanges, %d request headers, %d distinct responses, %s in %.1f ms" % (
+        corpus.index_fname, len(corpus.sources), corpus.exchanges, len(corpus.resp_by_req), corpus.responses,
+        "loaded" if cached else "built", (perf_counter() - t0) * 1000))
+
+
+if __name__ == "__main__":
+    main()
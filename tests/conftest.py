@@ -0,0 +1,36 @@
+#
+#  conftest.py - run the tests on the simulated libnfc backend from the repository root modules
+#
+import os
+import sys
+
+os.environ.setdefault("LIBNFC_BACKEND", "sim")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def sim_relay():
+    """sim_relay(reader, card, **relay_kwargs) -> NFCRelay set up on simulated devices, ready for relay_frames()"""
+    from libnfc_ffi import libnfc_sim
+    from NFCRelay import NFCRelay
+    relays = []
+
+    def make(reader, card, **kwargs):
+        libnfc_sim.configure(devices=[libnfc_sim.SimDevice("sim:emulator", reader=reader),
+                                      libnfc_sim.SimDevice("sim:reader", card=card)])
+        kwargs.setdefault('verbose', False)
+        kwargs.setdefault('stream_log', False)
+        r = NFCRelay(1, 0, **kwargs)
+        r.reader_setup()
+        r.reader_get_targets()
+        r.select_target()
+        r.emulator_setup()
+        relays.append(r)
+        return r
+
+    yield make
+    for r in relays:
+        r.close()
+    libnfc_sim.configure()
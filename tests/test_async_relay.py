@@ -0,0 +1,49 @@
+import asyncio
+
+from libnfc_ffi import libnfc_sim
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+from nfc_helper import FrameDirection
+from async_relay import AsyncNFCRelay
+
+SELECT = bytes.fromhex("00a4040000")
+GET_DATA = bytes.fromhex("80ca9f1700")
+
+
+class PatchingHook:
+    """Coroutine hook that owns a resource, closed by the relay"""
+    def __init__(self):
+        self.closed = False
+
+    async def __call__(self, direction, data, easy_framing):
+        await asyncio.sleep(0)
+        return False, data.replace(b"\x9f\x17", b"\x9f\x36")
+
+    def close(self):
+        self.closed = True
+
+
+def test_async_relay_awaits_the_hook_and_closes_it():
+    reader = VirtualReader([SELECT, GET_DATA])
+    card = VirtualCard({SELECT: bytes.fromhex("9000"), bytes.fromhex("80ca9f3600"): bytes.fromhex("9f3601039000")})
+    libnfc_sim.configure(devices=[libnfc_sim.SimDevice("sim:emulator", reader=reader),
+                                  libnfc_sim.SimDevice("sim:reader", card=card)])
+    try:
+        r = AsyncNFCRelay(1, 0, verbose=False, stream_log=False)
+        hook = PatchingHook()
+        r.set_data_hook(hook)
+
+        async def main():
+            queue = r.subscribe()
+            assert await r.run()
+            frames = []
+            while not queue.empty():
+                frames.append(queue.get_nowait())
+            return frames
+
+        frames = asyncio.run(main())
+    finally:
+        libnfc_sim.configure()
+    assert card.requests == [SELECT, bytes.fromhex("80ca9f3600")]
+    assert reader.responses == [bytes.fromhex("9000"), bytes.fromhex("9f3601039000")]
+    assert [bytes(f.data) for f in frames if f.direction == FrameDirection.FromReader and f.result > 0] == [SELECT, GET_DATA]
+    assert hook.closed and r.executor is None # run() closed the relay
@@ -0,0 +1,90 @@
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+from nfc_helper import apdu_is_extended
+
+SELECT = bytes.fromhex("00a4040007a000000004101000")
+READ_BINARY_EXT = bytes.fromhex("00b0000000025a") # case 2E, Le = 602
+LONG_RESPONSE = bytes(range(256)) * 2 + bytes(88) + bytes.fromhex("9000")
+ATS_FSC_256 = bytes.fromhex("78779102")
+
+
+def payloads(blocks):
+    return b"".join(block[1:] for block in blocks)
+
+
+def test_extended_length_detection():
+    assert apdu_is_extended(bytes.fromhex("00b0000000ffff"))             # 2E
+    assert apdu_is_extended(bytes.fromhex("00d60000000003010203"))       # 3E
+    assert apdu_is_extended(bytes.fromhex("80e800000000030102030000"))   # 4E
+    assert apdu_is_extended(bytes.fromhex("90e800000000030102030000"))
+    assert not apdu_is_extended(bytes.fromhex("00a4040007a000000004101000")) # short
+    assert not apdu_is_extended(bytes.fromhex("bd010000000000"))         # DESFire native ReadData
+    assert not apdu_is_extended(bytes.fromhex("bd0100000000200000"))
+    assert not apdu_is_extended(bytes.fromhex("ffca000000000000"))
+    assert not apdu_is_extended(bytes.fromhex("00d60000000005010203"))   # Lc doesn't match the data
+
+
+def test_long_response_is_chained_to_the_reader_in_its_fsd(sim_relay):
+    reader = VirtualReader([READ_BINARY_EXT], rats=bytes.fromhex("e080")) # FSD 256
+    card = VirtualCard({READ_BINARY_EXT: LONG_RESPONSE, SELECT: bytes.fromhex("9000")}, ats=ATS_FSC_256)
+    r = sim_relay(reader, card)
+    r.relay_frames()
+    assert card.requests == [READ_BINARY_EXT]
+    assert payloads(reader.responses) == LONG_RESPONSE
+    assert [len(block) for block in reader.responses] == [254, 254, 97]
+    assert reader.chained_blocks == 2
+    assert r.stats.counters['chained_exchanges'] == 1
+
+
+def test_chaining_to_the_reader_without_rats_uses_fragment_size(sim_relay):
+    reader = VirtualReader([READ_BINARY_EXT])
+    card = VirtualCard({READ_BINARY_EXT: LONG_RESPONSE})
+    r = sim_relay(reader, card)
+    r.relay_frames()
+    assert payloads(reader.responses) == LONG_RESPONSE
+    assert max(len(block) for block in reader.responses) == r.fragment_size + 1
+
+
+def test_card_session_stays_in_raw_framing_after_chaining(sim_relay):
+    read_ext = bytes.fromhex("00b000000000c8") # case 2E, the response fits one frame to the reader
+    response = bytes(200) + bytes.fromhex("9000")
+    reader = VirtualReader([SELECT, SELECT, read_ext, SELECT, read_ext, SELECT])
+    card = VirtualCard({read_ext: response, SELECT: bytes.fromhex("6f009000")})
+    r = sim_relay(reader, card)
+    r.relay_frames()
+    assert card.requests == [SELECT, SELECT, read_ext, SELECT, read_ext, SELECT]
+    assert reader.responses == [bytes.fromhex("6f009000")] * 2 + [response, bytes.fromhex("6f009000")] * 2
+    assert card.block_errors == 0 # the card never saw a block number out of step
+    assert r.pndReader.raw_iso_dep
+    assert card.pn53x_block_num == 0 # the two exchanges before chaining only
+    # a new selection goes back to easy framing
+    ret, nt = r.pndReader.select_passive_target()
+    assert ret > 0 and not r.pndReader.raw_iso_dep
+    assert bytes(r.pndReader.transceive_bytes(SELECT)[0]) == bytes.fromhex("6f009000")
+    assert card.block_errors == 0
+
+
+def test_long_command_is_chained_to_the_card_in_its_fsc(sim_relay):
+    reader = VirtualReader([SELECT])
+    card = VirtualCard(handler=lambda request: len(request).to_bytes(2, "big") + bytes.fromhex("9000"))
+    r = sim_relay(reader, card)
+    apdu = bytes.fromhex("00d6000000012c") + bytes(300) # case 3E, Lc = 300
+    assert r.pndReader.needs_chaining(apdu)
+    resp, ret = r.pndReader.transceive_chained(apdu)
+    assert bytes(resp) == (len(apdu)).to_bytes(2, "big") + bytes.fromhex("9000")
+    assert card.requests == [apdu]
+    assert card.block_errors == 0
+
+
+def test_block_number_follows_the_pn53x_chaining_before_raw_framing(sim_relay):
+    update = bytes.fromhex("00d600005f") + bytes(95) # 100 bytes: chained by the PN53x in 4 blocks of FSC 32
+    read_ext = bytes.fromhex("00b000000000c8")
+    response = bytes(200) + bytes.fromhex("9000")
+    reader = VirtualReader([SELECT, update, read_ext, SELECT])
+    card = VirtualCard({read_ext: response, update: bytes.fromhex("9000"), SELECT: bytes.fromhex("6f009000")},
+                       ats=bytes.fromhex("72779102")) # FSCI 2, FSC 32
+    r = sim_relay(reader, card)
+    r.relay_frames()
+    assert card.requests == [SELECT, update, read_ext, SELECT]
+    assert reader.responses == [bytes.fromhex("6f009000"), bytes.fromhex("9000"), response, bytes.fromhex("6f009000")]
+    assert r.pndReader.raw_iso_dep
+    assert card.block_errors == 0
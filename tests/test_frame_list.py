@@ -0,0 +1,96 @@
+import gc
+import os
+
+from nfc_helper import FrameLogger, FrameList, FrameDirection
+
+
+def make_logger(n, **kwargs):
+    fl = FrameLogger(**kwargs)
+    for i in range(n):
+        fl.add_frame_by_data(i, float(i), bytes([i & 0xFF]) * (i % 7), 0,
+                             FrameDirection.FromReader if i % 2 == 0 else FrameDirection.ToReader)
+    return fl
+
+
+def test_save_streams_the_pretty_json(tmp_path):
+    for n in (0, 1, 50):
+        fl = make_logger(n, max_frames=8)
+        fname = str(tmp_path / "log{}.json".format(n))
+        fl.save_to(fname)
+        with open(fname) as f:
+            assert f.read() == fl.to_json_pretty()
+        loaded = FrameLogger()
+        loaded.load_from(fname)
+        assert [f.__dict__() for f in loaded.iter_all()] == [f.__dict__() for f in fl.iter_all()]
+        fl.close_spill()
+
+
+def test_temporary_spill_is_removed_on_clear():
+    fl = make_logger(20, max_frames=4)
+    spill_fname = fl.spill.log_fname
+    assert os.path.exists(spill_fname)
+    assert fl.get_frame_list_len() == 20
+    fl.clear()
+    assert not os.path.exists(spill_fname)
+    assert fl.get_frame_list_len() == 0
+
+
+def test_temporary_spill_is_removed_with_the_list():
+    fl = FrameList(max_frames=2)
+    for i in range(5):
+        fl.add_frame_by_data(i, 0.0, b"\x00\xa4", 0, FrameDirection.FromReader)
+    spill_fname = fl.spill.log_fname
+    del fl
+    gc.collect()
+    assert not os.path.exists(spill_fname)
+
+
+def test_column_accessors_skip_popped_frames():
+    fl = make_logger(10, max_frames=6)
+    c = fl.frame_list
+    with c.column('index') as index:
+        assert list(index) == [4, 5, 6, 7, 8, 9]
+    with c.payload(1) as view:
+        assert bytes(view) == b"\x05" * 5
+    assert [(n, i) for n, i, d in fl.iter_index_direction()] == [(n, n) for n in range(10)]
+    assert fl.get_data(2) == b"\x02" * 2 and fl.get_data(9) == b"\x09" * 2
+    fl.close_spill()
+
+
+def test_set_frame_writes_back():
+    fl = make_logger(4)
+    frame = fl.get_frame(1)
+    frame.data[:] = b"\x90\x00\x01\x02\x03\x04\x05\x06"
+    frame.result = 8
+    assert fl.get_frame(1).data != frame.data # a copy
+    fl.set_frame(1, frame)
+    assert fl.get_frame(1) == frame
+    assert fl.get_frame(2).data == b"\x02" * 2
+    assert isinstance(fl.get_frame_list(), tuple)
+
+
+def test_frames_and_target_data_pickle():
+    import pickle
+    from nfc_helper import Frame, TargetData
+    frame = Frame(3, 1.5, bytearray(b"\x90\x00"), 2, FrameDirection.FromCard, False)
+    assert pickle.loads(pickle.dumps(frame)) == frame
+    target = TargetData(bytearray.fromhex("04a1b2c3"), bytearray.fromhex("0004"), 0x20)
+    assert pickle.loads(pickle.dumps(target)) == target
+
+
+def test_compaction_keeps_frames_moved_by_set_frame():
+    def data(i):
+        return bytes([i & 0xFF]) * (i % 7)
+    fl = FrameList(max_frames=1100)
+    for i in range(1200):
+        fl.add_frame_by_data(i, float(i), data(i), 0, FrameDirection.FromReader)
+    frame = fl.get_frame(1100)
+    frame.data[:] = b"\xee" * 10 # longer than the old payload, moved to the arena end
+    fl.set_frame(1100, frame)
+    for i in range(1200, 2400): # pops past the compaction threshold
+        fl.add_frame_by_data(i, float(i), data(i), 0, FrameDirection.FromReader)
+    assert fl.frame_list._head < 1024
+    for n, frame in enumerate(fl.iter_all()):
+        assert frame.index == n
+        assert frame.data == (b"\xee" * 10 if n == 1100 else data(n))
+    fl.close_spill()
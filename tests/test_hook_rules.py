@@ -0,0 +1,72 @@
+import os
+import time
+
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+from nfc_helper import FrameDirection, recorded_sessions
+from hook_rules import RuleEngine, RuleAutomaton, Rule
+
+READ_RECORD = bytes.fromhex("00b2010c00")
+SELECT = bytes.fromhex("00a4040000")
+GET_DATA = bytes.fromhex("80ca9f1700")
+
+
+def rules(*dicts):
+    return [Rule.from_dict(priority, d) for priority, d in enumerate(dicts)]
+
+
+def test_partial_masks_are_checked_after_the_automaton():
+    automaton = RuleAutomaton(rules({"pattern": "00 B2 01 0C", "mask": "FF FF FF F8", "action": "drop"},
+                                    {"pattern": "00 ?? 01", "action": "fragment"}))
+    assert [r.action for r in automaton.match(bytes.fromhex("00b2010f00"))] == ["drop", "fragment"]
+    assert [r.action for r in automaton.match(bytes.fromhex("00b2011400"))] == ["fragment"]
+    assert [r.action for r in automaton.match(bytes.fromhex("00b20200"))] == []
+
+
+def test_many_partial_masks_compile_quickly():
+    patterns = [{"pattern": "{:02X} {:02X} {:02X} {:02X}".format(i, i, i, i), "mask": "F0 F0 F0 F0", "action": "fragment"}
+                for i in range(0, 256, 16)]
+    t0 = time.perf_counter()
+    automaton = RuleAutomaton(rules(*patterns))
+    assert time.perf_counter() - t0 < 1
+    assert len(automaton.match(bytes.fromhex("1f1e1d1c"))) == 1
+
+
+def test_dropped_reader_frame_keeps_index_pairs(sim_relay):
+    reader = VirtualReader([READ_RECORD, SELECT, GET_DATA])
+    card = VirtualCard({SELECT: bytes.fromhex("9000"), GET_DATA: bytes.fromhex("9f1701039000"), READ_RECORD: bytes.fromhex("6a82")})
+    r = sim_relay(reader, card)
+    r.set_data_hook(RuleEngine(rules=[{"direction": "FromReader", "pattern": "00 B2 01 0C", "mask": "FF FF FF F8", "action": "drop"}]))
+    r.relay_frames()
+    assert card.requests == [SELECT, GET_DATA]
+    assert reader.responses == [bytes.fromhex("9000"), bytes.fromhex("9f1701039000")]
+    assert r.stats.counters['dropped_frames'] == 1
+    # every request keeps an even index and its response the next one, as replay expects
+    from_reader = [f.index for f in r.fl.iter_all() if f.direction == FrameDirection.FromReader]
+    assert all(index % 2 == 0 for index in from_reader)
+    sessions = list(recorded_sessions(r.fl))
+    assert [(bytes(req), bytes(resp.data)) for req, resp in sessions[0]] == [
+        (SELECT, bytes.fromhex("9000")), (GET_DATA, bytes.fromhex("9f1701039000"))]
+
+
+def test_rules_file_is_reloaded_in_the_background(tmp_path):
+    fname = str(tmp_path / "rules.json")
+    with open(fname, "w") as f:
+        f.write('[{"pattern": "00 A4", "action": "drop"}]')
+    engine = RuleEngine(fname, reload_interval=0.01)
+    try:
+        assert engine(FrameDirection.FromReader, SELECT, True)[1] is None
+        with open(fname, "w") as f:
+            f.write('[{"pattern": "00 A4", "action": "replace", "data": "00A4040100"}]')
+        os.utime(fname, ns=(time.time_ns(), time.time_ns() + 10**9))
+        deadline = time.monotonic() + 2
+        while engine.rules[0].action != "replace" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert engine(FrameDirection.FromReader, SELECT, True)[1] == bytes.fromhex("00a4040100")
+        with open(fname, "w") as f:
+            f.write('[{"pattern": "00 A4"')
+        os.utime(fname, ns=(time.time_ns(), time.time_ns() + 2 * 10**9))
+        time.sleep(0.1)
+        assert engine.rules[0].action == "replace" # a broken file keeps the previous rules
+    finally:
+        engine.close()
+    assert engine._reloader is None
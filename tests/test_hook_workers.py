@@ -0,0 +1,64 @@
+import time
+import threading
+
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+from nfc_helper import FrameDirection
+from hook_workers import DeadlineHook
+from hook_rules import RuleEngine
+
+SELECT = bytes.fromhex("00a4040000")
+GET_DATA = bytes.fromhex("80ca9f1700")
+
+
+def test_deadline_miss_forwards_the_original_frame(sim_relay):
+    release = threading.Event()
+
+    def slow_hook(direction, data, easy_framing):
+        if direction == FrameDirection.FromReader and data[:2] == GET_DATA[:2]:
+            release.wait(2)
+        return False, data.replace(b"\x9f\x17", b"\x9f\x36")
+
+    reader = VirtualReader([SELECT, GET_DATA])
+    card = VirtualCard({SELECT: bytes.fromhex("9000"), GET_DATA: bytes.fromhex("9f1701039000")})
+    r = sim_relay(reader, card)
+    r.set_data_hook(slow_hook, deadline_ms=50)
+    r.relay_frames()
+    release.set()
+    assert card.requests == [SELECT, GET_DATA] # unchanged, the hook missed its deadline
+    assert reader.responses == [bytes.fromhex("9000"), bytes.fromhex("9f3601039000")]
+    assert r.stats.counters['hook_deadline_missed'] == 1
+
+
+def test_relay_closes_a_deadline_hook_wrapped_by_rules(sim_relay, tmp_path):
+    fname = str(tmp_path / "rules.json")
+    with open(fname, "w") as f:
+        f.write('[{"pattern": "00 A4", "action": "fragment"}]')
+    r = sim_relay(VirtualReader([SELECT]), VirtualCard({SELECT: bytes.fromhex("9000")}))
+    r.set_data_hook(lambda direction, data, easy_framing: (False, data), deadline_ms=50)
+    deadline_hook = r.data_hook
+    engine = r.set_data_rules(fname)
+    assert engine.next_hook is deadline_hook
+    r.relay_frames()
+    assert deadline_hook._executor is not None
+    r.close()
+    assert deadline_hook._executor is None
+    assert engine._reloader is None
+
+
+def test_replaced_hook_is_closed(sim_relay):
+    closed = []
+
+    class Hook:
+        def __call__(self, direction, data, easy_framing):
+            return False, data
+
+        def close(self):
+            closed.append(self)
+
+    hook = Hook()
+    r = sim_relay(VirtualReader([SELECT]), VirtualCard())
+    r.set_data_hook(RuleEngine(rules=[], next_hook=hook))
+    r.set_data_hook(Hook())
+    assert closed == [hook]
+    r.close()
+    assert len(closed) == 2
@@ -0,0 +1,35 @@
+import pytest
+
+from nfc_helper import FrameLogger, FrameDirection, FrameStreamWriter, FRAME_DIRECTIONS
+
+np = pytest.importorskip("numpy")
+import log_analytics
+
+
+def make_logger(n):
+    fl = FrameLogger()
+    for i in range(n):
+        direction = FrameDirection.FromReader if i % 2 == 0 else FrameDirection.FromCard
+        data = bytes.fromhex("00b2010c00") if i % 2 == 0 else bytes([i & 0xFF]) * (i % 5) + bytes.fromhex("9000")
+        fl.add_frame_by_data(i, i * 0.001, data, len(data) if i % 11 else -6, direction, True)
+    return fl
+
+
+def test_log_formats_load_the_same_columns(tmp_path):
+    fl = make_logger(50)
+    fl.save_to(str(tmp_path / "log.json"))
+    fl.save_to(str(tmp_path / "log.nfcb"))
+    stream = FrameStreamWriter(str(tmp_path / "log.jsonl"))
+    for frame in fl.iter_all():
+        stream.write(frame)
+    stream.close()
+    expected = [(f.index, f.time, bytes(f.data), f.result, f.direction) for f in fl.iter_all()]
+    for ext in (".json", ".jsonl", ".nfcb"):
+        a = log_analytics.load_arrays([str(tmp_path / ("log" + ext))])
+        arena = a['arena'].tobytes()
+        frames = [(int(a['index'][n]), float(a['time'][n]), arena[a['starts'][n]:a['starts'][n] + a['lens'][n]],
+                   int(a['result'][n]), FRAME_DIRECTIONS[a['direction'][n]]) for n in range(len(a['index']))]
+        assert frames == expected, ext
+        assert a['easy_framing'].all()
+    summary = log_analytics.analyze([str(tmp_path / "log.json"), str(tmp_path / "log.nfcb")])
+    assert summary == log_analytics.analyze([str(tmp_path / "log.jsonl"), str(tmp_path / "log.json")])
@@ -0,0 +1,45 @@
+import io
+import threading
+
+from output_redirect import OutputChannel
+
+
+class SlowStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.release.wait()
+        return super().write(data)
+
+
+def test_text_is_never_dropped():
+    stream = SlowStream()
+    channel = OutputChannel(stream, max_pending=16, linger=0)
+    worker = threading.Thread(target=channel.run)
+    worker.start()
+    lines = ["line {}\n".format(i) for i in range(200)]
+    writer = threading.Thread(target=lambda: [channel.write(line) for line in lines])
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive() # backed up behind the stalled console
+    assert channel._pending <= 16
+    stream.release.set()
+    writer.join()
+    channel.close()
+    worker.join()
+    assert stream.getvalue() == "".join(lines)
+    assert channel.blocked > 0
+
+
+def test_only_progress_marks_are_evicted():
+    channel = OutputChannel(io.StringIO(), max_progress=10)
+    channel.write("start\n")
+    for _ in range(100):
+        channel.progress(".")
+    channel.write("end\n")
+    assert channel._progress == 10
+    assert channel.dropped_progress == 90
+    with channel._lock:
+        assert channel._take() == "start\n" + "." * 10 + "end\n"
@@ -0,0 +1,39 @@
+import os
+
+from libnfc_ffi import libnfc_sim
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+from nfc_helper import FrameDirection
+from relay_scheduler import RelayScheduler
+
+SELECT = bytes.fromhex("00a4040000")
+GET_DATA = bytes.fromhex("80ca9f1700")
+
+
+def test_pair_relay_gets_the_relay_options(tmp_path):
+    rules_fname = str(tmp_path / "rules.json")
+    with open(rules_fname, "w") as f:
+        f.write('[{"direction": "FromCard", "pattern": "9F 17", "action": "patch", "offset": 1, "data": "36"}]')
+    observed = []
+    reader = VirtualReader([SELECT, GET_DATA])
+    card = VirtualCard({SELECT: bytes.fromhex("9000"), GET_DATA: bytes.fromhex("9f1701039000")})
+    libnfc_sim.configure(devices=[libnfc_sim.SimDevice("sim:emulator", reader=reader),
+                                  libnfc_sim.SimDevice("sim:reader", card=card)])
+    try:
+        scheduler = RelayScheduler()
+        log_fname = str(tmp_path / "pair0.json")
+        scheduler.add_pair(1, 0, log_fname=log_fname, data_hook=lambda direction, data, easy_framing: (False, data),
+                           hook_deadline_ms=1000, rules=rules_fname,
+                           observers=[lambda direction, data, easy_framing: observed.append(direction)],
+                           wtx_enabled=False, fsci=8, max_frames=2)
+        scheduler.start()
+        scheduler.join(5)
+    finally:
+        libnfc_sim.configure()
+    result = scheduler.results()[0]
+    assert result.error is None
+    assert reader.responses == [bytes.fromhex("9000"), bytes.fromhex("9f3601039000")]
+    relay = scheduler.sessions[0].relay
+    assert (relay.fsci, relay.wtx_enabled) == (8, False)
+    assert relay.fl.max_frames == 2 and len(relay.fl.frame_list) <= 2
+    assert observed.count(FrameDirection.FromReader) == 2
+    assert os.path.exists(log_fname)
@@ -0,0 +1,46 @@
+from nfc_helper import FrameLogger, FrameDirection, EmulatedInitiator
+
+SELECT = bytes.fromhex("00a4040000")
+GET_CHALLENGE = bytes.fromhex("0084000008")
+READ_RECORD = bytes.fromhex("00b2010c00")
+
+
+def record(fname, *sessions):
+    """Log of (request, response) sessions as relay_frames() writes them, indexes start over per session"""
+    fl = FrameLogger()
+    for session in sessions:
+        for n, (request, response) in enumerate(session):
+            fl.add_frame_by_data(2 * n, 0.0, request, len(request), FrameDirection.FromReader)
+            fl.add_frame_by_data(2 * n, 0.0, request, len(request), FrameDirection.ToCard)
+            fl.add_frame_by_data(2 * n + 1, 0.0, response, len(response), FrameDirection.FromCard)
+            fl.add_frame_by_data(2 * n + 1, 0.0, response, len(response), FrameDirection.ToReader)
+    fl.save_to(fname)
+
+
+def test_replay_follows_the_recorded_order(tmp_path):
+    fname = str(tmp_path / "log.json")
+    record(fname, [(SELECT, bytes.fromhex("9000")),
+                   (GET_CHALLENGE, bytes.fromhex("11111111111111119000")),
+                   (GET_CHALLENGE, bytes.fromhex("22222222222222229000")),
+                   (READ_RECORD, bytes.fromhex("70009000"))])
+    e = EmulatedInitiator()
+    e.load_from(fname)
+    for _ in range(2): # a new session starts over at the root
+        assert bytes(e.transceive_bytes(SELECT)[0]) == bytes.fromhex("9000")
+        assert bytes(e.transceive_bytes(GET_CHALLENGE)[0]) == bytes.fromhex("11111111111111119000")
+        assert bytes(e.transceive_bytes(GET_CHALLENGE)[0]) == bytes.fromhex("22222222222222229000")
+        assert bytes(e.transceive_bytes(READ_RECORD)[0]) == bytes.fromhex("70009000")
+    assert e.conversation.matches['path'] == 7 and e.conversation.matches['restart'] == 1
+
+
+def test_replay_falls_back_to_the_header(tmp_path):
+    fname = str(tmp_path / "log.json")
+    select_aid = bytes.fromhex("00a4040007a000000004101000")
+    record(fname, [(SELECT, bytes.fromhex("9000")), (select_aid, bytes.fromhex("6f0084009000"))])
+    e = EmulatedInitiator()
+    e.load_from(fname)
+    e.transceive_bytes(SELECT)
+    # another AID of the same length: same CLA INS P1 P2 Lc, the recorded answer
+    assert bytes(e.transceive_bytes(bytes.fromhex("00a4040007a000000003101000"))[0]) == bytes.fromhex("6f0084009000")
+    assert e.conversation.matches['header'] == 1
+    assert e.transceive_bytes(bytes.fromhex("80ca9f1700")) == (b'', 0)
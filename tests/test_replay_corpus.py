@@ -0,0 +1,53 @@
+import os
+import json
+
+from nfc_helper import EmulatedInitiator
+from replay_corpus import ReplayCorpus, INDEX_FNAME
+from test_replay import record, SELECT, GET_CHALLENGE, READ_RECORD
+
+
+def make_captures(path):
+    record(str(path / "a.json"), [(SELECT, bytes.fromhex("9000")), (GET_CHALLENGE, bytes.fromhex("11111111111111119000"))])
+    record(str(path / "b.json"), [(SELECT, bytes.fromhex("9000")), (READ_RECORD, bytes.fromhex("70009000"))])
+
+
+def test_index_is_cached_and_invalidated(tmp_path):
+    make_captures(tmp_path)
+    corpus = ReplayCorpus(str(tmp_path))
+    assert not corpus.load()
+    assert corpus.exchanges == 4 and corpus.responses == 3
+    with open(os.path.join(str(tmp_path), INDEX_FNAME)) as f:
+        assert json.load(f)['version'] # plain data
+
+    cached = ReplayCorpus(str(tmp_path))
+    assert cached.load()
+    assert cached.exchanges == 4 and len(cached.sources) == 2
+    assert {h: bytes(r.data) for h, r in cached.resp_by_req.items()} == {h: bytes(r.data) for h, r in corpus.resp_by_req.items()}
+
+    record(str(tmp_path / "c.json"), [(READ_RECORD, bytes.fromhex("70019000"))])
+    added = ReplayCorpus(str(tmp_path))
+    assert not added.load() # a new log rebuilds the index
+    assert added.exchanges == 5 and len(added.sources) == 3
+
+    os.remove(str(tmp_path / "c.json"))
+    assert not ReplayCorpus(str(tmp_path)).load()
+    assert ReplayCorpus(str(tmp_path)).load()
+
+
+def test_broken_index_is_rebuilt(tmp_path):
+    make_captures(tmp_path)
+    ReplayCorpus(str(tmp_path)).load()
+    with open(os.path.join(str(tmp_path), INDEX_FNAME), "w") as f:
+        f.write('{"version": 2, "sources": {}')
+    assert not ReplayCorpus(str(tmp_path)).load()
+
+
+def test_replay_from_the_loaded_index(tmp_path):
+    make_captures(tmp_path)
+    ReplayCorpus(str(tmp_path)).load()
+    e = EmulatedInitiator()
+    e.load_from(str(tmp_path))
+    assert bytes(e.transceive_bytes(SELECT)[0]) == bytes.fromhex("9000")
+    assert bytes(e.transceive_bytes(READ_RECORD)[0]) == bytes.fromhex("70009000")
+    assert e.conversation.matches['path'] == 2
+    assert bytes(e.transceive_bytes(GET_CHALLENGE)[0]) == bytes.fromhex("11111111111111119000")
@@ -0,0 +1,34 @@
+from libnfc_ffi import libnfc_sim
+from libnfc_ffi.libnfc_sim import VirtualReader, VirtualCard
+
+SELECT = bytes.fromhex("00a4040000")
+
+
+def slow_card(ms):
+    # keeps the configured devices, the card transceive takes ms
+    libnfc_sim.configure(devices=libnfc_sim.libnfc.devices, latency_ms={"nfc_initiator_transceive_bytes": ms})
+
+
+def test_slow_card_gets_wtx_keep_alive_in_raw_framing(sim_relay):
+    reader = VirtualReader([b"\x02" + SELECT, b"\x03" + SELECT])
+    card = VirtualCard({SELECT: bytes.fromhex("6f009000")})
+    r = sim_relay(reader, card, easy_framing=False)
+    assert 150 < r.fwt_ms < 160 # FWI 9 in the emulated ATS
+    slow_card(250)
+    r.relay_frames()
+    assert reader.wtx_requests == 2 # one per exchange, answered by the reader
+    assert reader.responses == [bytes.fromhex("026f009000"), bytes.fromhex("036f009000")]
+    assert r.stats.counters['wtx_exchanges'] == 2
+    assert r.stats.counters.get('fwt_exceeded', 0) == 0
+
+
+def test_no_wtx_when_disabled(sim_relay):
+    reader = VirtualReader([b"\x02" + SELECT])
+    card = VirtualCard({SELECT: bytes.fromhex("6f009000")})
+    r = sim_relay(reader, card, easy_framing=False)
+    r.wtx_enabled = False
+    slow_card(250)
+    r.relay_frames()
+    assert reader.wtx_requests == 0
+    assert reader.responses == [bytes.fromhex("026f009000")]
+    assert r.stats.counters['fwt_exceeded'] == 1